@@ -0,0 +1,58 @@
+# WorkflowAI Stats Aggregator
+"""
+Write-behind aggregation of per-user usage counters.
+
+Task completions add increments in memory; a background loop coalesces them
+per user and applies them with one ``increment_user_stats`` RPC every
+``flush_interval`` seconds (or sooner once ``max_pending`` users are
+waiting). Increments still buffered when a process dies hard are lost; a
+graceful stop flushes them.
+"""
+
+import logging
+import os
+from typing import Dict, List
+
+from writebehind import PeriodicFlusher, lock_order
+
+logger = logging.getLogger(__name__)
+
+USER_STATS_FLUSH_INTERVAL = float(os.getenv("USER_STATS_FLUSH_INTERVAL", "5"))  # seconds
+USER_STATS_MAX_PENDING = int(os.getenv("USER_STATS_MAX_PENDING", "500"))  # users per flush
+
+
+class UserStatsAggregator(PeriodicFlusher):
+    """Coalesces total_tasks_completed / total_credits_used increments."""
+
+    def __init__(
+        self,
+        db,
+        flush_interval: float = USER_STATS_FLUSH_INTERVAL,
+        max_pending: int = USER_STATS_MAX_PENDING
+    ):
+        super().__init__(flush_interval)
+        self.db = db
+        self.max_pending = max_pending
+        self._pending: Dict[str, Dict[str, int]] = {}
+
+    def add(self, user_id: str, tasks_completed: int = 0, credits_used: int = 0) -> None:
+        delta = self._pending.setdefault(user_id, {'tasks_completed': 0, 'credits_used': 0})
+        delta['tasks_completed'] += tasks_completed
+        delta['credits_used'] += credits_used
+        if len(self._pending) >= self.max_pending:
+            self.flush_soon()
+
+    async def flush(self) -> None:
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, {}
+        deltas: List[dict] = [
+            {'user_id': user_id, **delta} for user_id, delta in lock_order(pending.items())
+        ]
+        try:
+            await self.db.increment_user_stats(deltas)
+        except Exception as e:
+            logger.error(f"Error flushing user stats ({len(deltas)} users): {str(e)}")
+            # Merge back so the increments go out with the next flush
+            for user_id, delta in pending.items():
+                self.add(user_id, **delta)
@@ -0,0 +1,190 @@
+# WorkflowAI Usage & Audit Logging
+"""
+Write-behind buffers for the ``usage_tracking`` and ``audit_logs`` tables.
+
+Request handlers and task workers only append rows in memory; a background
+loop writes them with one multi-row insert per ``batch_size`` rows, every
+``flush_interval`` seconds or as soon as a batch is full. A buffer holds at
+most ``max_buffered`` rows: while the database is unreachable the oldest
+rows are dropped (and counted) rather than growing without bound. A graceful
+stop flushes what is left; rows buffered when a process dies hard are lost.
+
+When a batch fails, it is inserted in halves down to the rows that fail on
+their own, so one bad row does not hold back the others. Such a row is kept
+for AUDIT_MAX_ROW_ATTEMPTS flushes, then logged and dropped. If no part of
+the batch can be written the database is taken to be unreachable: the batch
+stays buffered as a whole and no row is charged an attempt.
+"""
+
+import json
+import logging
+import os
+from collections import deque
+from datetime import datetime, timezone
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional
+
+from metrics import WRITE_BEHIND_DROPPED, WRITE_BEHIND_REJECTED
+from writebehind import PeriodicFlusher
+
+logger = logging.getLogger(__name__)
+
+AUDIT_FLUSH_INTERVAL = float(os.getenv("AUDIT_FLUSH_INTERVAL", "2"))  # seconds
+AUDIT_BATCH_SIZE = int(os.getenv("AUDIT_BATCH_SIZE", "500"))  # rows per insert
+AUDIT_MAX_BUFFERED = int(os.getenv("AUDIT_MAX_BUFFERED", "50000"))  # rows per table and process
+AUDIT_MAX_ROW_ATTEMPTS = int(os.getenv("AUDIT_MAX_ROW_ATTEMPTS", "3"))  # flushes a rejected row is kept for
+
+
+class BufferedWriter(PeriodicFlusher):
+    """Batches rows of one table into multi-row inserts."""
+
+    def __init__(
+        self,
+        table: str,
+        insert: Callable[[List[Dict[str, Any]]], Awaitable[None]],
+        batch_size: int = AUDIT_BATCH_SIZE,
+        flush_interval: float = AUDIT_FLUSH_INTERVAL,
+        max_buffered: int = AUDIT_MAX_BUFFERED,
+        max_row_attempts: int = AUDIT_MAX_ROW_ATTEMPTS
+    ):
+        super().__init__(flush_interval)
+        self.table = table
+        self.insert = insert
+        self.batch_size = batch_size
+        self.max_buffered = max_buffered
+        self.max_row_attempts = max_row_attempts
+        self._rows: Deque[Dict[str, Any]] = deque()
+        self._attempts: Dict[int, int] = {}  # id(row) -> failed flushes of rows that failed alone
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def add(self, row: Dict[str, Any]) -> None:
+        self._rows.append(row)
+        self._trim()
+        if len(self._rows) >= self.batch_size:
+            self.flush_soon()
+
+    def _trim(self) -> None:
+        overflow = len(self._rows) - self.max_buffered
+        if overflow > 0:
+            for _ in range(overflow):
+                self._attempts.pop(id(self._rows.popleft()), None)
+            WRITE_BEHIND_DROPPED.labels(table=self.table).inc(overflow)
+            logger.warning(f"{self.table} buffer full; dropped {overflow} oldest rows")
+
+    async def flush(self) -> None:
+        """Write all buffered rows; rows that could not be written stay buffered."""
+        held = []  # rejected rows, retried on the next flush
+        try:
+            while self._rows:
+                batch = [self._rows.popleft() for _ in range(min(self.batch_size, len(self._rows)))]
+                try:
+                    await self.insert(batch)
+                    self._forget(batch)
+                    continue
+                except Exception as e:
+                    logger.error(f"Error writing {len(batch)} {self.table} rows: {str(e)}")
+                except BaseException:
+                    self._requeue(batch)
+                    raise
+                rejected = await self._split(batch)
+                if rejected is None:
+                    self._requeue(batch)
+                    return
+                for row in rejected:
+                    attempts = self._attempts.pop(id(row), 0) + 1
+                    if attempts < self.max_row_attempts:
+                        self._attempts[id(row)] = attempts
+                        held.append(row)
+                    else:
+                        WRITE_BEHIND_REJECTED.labels(table=self.table).inc()
+                        logger.error(f"Dropping {self.table} row rejected {attempts} times: {json.dumps(row, default=str)}")
+        finally:
+            self._requeue(held)
+
+    async def _split(self, batch: List[Dict[str, Any]]) -> Optional[List[Dict[str, Any]]]:
+        """Insert a failed batch in halves; the rows that fail alone, None if nothing could be written."""
+        written = False
+        rejected = []
+        half = len(batch) // 2
+        parts = [batch[half:], batch[:half]] if half else [batch]  # a stack, first half on top
+        while parts:
+            part = parts.pop()
+            try:
+                await self.insert(part)
+                self._forget(part)
+                written = True
+                continue
+            except Exception:
+                pass
+            except BaseException:
+                # Cancelled: keep what wasn't written, in order
+                self._requeue(rejected + part + [row for rest in reversed(parts) for row in rest])
+                raise
+            if len(part) > 1:
+                half = len(part) // 2
+                parts += [part[half:], part[:half]]
+                continue
+            rejected.append(part[0])
+            if not written and len(rejected) > 1:
+                # Rows failing one by one and none succeeding: the database, not the rows
+                return None
+        return rejected if written else None
+
+    def _requeue(self, rows: List[Dict[str, Any]]) -> None:
+        # In front, in order, for the next flush
+        self._rows.extendleft(reversed(rows))
+        self._trim()
+
+    def _forget(self, rows: List[Dict[str, Any]]) -> None:
+        for row in rows:
+            self._attempts.pop(id(row), None)
+
+
+class UsageLog(BufferedWriter):
+    """Billable usage (``usage_tracking`` rows)."""
+
+    def __init__(self, db, **kwargs):
+        super().__init__('usage_tracking', lambda rows: db.create_usage_records(rows), **kwargs)
+
+    def record(self, user_id: str, team_id: Optional[str], resource_type: str, quantity: int = 1, credits: int = 1) -> None:
+        now = datetime.now(timezone.utc)
+        self.add({
+            "user_id": user_id,
+            "team_id": team_id,
+            "resource_type": resource_type,
+            "quantity": quantity,
+            "credits_consumed": credits,
+            "month_year": now.strftime("%Y-%m"),
+            "created_at": now.isoformat()
+        })
+
+
+class AuditLog(BufferedWriter):
+    """Security-relevant actions (``audit_logs`` rows)."""
+
+    def __init__(self, db, **kwargs):
+        super().__init__('audit_logs', lambda rows: db.create_audit_logs(rows), **kwargs)
+
+    def record(
+        self,
+        action: str,
+        user_id: Optional[str],
+        team_id: Optional[str] = None,
+        resource_type: Optional[str] = None,
+        resource_id: Optional[str] = None,
+        request=None,
+        metadata: Optional[Dict[str, Any]] = None
+    ) -> None:
+        # Every row has the same keys: PostgREST takes the columns of a bulk insert from the first row
+        self.add({
+            "user_id": user_id,
+            "team_id": team_id,
+            "action": action,
+            "resource_type": resource_type,
+            "resource_id": resource_id,
+            "ip_address": request.client.host if request is not None and request.client else None,
+            "user_agent": request.headers.get('user-agent') if request is not None else None,
+            "metadata": metadata,
+            "created_at": datetime.now(timezone.utc).isoformat()
+        })
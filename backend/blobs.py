@@ -0,0 +1,187 @@
+# WorkflowAI Blob Store
+"""
+Content-addressed storage for generated files (images).
+
+Blobs are identified by the SHA-256 of their bytes, so storing the same
+image twice keeps one copy and a blob's URL never changes meaning. Results
+point at ``/blobs/<sha256>`` on this API instead of a provider CDN URL that
+expires.
+
+``BlobStore`` is the backend interface; BLOB_BACKEND selects one:
+- ``local`` (default): files under BLOB_DIR, fanned out by hash prefix. The
+  API server and the workers must share that directory (same host or a
+  shared volume).
+
+An S3-compatible backend plugs in by implementing put, stat, read and delete.
+"""
+
+import hashlib
+import os
+import re
+import uuid
+from dataclasses import dataclass
+from typing import AsyncIterator, Optional
+
+import aiofiles
+import aiofiles.os
+
+BLOB_BACKEND = os.getenv("BLOB_BACKEND", "local").lower()
+BLOB_DIR = os.getenv("BLOB_DIR", "blobs")
+BLOB_MAX_SIZE = int(os.getenv("BLOB_MAX_SIZE", str(50 * 1024 * 1024)))  # bytes
+BLOB_PUBLIC_URL = os.getenv("BLOB_PUBLIC_URL", "").rstrip("/")  # prefix of /blobs/... in results; '' = relative
+BLOB_CHUNK_SIZE = 64 * 1024
+
+DIGEST_PATTERN = re.compile(r"^[0-9a-f]{64}$")
+
+_SIGNATURES = [
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+]
+
+
+class BlobTooLarge(Exception):
+    """The blob exceeded BLOB_MAX_SIZE while being stored."""
+
+
+@dataclass(frozen=True)
+class BlobInfo:
+    digest: str  # SHA-256 hex
+    size: int
+    content_type: str
+
+    @property
+    def etag(self) -> str:
+        return f'"{self.digest}"'
+
+
+def sniff_content_type(head: bytes) -> str:
+    for signature, content_type in _SIGNATURES:
+        if head.startswith(signature):
+            return content_type
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    return "application/octet-stream"
+
+
+def blob_url(digest: str) -> str:
+    return f"{BLOB_PUBLIC_URL}/blobs/{digest}"
+
+
+class BlobStore:
+    """Content-addressed blob backend."""
+
+    async def put(self, chunks: AsyncIterator[bytes], max_size: int = BLOB_MAX_SIZE) -> BlobInfo:
+        """Store a stream of bytes (without buffering it whole); returns where it went."""
+        raise NotImplementedError
+
+    async def put_bytes(self, data: bytes) -> BlobInfo:
+        async def chunks():
+            yield data
+        return await self.put(chunks(), max_size=max(len(data), BLOB_MAX_SIZE))
+
+    async def stat(self, digest: str) -> Optional[BlobInfo]:
+        raise NotImplementedError
+
+    def read(self, digest: str, start: int = 0, end: Optional[int] = None) -> AsyncIterator[bytes]:
+        """Bytes ``start``..``end`` (inclusive) of a blob, in chunks."""
+        raise NotImplementedError
+
+    async def delete(self, digest: str) -> None:
+        raise NotImplementedError
+
+
+class LocalBlobStore(BlobStore):
+    """Blobs as files ``<root>/<ab>/<cd>/<sha256>``."""
+
+    def __init__(self, root: str = BLOB_DIR):
+        self.root = root
+
+    def path(self, digest: str) -> str:
+        return os.path.join(self.root, digest[:2], digest[2:4], digest)
+
+    async def put(self, chunks: AsyncIterator[bytes], max_size: int = BLOB_MAX_SIZE) -> BlobInfo:
+        tmp_dir = os.path.join(self.root, "tmp")
+        await aiofiles.os.makedirs(tmp_dir, exist_ok=True)
+        tmp_path = os.path.join(tmp_dir, uuid.uuid4().hex)
+        sha256 = hashlib.sha256()
+        size = 0
+        head = b""
+        try:
+            async with aiofiles.open(tmp_path, "wb") as f:
+                async for chunk in chunks:
+                    size += len(chunk)
+                    if size > max_size:
+                        raise BlobTooLarge(f"Blob larger than {max_size} bytes")
+                    if len(head) < 16:
+                        head += chunk[:16]
+                    sha256.update(chunk)
+                    await f.write(chunk)
+            digest = sha256.hexdigest()
+            path = self.path(digest)
+            if await aiofiles.os.path.exists(path):
+                # Already stored: identical content, keep the existing file
+                await aiofiles.os.remove(tmp_path)
+            else:
+                await aiofiles.os.makedirs(os.path.dirname(path), exist_ok=True)
+                await aiofiles.os.replace(tmp_path, path)
+        except BaseException:
+            if await aiofiles.os.path.exists(tmp_path):
+                await aiofiles.os.remove(tmp_path)
+            raise
+        return BlobInfo(digest, size, sniff_content_type(head))
+
+    async def stat(self, digest: str) -> Optional[BlobInfo]:
+        if not DIGEST_PATTERN.match(digest):
+            return None
+        path = self.path(digest)
+        try:
+            size = (await aiofiles.os.stat(path)).st_size
+            async with aiofiles.open(path, "rb") as f:
+                head = await f.read(16)
+        except FileNotFoundError:
+            return None
+        return BlobInfo(digest, size, sniff_content_type(head))
+
+    async def read(self, digest: str, start: int = 0, end: Optional[int] = None) -> AsyncIterator[bytes]:
+        async with aiofiles.open(self.path(digest), "rb") as f:
+            await f.seek(start)
+            remaining = None if end is None else end - start + 1
+            while remaining is None or remaining > 0:
+                chunk = await f.read(BLOB_CHUNK_SIZE if remaining is None else min(BLOB_CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                if remaining is not None:
+                    remaining -= len(chunk)
+                yield chunk
+
+    async def delete(self, digest: str) -> None:
+        try:
+            await aiofiles.os.remove(self.path(digest))
+        except FileNotFoundError:
+            pass
+
+
+def create_blob_store() -> BlobStore:
+    if BLOB_BACKEND == "local":
+        return LocalBlobStore()
+    raise ValueError(f"Unknown BLOB_BACKEND: {BLOB_BACKEND}")
+
+
+def parse_range(header: Optional[str], size: int):
+    """(start, end) of a single ``bytes=`` range, None for no/unsupported range, ValueError if unsatisfiable."""
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    first, _, last = header[len("bytes="):].strip().partition("-")
+    try:
+        if first:
+            start = int(first)
+            end = min(int(last), size - 1) if last else size - 1
+        else:
+            start, end = max(size - int(last), 0), size - 1  # suffix: last N bytes
+    except ValueError:
+        return None
+    if start >= size or start > end:
+        raise ValueError("Range not satisfiable")
+    return start, end
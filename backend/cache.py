@@ -0,0 +1,61 @@
+# WorkflowAI In-Process Caches
+"""
+Small in-process caches for hot lookups.
+
+``TTLCache`` is a size-bounded LRU whose entries expire after a TTL. It is
+not shared between processes, so every API worker keeps its own copy and
+explicit invalidation only reaches the process that receives it; keep TTLs
+short for data that can change elsewhere.
+"""
+
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+
+from metrics import CACHE_EVICTIONS, CACHE_REQUESTS
+
+_MISSING = object()
+
+
+class TTLCache:
+    """LRU cache with per-entry expiry; hits, misses and evictions are exported as metrics."""
+
+    def __init__(self, name: str, maxsize: int, ttl: float):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._requests = {hit: CACHE_REQUESTS.labels(cache=name, result="hit" if hit else "miss") for hit in (True, False)}
+        self._evictions = CACHE_EVICTIONS.labels(cache=name)
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        entry = self._data.get(key, _MISSING)
+        if entry is not _MISSING:
+            value, expires_at = entry
+            if expires_at > time.monotonic():
+                self._data.move_to_end(key)
+                self._record(hit=True)
+                return value
+            del self._data[key]
+        self._record(hit=False)
+        return default
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        """Store ``value``; ``ttl`` overrides the cache default for this entry."""
+        self._data[key] = (value, time.monotonic() + (self.ttl if ttl is None else ttl))
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self._evictions.inc()
+
+    def invalidate(self, key: Hashable) -> bool:
+        return self._data.pop(key, _MISSING) is not _MISSING
+
+    def clear(self) -> None:
+        self._data.clear()
+
+    def _record(self, hit: bool) -> None:
+        self._requests[hit].inc()
@@ -0,0 +1,107 @@
+# WorkflowAI Task Coalescing
+"""
+Single-flight execution of identical generations.
+
+Tasks with the same prompt hash (see result_cache.generation_key) that are
+processed at the same time share one provider call: the first becomes the
+leader, later ones attach as followers. Followers receive the leader's
+output in their own task stream as it is generated (including whatever was
+streamed before they attached) and the leader's result when it completes.
+
+If the leader fails, its own task fails and the first follower takes over
+with a fresh provider call; the remaining followers attach to it instead.
+
+The claim RPC hands pending duplicates of a claimed task to the same worker,
+so coalescing within one process covers tasks submitted together.
+"""
+
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from metrics import TASK_COALESCING
+
+logger = logging.getLogger(__name__)
+
+
+class TeeStream:
+    """Writes a leader's output to its own task stream and its followers' streams."""
+
+    def __init__(self, leader):
+        self._writers = [leader]
+        self._chunks: List[str] = []
+
+    async def write(self, text: str) -> None:
+        if not text:
+            return
+        self._chunks.append(text)
+        for writer in list(self._writers):
+            await writer.write(text)
+
+    async def attach(self, writer) -> None:
+        # Catch the follower up on what was generated before it joined
+        self._writers.append(writer)
+        await writer.write(''.join(self._chunks))
+
+    def detach(self, writer) -> None:
+        if writer in self._writers:
+            self._writers.remove(writer)
+
+
+class _Flight:
+    def __init__(self, leader_id: str, stream: TeeStream):
+        self.leader_id = leader_id
+        self.stream = stream
+        self.result: Optional[Dict[str, Any]] = None
+        self.done = asyncio.Event()
+
+
+class TaskCoalescer:
+    """Deduplicates concurrent generations with the same key in this process."""
+
+    def __init__(self):
+        self._flights: Dict[str, _Flight] = {}
+
+    def __len__(self) -> int:
+        return len(self._flights)
+
+    async def run(
+        self,
+        key: str,
+        task_id: str,
+        stream,
+        generate: Callable[[TeeStream], Awaitable[Dict[str, Any]]]
+    ) -> Tuple[Dict[str, Any], Optional[str]]:
+        """Result of the generation for ``key`` and the id of the task that led it.
+
+        The leader id is None when this task ran the generation itself.
+        ``generate`` is only called by the leader, with a stream that fans out
+        to every follower.
+        """
+        while True:
+            flight = self._flights.get(key)
+            if flight is None:
+                flight = _Flight(task_id, TeeStream(stream))
+                self._flights[key] = flight
+                try:
+                    flight.result = await generate(flight.stream)
+                    return flight.result, None
+                finally:
+                    # Cleared before waking followers, so the first of them to
+                    # run finds no flight and takes over if this one failed
+                    del self._flights[key]
+                    flight.done.set()
+
+            TASK_COALESCING.labels(event='joined').inc()
+            await flight.stream.attach(stream)
+            try:
+                await flight.done.wait()
+            finally:
+                flight.stream.detach(stream)
+            if flight.result is not None:
+                return flight.result, flight.leader_id
+
+            # Leader failed: drop its partial output and lead (or follow) the retry
+            logger.warning(f"Leader task {flight.leader_id} failed; task {task_id} retries its generation")
+            TASK_COALESCING.labels(event='failover').inc()
+            await stream.reset()
@@ -0,0 +1,181 @@
+# WorkflowAI Image Derivatives
+"""
+Resized and re-encoded copies of generated images: platform sizes (the
+presets of design_server's optimize_for_platform) and icon sizes.
+
+Rendering is CPU-bound, so it runs in a process pool (DERIVATIVE_PROCESSES
+spawned processes) and never on the event loop. Each render opens the source
+once and builds a 2x downscale pyramid; every size is resampled (Lanczos,
+center crop to the target aspect) from the smallest pyramid level that is
+still at least as large as it needs, not from the full original.
+
+Outputs are stored in the blob store. ``blob_derivatives`` maps
+(source SHA-256, name, format) to the output blob, so a source that was
+rendered before (same image from the result cache, or a retried task) only
+renders the sizes it is missing.
+"""
+
+import asyncio
+import io
+import logging
+import math
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+from PIL import Image, ImageOps
+
+logger = logging.getLogger(__name__)
+
+DERIVATIVE_PROCESSES = int(os.getenv("DERIVATIVE_PROCESSES", "2"))
+DERIVATIVE_JPEG_QUALITY = int(os.getenv("DERIVATIVE_JPEG_QUALITY", "88"))
+DERIVATIVE_WEBP_QUALITY = int(os.getenv("DERIVATIVE_WEBP_QUALITY", "85"))
+
+PLATFORM_SIZES = {
+    'instagram_post': (1080, 1080),
+    'instagram_story': (1080, 1920),
+    'facebook_post': (1200, 630),
+    'facebook_cover': (851, 315),
+    'twitter_post': (1200, 675),
+    'twitter_header': (1500, 500),
+    'linkedin_post': (1200, 627),
+    'linkedin_cover': (1584, 396),
+}
+ICON_SIZES = (16, 32, 64, 128, 256, 512, 1024)
+SIZES = {**PLATFORM_SIZES, **{f"icon_{size}": (size, size) for size in ICON_SIZES}}
+FORMATS = {'png': "PNG", 'webp': "WEBP", 'jpeg': "JPEG"}
+CONTENT_TYPES = {'png': "image/png", 'webp': "image/webp", 'jpeg': "image/jpeg"}
+
+# Rendered for a category when the task's input_data doesn't ask for derivatives
+DEFAULT_DERIVATIVES = {
+    'logo_design': {"sizes": [f"icon_{size}" for size in ICON_SIZES], "formats": ["png"]},
+}
+
+Spec = Tuple[str, str]  # (size name, format)
+
+
+def _names(value: Any, field: str) -> List[str]:
+    if isinstance(value, str):
+        return [value]
+    if not isinstance(value, list) or not all(isinstance(item, str) for item in value):
+        raise ValueError(f"derivatives.{field} must be a name or a list of names")
+    return value
+
+
+def parse_specs(request: Any) -> List[Spec]:
+    """(size, format) pairs of a ``derivatives`` request; ValueError if it is malformed.
+
+    ``{"sizes": ["instagram_post", "icon_64"], "formats": ["png", "webp"]}``;
+    a single name may be given as a string, ``"sizes": "all"`` renders every
+    known size and formats default to png.
+    """
+    if not request:
+        return []
+    if not isinstance(request, dict):
+        raise ValueError("derivatives must be an object with sizes and formats")
+    sizes = _names(request.get('sizes') or [], 'sizes')
+    formats = _names(request.get('formats') or ["png"], 'formats')
+    if sizes == ["all"]:
+        sizes = list(SIZES)
+    unknown = [s for s in sizes if s not in SIZES] + [f for f in formats if f not in FORMATS]
+    if unknown:
+        raise ValueError(f"Unknown derivative sizes/formats: {', '.join(unknown)}")
+    return [(size, fmt) for size in dict.fromkeys(sizes) for fmt in dict.fromkeys(formats)]
+
+
+def requested_specs(task: Dict[str, Any]) -> List[Spec]:
+    """(size, format) pairs a task asks for in input_data.derivatives, or its category's default."""
+    return parse_specs((task.get('input_data') or {}).get('derivatives') or DEFAULT_DERIVATIVES.get(task['category']))
+
+
+def _encode(image: Image.Image, fmt: str) -> bytes:
+    out = io.BytesIO()
+    if fmt == 'jpeg':
+        if image.mode in ("RGBA", "LA"):
+            background = Image.new("RGB", image.size, (255, 255, 255))
+            background.paste(image, mask=image.getchannel("A"))
+            image = background
+        image.convert("RGB").save(out, "JPEG", quality=DERIVATIVE_JPEG_QUALITY, optimize=True, progressive=True)
+    elif fmt == 'webp':
+        image.save(out, "WEBP", quality=DERIVATIVE_WEBP_QUALITY, method=4)
+    else:
+        image.save(out, "PNG")
+    return out.getvalue()
+
+
+def render_derivatives(source: bytes, specs: List[Spec]) -> List[Tuple[str, str, bytes]]:
+    """Render ``specs`` of an encoded image; returns (size name, format, encoded bytes).
+
+    Runs in a pool process, so it only takes and returns picklable values.
+    """
+    with Image.open(io.BytesIO(source)) as opened:
+        original = opened.convert("RGBA" if opened.mode in ("RGBA", "LA", "P", "PA") else "RGB")
+    pyramid = [original]
+    outputs = []
+    # Largest first, so the pyramid grows only as deep as the smallest size needs
+    for name in sorted({name for name, _ in specs}, key=lambda n: SIZES[n][0] * SIZES[n][1], reverse=True):
+        width, height = SIZES[name]
+        scale = max(width / original.width, height / original.height)
+        need = (math.ceil(original.width * scale), math.ceil(original.height * scale))
+        while True:
+            level = pyramid[-1]
+            if level.width // 2 < need[0] or level.height // 2 < need[1]:
+                break
+            pyramid.append(level.reduce(2))
+        # Smallest level that still covers the target
+        base = next(level for level in reversed(pyramid) if level.width >= need[0] and level.height >= need[1]) \
+            if need[0] <= original.width and need[1] <= original.height else original
+        resized = ImageOps.fit(base, (width, height), Image.LANCZOS)
+        for size_name, fmt in specs:
+            if size_name == name:
+                outputs.append((name, fmt, _encode(resized, fmt)))
+    return outputs
+
+
+class DerivativeRenderer:
+    """Renders derivatives of stored images in a process pool, cached by source hash."""
+
+    def __init__(self, db, blob_store, processes: int = DERIVATIVE_PROCESSES):
+        self.db = db
+        self.blob_store = blob_store
+        self.processes = processes
+        self._pool: Optional[ProcessPoolExecutor] = None
+
+    def _executor(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            # Spawned, not forked: the parent runs an event loop and client threads
+            self._pool = ProcessPoolExecutor(self.processes, mp_context=multiprocessing.get_context("spawn"))
+        return self._pool
+
+    def close(self) -> None:
+        if self._pool:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    async def render(self, source_digest: str, specs: List[Spec]) -> List[Dict[str, Any]]:
+        """Derivatives of a blob (rendering only those not cached); rows of ``blob_derivatives``."""
+        if not specs:
+            return []
+        cached = {(row['name'], row['format']): row for row in await self.db.get_blob_derivatives(source_digest)}
+        missing = [spec for spec in specs if spec not in cached]
+        if missing:
+            source = b"".join([chunk async for chunk in self.blob_store.read(source_digest)])
+            loop = asyncio.get_running_loop()
+            rendered = await loop.run_in_executor(self._executor(), render_derivatives, source, missing)
+            rows = []
+            for name, fmt, data in rendered:
+                blob = await self.blob_store.put_bytes(data)
+                width, height = SIZES[name]
+                rows.append({
+                    'source_sha256': source_digest,
+                    'name': name,
+                    'format': fmt,
+                    'width': width,
+                    'height': height,
+                    'sha256': blob.digest,
+                    'size_bytes': blob.size
+                })
+            await self.db.put_blob_derivatives(rows)
+            cached.update({(row['name'], row['format']): row for row in rows})
+        return [cached[spec] for spec in specs]
@@ -0,0 +1,146 @@
+# WorkflowAI Task Duration Estimates
+"""
+Online estimates of how long tasks take, from the durations of finished ones.
+
+Durations are normalized by the size of the task's input (seconds per
+``1 + input characters / ETA_SIZE_UNIT``), then folded into running
+statistics per (type, category, model): an EWMA plus streaming p50/p90
+(stochastic quantile updates, no samples kept). The EWMA gives a task's
+expected duration (the scheduler's cost), the p90 (floored at the p50 and
+the EWMA) an upper bound returned to users. Rows with model ``''``
+aggregate all models; that is what new tasks are estimated from, since
+their route is only chosen when they run.
+
+Workers record samples in memory and apply them in batches with the
+``record_ai_task_durations`` RPC (write-behind, like aggregator.py). Every
+process re-reads ``ai_task_duration_stats`` every ETA_REFRESH_INTERVAL
+seconds, so the API server's estimates follow all workers' samples.
+"""
+
+import json
+import logging
+import math
+import os
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+from writebehind import PeriodicFlusher, lock_order
+
+logger = logging.getLogger(__name__)
+
+ETA_ALPHA = float(os.getenv("ETA_ALPHA", "0.1"))  # EWMA weight of a new sample
+ETA_QUANTILE_RATE = float(os.getenv("ETA_QUANTILE_RATE", "0.05"))  # relative step of the quantile estimates
+ETA_SIZE_UNIT = float(os.getenv("ETA_SIZE_UNIT", "2000"))  # input characters per unit of work
+ETA_FLUSH_INTERVAL = float(os.getenv("ETA_FLUSH_INTERVAL", "10"))  # seconds
+ETA_REFRESH_INTERVAL = float(os.getenv("ETA_REFRESH_INTERVAL", "60"))  # seconds
+
+StatsKey = Tuple[str, str, str]  # (type, category, model)
+
+
+def input_size(task: Dict[str, Any]) -> int:
+    """Characters of prompt material in a task."""
+    input_data = task.get('input_data')
+    return (
+        len(task.get('title') or '')
+        + len(task.get('description') or '')
+        + (len(json.dumps(input_data)) if input_data else 0)
+    )
+
+
+def size_factor(task: Dict[str, Any]) -> float:
+    return 1 + input_size(task) / ETA_SIZE_UNIT
+
+
+@dataclass
+class DurationStats:
+    """Running statistics of size-normalized durations, in seconds."""
+
+    samples: int = 0
+    ewma: float = 0.0
+    p50: float = 0.0
+    p90: float = 0.0
+
+    def update(self, value: float, alpha: float = ETA_ALPHA, rate: float = ETA_QUANTILE_RATE) -> None:
+        # Same arithmetic as record_ai_task_durations in schema.sql
+        if not self.samples:
+            self.ewma = self.p50 = self.p90 = value
+        else:
+            self.ewma += alpha * (value - self.ewma)
+            self.p50 *= 1 + rate * (0.5 - (value < self.p50))
+            self.p90 *= 1 + rate * (0.9 - (value < self.p90))
+        self.samples += 1
+
+
+class DurationEstimator(PeriodicFlusher):
+    """Records task durations and estimates those of new tasks."""
+
+    def __init__(
+        self,
+        db,
+        flush_interval: float = ETA_FLUSH_INTERVAL,
+        refresh_interval: float = ETA_REFRESH_INTERVAL
+    ):
+        super().__init__(flush_interval)
+        self.db = db
+        self.refresh_interval = refresh_interval
+        self.stats: Dict[StatsKey, DurationStats] = {}
+        self._pending: List[Dict[str, Any]] = []
+        self._refreshed_at = 0.0
+
+    def record(self, task: Dict[str, Any], model: Optional[str], seconds: float) -> None:
+        """Add the duration of a finished generation (buffered until the next flush)."""
+        value = seconds / size_factor(task)
+        sample = {'type': task['type'], 'category': task['category'], 'model': model or '', 'value': value}
+        self._pending.append(sample)
+        for key in {(task['type'], task['category'], model or ''), (task['type'], task['category'], '')}:
+            self.stats.setdefault(key, DurationStats()).update(value)
+
+    def _stats(self, task: Dict[str, Any], model: Optional[str]) -> Optional[DurationStats]:
+        stats = self.stats.get((task['type'], task['category'], model or '')) if model else None
+        stats = stats or self.stats.get((task['type'], task['category'], ''))
+        return stats if stats and stats.samples else None
+
+    def estimate(self, task: Dict[str, Any], model: Optional[str] = None) -> Optional[int]:
+        """Expected seconds for ``task`` (on ``model`` if given), or None without history."""
+        stats = self._stats(task, model)
+        return max(1, math.ceil(stats.ewma * size_factor(task))) if stats else None
+
+    def estimate_p90(self, task: Dict[str, Any], model: Optional[str] = None) -> Optional[int]:
+        """Seconds within which 9 in 10 tasks like ``task`` finish, or None without history."""
+        stats = self._stats(task, model)
+        if not stats:
+            return None
+        # The quantile estimates move slowly; never report a bound below the typical duration
+        return max(1, math.ceil(max(stats.p90, stats.p50, stats.ewma) * size_factor(task)))
+
+    async def flush(self) -> None:
+        if not self._pending or not self.db:
+            return
+        pending, self._pending = self._pending, []
+        samples = lock_order(pending, key=lambda s: (s['type'], s['category'], s['model']))
+        try:
+            await self.db.record_task_durations(samples, ETA_ALPHA, ETA_QUANTILE_RATE)
+        except Exception as e:
+            logger.error(f"Error flushing task durations ({len(samples)} samples): {str(e)}")
+            self._pending = pending + self._pending
+
+    async def refresh(self) -> None:
+        """Replace the local statistics with the shared ones."""
+        if not self.db:
+            return
+        try:
+            rows = await self.db.get_task_duration_stats()
+        except Exception as e:
+            logger.error(f"Error loading task duration stats: {str(e)}")
+            return
+        self.stats = {
+            (row['type'], row['category'], row['model']): DurationStats(row['samples'], row['ewma'], row['p50'], row['p90'])
+            for row in rows
+        }
+        self._refreshed_at = time.monotonic()
+
+    async def tick(self) -> None:
+        await self.flush()
+        if time.monotonic() - self._refreshed_at >= self.refresh_interval:
+            await self.refresh()
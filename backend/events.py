@@ -0,0 +1,116 @@
+# WorkflowAI Event Bus
+"""
+Publish/subscribe for task lifecycle events.
+
+Subscribers (e.g. /ws/tasks connections) receive events for a topic such as
+``user:<id>`` through a bounded in-process queue; a slow subscriber loses
+its oldest events instead of holding up publishers.
+
+Without a broker, events only reach subscribers in the publishing process
+(API with EMBEDDED_WORKER). With a RedisBroker, publishers send to Redis and
+each API process keeps a single pattern subscription that it fans out
+locally, however many sockets are open.
+"""
+
+import asyncio
+import json
+import logging
+import os
+from contextlib import asynccontextmanager
+from typing import Any, Callable, Dict, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+EVENT_QUEUE_SIZE = int(os.getenv("EVENT_QUEUE_SIZE", "100"))  # per subscriber
+
+
+class Subscription:
+    """Bounded queue of events for one subscriber."""
+
+    def __init__(self, topic: str, maxsize: int):
+        self.topic = topic
+        self.dropped = 0
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize)
+
+    def put(self, event: Dict[str, Any]) -> None:
+        if self._queue.full():
+            self._queue.get_nowait()
+            self.dropped += 1
+        self._queue.put_nowait(event)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> Dict[str, Any]:
+        return await self._queue.get()
+
+
+class RedisBroker:
+    """Carries events between processes over Redis pub/sub."""
+
+    def __init__(self, redis, prefix: str = "events:"):
+        self.redis = redis
+        self.prefix = prefix
+
+    async def publish(self, topic: str, event: Dict[str, Any]) -> None:
+        await self.redis.publish(self.prefix + topic, json.dumps(event, default=str))
+
+    async def listen(self, deliver: Callable[[str, Dict[str, Any]], None]) -> None:
+        """Deliver every event published by any process until cancelled; reconnects on errors."""
+        while True:
+            pubsub = self.redis.pubsub()
+            try:
+                await pubsub.psubscribe(self.prefix + "*")
+                async for message in pubsub.listen():
+                    if message['type'] != 'pmessage':
+                        continue
+                    deliver(message['channel'][len(self.prefix):], json.loads(message['data']))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Event broker connection lost: {str(e)}")
+                await asyncio.sleep(1)
+            finally:
+                await pubsub.aclose()
+
+
+class EventBus:
+    """Topic-based fan-out to local subscribers, optionally through a broker."""
+
+    def __init__(self, broker: Optional[RedisBroker] = None, queue_size: int = EVENT_QUEUE_SIZE):
+        self.broker = broker
+        self.queue_size = queue_size
+        self._subscribers: Dict[str, Set[Subscription]] = {}
+        self._listener: Optional[asyncio.Task] = None
+
+    async def publish(self, topic: str, event: Dict[str, Any]) -> None:
+        if self.broker:
+            await self.broker.publish(topic, event)
+        else:
+            self._deliver(topic, event)
+
+    def _deliver(self, topic: str, event: Dict[str, Any]) -> None:
+        for subscription in self._subscribers.get(topic, ()):
+            subscription.put(event)
+
+    @asynccontextmanager
+    async def subscribe(self, topic: str):
+        # Only processes that have subscribers listen to the broker (workers just publish)
+        if self.broker and not self._listener:
+            self._listener = asyncio.create_task(self.broker.listen(self._deliver))
+        subscription = Subscription(topic, self.queue_size)
+        self._subscribers.setdefault(topic, set()).add(subscription)
+        try:
+            yield subscription
+        finally:
+            subscribers = self._subscribers.get(topic)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[topic]
+
+    async def close(self) -> None:
+        if self._listener:
+            self._listener.cancel()
+            await asyncio.gather(self._listener, return_exceptions=True)
+            self._listener = None
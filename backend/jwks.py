@@ -0,0 +1,96 @@
+# WorkflowAI JWKS Cache
+"""
+Signing keys for Clerk session tokens.
+
+Keys are loaded from a JWKS document (Clerk's Backend API by default, any
+JWKS URL, or a local file for tests) and kept in memory. The set is
+refreshed after ``ttl`` seconds, and early when a token names a key id we
+don't know yet (key rotation), at most once per ``min_refresh_interval``.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import time
+from typing import Any, Dict, Optional
+
+import httpx
+import jwt
+
+logger = logging.getLogger(__name__)
+
+CLERK_JWKS_URL = os.getenv("CLERK_JWKS_URL", "https://api.clerk.com/v1/jwks")
+CLERK_JWKS_FILE = os.getenv("CLERK_JWKS_FILE")  # local JWKS document, e.g. for tests
+JWKS_TTL = float(os.getenv("JWKS_TTL", "3600"))  # seconds
+JWKS_MIN_REFRESH_INTERVAL = float(os.getenv("JWKS_MIN_REFRESH_INTERVAL", "30"))  # seconds
+
+
+class JWKSCache:
+    """In-memory JWKS with TTL refresh and refresh-on-unknown-kid."""
+
+    def __init__(
+        self,
+        url: Optional[str] = CLERK_JWKS_URL,
+        path: Optional[str] = CLERK_JWKS_FILE,
+        headers: Optional[Dict[str, str]] = None,
+        ttl: float = JWKS_TTL,
+        min_refresh_interval: float = JWKS_MIN_REFRESH_INTERVAL
+    ):
+        self.url = url
+        self.path = path
+        self.headers = headers or {}
+        self.ttl = ttl
+        self.min_refresh_interval = min_refresh_interval
+        self._keys: Dict[str, Any] = {}
+        self._fetched_at = float('-inf')  # last successful load
+        self._attempted_at = float('-inf')  # last load attempt, for rate limiting
+        self._lock = asyncio.Lock()
+
+    def has_key(self, kid: Optional[str]) -> bool:
+        return kid in self._keys
+
+    async def get_key(self, kid: Optional[str]):
+        """Public key for ``kid``, or None if the JWKS doesn't contain it."""
+        now = time.monotonic()
+        stale = now - self._fetched_at > self.ttl or kid not in self._keys
+        if stale and now - self._attempted_at > self.min_refresh_interval:
+            await self.refresh()
+        return self._keys.get(kid)
+
+    async def refresh(self) -> None:
+        async with self._lock:
+            # Another request may have refreshed while we waited for the lock
+            if time.monotonic() - self._attempted_at < self.min_refresh_interval:
+                return
+            self._attempted_at = time.monotonic()
+            try:
+                document = await self._load()
+            except Exception as e:
+                # Keep serving the keys we have; retry after min_refresh_interval
+                logger.error(f"Error fetching JWKS: {str(e)}")
+                return
+
+            keys = {}
+            for jwk in document.get('keys', []):
+                if jwk.get('use', 'sig') != 'sig' or 'kid' not in jwk:
+                    continue
+                try:
+                    keys[jwk['kid']] = jwt.PyJWK(jwk).key
+                except jwt.PyJWKError as e:
+                    logger.warning(f"Skipping unusable JWK {jwk.get('kid')}: {str(e)}")
+
+            rotated = set(self._keys) - set(keys)
+            if rotated:
+                logger.info(f"JWKS rotated out key(s): {', '.join(sorted(rotated))}")
+            self._keys = keys
+            self._fetched_at = time.monotonic()
+
+    async def _load(self) -> Dict[str, Any]:
+        if self.path:
+            with open(self.path) as f:
+                return json.load(f)
+        async with httpx.AsyncClient(timeout=10) as client:
+            response = await client.get(self.url, headers=self.headers)
+            response.raise_for_status()
+            return response.json()
@@ -1,21 +1,46 @@
 # WorkflowAI Backend API Server
-from fastapi import FastAPI, HTTPException, Depends, BackgroundTasks, Request
+from fastapi import FastAPI, HTTPException, Depends, Query, Request, WebSocket
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.middleware.trustedhost import TrustedHostMiddleware
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from fastapi.responses import Response, StreamingResponse
 from contextlib import asynccontextmanager
 import uvicorn
 import os
 from datetime import datetime
 import json
 import asyncio
+import base64
+import hashlib
+import hmac
+import secrets
+import time
+import uuid
 from typing import Optional, List, Dict, Any
-import httpx
-from supabase import create_client, Client
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, ValidationError, field_validator
 import jwt
 from cryptography.hazmat.primitives import serialization
 import logging
+import redis.asyncio as redis
+
+from aggregator import UserStatsAggregator
+from audit import AuditLog, UsageLog
+from blobs import BlobInfo, blob_url, create_blob_store, parse_range
+from cache import TTLCache
+from coalescing import TaskCoalescer
+from derivatives import DerivativeRenderer, parse_specs, requested_specs
+from eta import DurationEstimator
+from events import EventBus, RedisBroker
+from jwks import CLERK_JWKS_URL, JWKSCache
+from metrics import TASK_OUTCOMES, RequestMetricsMiddleware, render_metrics
+from providers import ProviderClients
+from repository import Repository
+from router import ModelRouter
+from result_cache import ResultCache, generation_key
+from streams import StreamEvent, StreamWriter, create_stream_backend
+from task_queue import TaskQueue, TaskWorker, default_worker_id
+from tracing import TRACING_SERVICE_NAME, TracingMiddleware, inject_context, setup_tracing, shutdown_tracing, span, task_span
+from webhooks import WEBHOOK_EVENTS, WebhookDispatcher, WebhookURLError, resolve_webhook_url, webhook_event_data
 
 # Logging setup (must be before any logger usage)
 logging.basicConfig(level=logging.INFO)
@@ -25,10 +50,20 @@ logger = logging.getLogger(__name__)
 SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_SERVICE_KEY = os.getenv("SUPABASE_SERVICE_KEY")
 CLERK_SECRET_KEY = os.getenv("CLERK_SECRET_KEY")
+CLERK_WEBHOOK_SECRET = os.getenv("CLERK_WEBHOOK_SECRET")
+CLERK_JWT_ISSUER = os.getenv("CLERK_JWT_ISSUER")  # e.g. https://clerk.workflowai.dev
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 ANTHROPIC_API_KEY = os.getenv("ANTHROPIC_API_KEY")
 STRIPE_SECRET_KEY = os.getenv("STRIPE_SECRET_KEY")
+REDIS_URL = os.getenv("REDIS_URL")  # shares task streams/events between workers and API pods
 ENVIRONMENT = os.getenv("ENVIRONMENT", "development")
+# Run a task worker inside the API process (development convenience; use worker.py in production)
+EMBEDDED_WORKER = os.getenv("EMBEDDED_WORKER", "false").lower() == "true"
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "30"))  # seconds
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "10000"))
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "10000"))
+TOKEN_CACHE_MAX_TTL = float(os.getenv("TOKEN_CACHE_MAX_TTL", "300"))  # seconds
+MAX_BATCH_SIZE = int(os.getenv("MAX_BATCH_SIZE", "500"))  # tasks per POST /tasks/batch
 
 # Validate required environment variables
 required_vars = {
@@ -44,20 +79,121 @@ if missing_vars:
     if ENVIRONMENT == "production":
         raise ValueError(f"Required environment variables missing: {', '.join(missing_vars)}")
 
-# Initialize Supabase client
+# Initialize database repository (async PostgREST client)
 if SUPABASE_URL and SUPABASE_SERVICE_KEY:
-    supabase: Client = create_client(SUPABASE_URL, SUPABASE_SERVICE_KEY)
+    db: Optional[Repository] = Repository(SUPABASE_URL, SUPABASE_SERVICE_KEY)
 else:
-    supabase = None
-    logger.warning("Supabase client not initialized - missing credentials")
+    db = None
+    logger.warning("Database client not initialized - missing credentials")
+
+# Shared AI provider HTTP clients (started in lifespan / worker startup)
+provider_clients = ProviderClients(OPENAI_API_KEY, ANTHROPIC_API_KEY)
+
+# Write-behind user counters (total_tasks_completed / total_credits_used)
+user_stats = UserStatsAggregator(db)
+
+# Write-behind usage_tracking / audit_logs rows (multi-row inserts off the request path)
+usage_log = UsageLog(db)
+audit_log = AuditLog(db)
+
+# Task lifecycle events to users' webhooks (queued per endpoint, off the task path)
+webhook_dispatcher = WebhookDispatcher(db)
+
+# Optional Redis connection for cross-process streams and events
+redis_client = redis.from_url(REDIS_URL, decode_responses=True) if REDIS_URL else None
+
+# Live task output for /tasks/{task_id}/stream
+task_streams = create_stream_backend(redis_client)
+
+# Task status events for /ws/tasks
+task_events = EventBus(RedisBroker(redis_client) if redis_client else None)
+
+# Task durations: actual ones recorded by workers, estimates for new tasks
+duration_estimator = DurationEstimator(db)
+
+# Generated files, content-addressed (served at /blobs/<sha256>)
+blob_store = create_blob_store()
+
+# Resized copies of generated images, rendered in a process pool
+derivative_renderer = DerivativeRenderer(db, blob_store)
+
+# Results of identical generations, shared across tasks
+result_cache = ResultCache(db)
+
+# Provider/model choice of text generations (latency-aware, with failover)
+model_router = ModelRouter(provider_clients)
+
+# Identical generations running in this process share one provider call
+task_coalescer = TaskCoalescer()
+
+# Model and generation parameters per category (also part of the prompt hash);
+# text categories may be served by an equivalent model, see router.py
+GENERATION_PARAMS = {
+    'blog_post': {"model": "gpt-4", "max_tokens": 2000},
+    'logo_design': {"model": "dall-e-3", "n": 1, "size": "1024x1024", "quality": "hd"},
+    'code_review': {"model": "claude-3-sonnet-20240229", "max_tokens": 1500},
+}
+STREAM_HEARTBEAT = float(os.getenv("STREAM_HEARTBEAT", "15"))  # seconds between SSE keep-alives
+
+def prompt_hash(task: dict) -> Optional[str]:
+    """Key of the generation a task asks for, or None if its category has none"""
+    params = GENERATION_PARAMS.get(task['category'])
+    return generation_key(task, params) if params else None
+
+async def startup(service_name: str = TRACING_SERVICE_NAME):
+    """Start the shared clients and background services of this process"""
+    setup_tracing(service_name)
+    provider_clients.start()
+    user_stats.start()
+    duration_estimator.start()
+    usage_log.start()
+    audit_log.start()
+    webhook_dispatcher.start()
+
+async def shutdown():
+    await user_stats.stop()
+    await duration_estimator.stop()
+    await webhook_dispatcher.stop()
+    derivative_renderer.close()
+    await usage_log.stop()
+    await audit_log.stop()
+    await provider_clients.close()
+    await task_streams.close()
+    await task_events.close()
+    if redis_client:
+        await redis_client.aclose()
+    if db:
+        await db.close()
+    shutdown_tracing()
 
 # Security
 security = HTTPBearer()
 
+# Clerk signing keys; the Backend API JWKS endpoint needs the secret key
+jwks = JWKSCache(
+    headers={"Authorization": f"Bearer {CLERK_SECRET_KEY}"} if CLERK_JWKS_URL.startswith("https://api.clerk.com") else None
+)
+
+# Verified token payloads by token hash, kept until the token expires
+token_cache = TTLCache("tokens", maxsize=TOKEN_CACHE_SIZE, ttl=TOKEN_CACHE_MAX_TTL)
+
+# User rows by clerk_id, so authenticated requests skip the users lookup
+user_cache = TTLCache("users", maxsize=USER_CACHE_SIZE, ttl=USER_CACHE_TTL)
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     logger.info("Starting WorkflowAI Backend Server...")
+    await startup()
+    embedded_worker = None
+    worker_task = None
+    if EMBEDDED_WORKER and db:
+        embedded_worker = TaskWorker(TaskQueue(db, default_worker_id()), process_ai_task)
+        worker_task = asyncio.create_task(embedded_worker.run())
     yield
+    if embedded_worker:
+        embedded_worker.stop()
+        await worker_task
+    await shutdown()
     logger.info("Shutting down WorkflowAI Backend Server...")
 
 app = FastAPI(
@@ -81,15 +217,26 @@ app.add_middleware(
     allowed_hosts=["localhost", "*.workflowai.dev", "api.workflowai.dev"]
 )
 
+app.add_middleware(RequestMetricsMiddleware)
+app.add_middleware(TracingMiddleware)
+
 # Pydantic Models
 class TaskCreate(BaseModel):
-    type: str = Field(..., regex="^(marketing|design|development)$")
+    type: str = Field(..., pattern="^(marketing|design|development)$")
     category: str
     title: str = Field(..., max_length=500)
     description: Optional[str] = None
     input_data: Optional[Dict[str, Any]] = None
-    priority: str = Field(default="normal", regex="^(low|normal|high|urgent)$")
+    priority: str = Field(default="normal", pattern="^(low|normal|high|urgent)$")
     team_id: Optional[str] = None
+    
+    @field_validator('input_data')
+    @classmethod
+    def check_derivatives(cls, input_data):
+        # Rejected here rather than after the image has been generated
+        if input_data:
+            parse_specs(input_data.get('derivatives'))
+        return input_data
 
 class TaskResponse(BaseModel):
     id: str
@@ -102,6 +249,47 @@ class TaskResponse(BaseModel):
     progress: int
     created_at: datetime
     estimated_duration: Optional[int]
+    estimated_duration_p90: Optional[int] = None
+
+class TaskView(BaseModel):
+    """Selected columns of a task (see ?fields=); unselected ones are left out of the response"""
+    id: str
+    user_id: Optional[str] = None
+    team_id: Optional[str] = None
+    type: Optional[str] = None
+    category: Optional[str] = None
+    title: Optional[str] = None
+    description: Optional[str] = None
+    input_data: Optional[Dict[str, Any]] = None
+    status: Optional[str] = None
+    progress: Optional[int] = None
+    priority: Optional[str] = None
+    estimated_duration: Optional[int] = None
+    estimated_duration_p90: Optional[int] = None
+    actual_duration: Optional[int] = None
+    credits_cost: Optional[int] = None
+    mcp_server_used: Optional[str] = None
+    created_at: Optional[datetime] = None
+    started_at: Optional[datetime] = None
+    completed_at: Optional[datetime] = None
+
+# Task columns clients can select with ?fields= (queue bookkeeping stays internal)
+TASK_FIELDS = set(TaskView.model_fields)
+# Default projections: listings skip long text, neither returns input_data unless asked
+TASK_LIST_FIELDS = ['id', 'user_id', 'type', 'category', 'title', 'status', 'progress', 'priority', 'created_at', 'estimated_duration', 'estimated_duration_p90']
+TASK_DETAIL_FIELDS = TASK_LIST_FIELDS + ['team_id', 'description', 'started_at', 'completed_at', 'actual_duration', 'credits_cost']
+
+class TaskPage(BaseModel):
+    tasks: List[TaskView]
+    next_cursor: Optional[str]  # pass as ?cursor= for the next page; None on the last page
+
+class TaskBatchError(BaseModel):
+    index: int
+    errors: List[Dict[str, Any]]
+
+class TaskBatchResponse(BaseModel):
+    ids: List[Optional[str]]  # per submitted item, None where it was rejected
+    errors: List[TaskBatchError]
     
 class UserProfile(BaseModel):
     id: str
@@ -117,36 +305,90 @@ class TeamCreate(BaseModel):
     name: str = Field(..., max_length=200)
     description: Optional[str] = None
 
+class WebhookCreate(BaseModel):
+    url: str = Field(..., max_length=2000)
+    events: List[str]
+    team_id: Optional[str] = None
+
+WEBHOOK_LIST_FIELDS = 'id, team_id, url, events, is_active, last_delivery_at, failure_count, created_at'
+
 # Authentication
 async def verify_token(credentials: HTTPAuthorizationCredentials = Depends(security)):
-    token = credentials.credentials
+    return await decode_token(credentials.credentials)
+
+async def decode_token(token: str) -> dict:
+    # Repeat requests of a session skip signature verification
+    cache_key = hashlib.sha256(token.encode()).hexdigest()
+    cached = token_cache.get(cache_key)
+    if cached and jwks.has_key(cached['kid']):
+        return cached['payload']
+    
     try:
-        # Verify Clerk JWT token
-        # In production, use Clerk's public key to verify
-        payload = jwt.decode(token, CLERK_SECRET_KEY, algorithms=['HS256'])
-        return payload
+        # Verify Clerk JWT token against Clerk's public keys
+        kid = jwt.get_unverified_header(token).get('kid')
+        key = await jwks.get_key(kid)
+        if key is None:
+            raise HTTPException(status_code=401, detail="Unknown signing key")
+        payload = jwt.decode(token, key, algorithms=['RS256'], issuer=CLERK_JWT_ISSUER)
     except jwt.ExpiredSignatureError:
         raise HTTPException(status_code=401, detail="Token has expired")
     except jwt.InvalidTokenError:
         raise HTTPException(status_code=401, detail="Invalid token")
+    
+    ttl = min(payload.get('exp', 0) - time.time(), TOKEN_CACHE_MAX_TTL)
+    if ttl > 0:
+        token_cache.set(cache_key, {'payload': payload, 'kid': kid}, ttl=ttl)
+    return payload
 
 async def get_current_user(payload: dict = Depends(verify_token)):
+    return await load_user(payload)
+
+async def load_user(payload: dict) -> dict:
     clerk_id = payload.get('sub')
     if not clerk_id:
         raise HTTPException(status_code=401, detail="Invalid token payload")
     
-    if not supabase:
+    user = user_cache.get(clerk_id)
+    if user:
+        return user
+    
+    if not db:
         raise HTTPException(status_code=503, detail="Database not available")
     
     # Get user from database
     try:
-        result = supabase.table('users').select('*').eq('clerk_id', clerk_id).single().execute()
-        if not result.data:
-            raise HTTPException(status_code=404, detail="User not found")
-        return result.data
+        user = await db.get_user_by_clerk_id(clerk_id)
     except Exception as e:
         logger.error(f"Error fetching user: {str(e)}")
         raise HTTPException(status_code=500, detail="Database error")
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+    user_cache.set(clerk_id, user)
+    return user
+
+def verify_clerk_webhook(headers, body: bytes) -> dict:
+    """Verify a Clerk (Svix) webhook signature and return the event"""
+    svix_id = headers.get('svix-id')
+    svix_timestamp = headers.get('svix-timestamp')
+    svix_signature = headers.get('svix-signature')
+    if not svix_id or not svix_timestamp or not svix_signature:
+        raise HTTPException(status_code=400, detail="Missing svix headers")
+    try:
+        timestamp = int(svix_timestamp)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid svix-timestamp header")
+    if abs(time.time() - timestamp) > 300:
+        raise HTTPException(status_code=400, detail="Webhook timestamp too old")
+    
+    secret = base64.b64decode(CLERK_WEBHOOK_SECRET.split('_', 1)[-1])
+    signed_content = f"{svix_id}.{svix_timestamp}.".encode() + body
+    expected = base64.b64encode(hmac.new(secret, signed_content, hashlib.sha256).digest()).decode()
+    
+    # Header holds space-separated "v1,<signature>" entries (several during secret rotation)
+    signatures = [entry.split(',', 1)[-1] for entry in svix_signature.split(' ')]
+    if not any(hmac.compare_digest(expected.encode(), signature.encode()) for signature in signatures):
+        raise HTTPException(status_code=400, detail="Invalid webhook signature")
+    return json.loads(body)
 
 # Health Check
 @app.get("/health")
@@ -157,6 +399,12 @@ async def health_check():
         "version": "1.0.0"
     }
 
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    """Prometheus scrape endpoint"""
+    body, content_type = render_metrics()
+    return Response(content=body, media_type=content_type)
+
 # User Management
 @app.get("/users/profile", response_model=UserProfile)
 async def get_user_profile(current_user: dict = Depends(get_current_user)):
@@ -165,19 +413,35 @@ async def get_user_profile(current_user: dict = Depends(get_current_user)):
 @app.put("/users/profile")
 async def update_user_profile(
     updates: Dict[str, Any],
+    request: Request,
     current_user: dict = Depends(get_current_user)
 ):
     # Update user profile
     allowed_fields = ['first_name', 'last_name', 'avatar_url']
     update_data = {k: v for k, v in updates.items() if k in allowed_fields}
     
-    result = supabase.table('users').update(update_data).eq('id', current_user['id']).execute()
+    await db.update_user(current_user['id'], update_data)
+    user_cache.invalidate(current_user['clerk_id'])
+    audit_log.record('user.update', current_user['id'], resource_type='user', resource_id=current_user['id'],
+                     request=request, metadata={"fields": sorted(update_data)})
     return {"message": "Profile updated successfully"}
 
+@app.post("/webhooks/clerk")
+async def clerk_webhook(request: Request):
+    """Clerk user events; drops cached user rows so changes apply immediately"""
+    if not CLERK_WEBHOOK_SECRET:
+        raise HTTPException(status_code=503, detail="Clerk webhook not configured")
+    
+    event = verify_clerk_webhook(request.headers, await request.body())
+    if event.get('type') in ('user.updated', 'user.deleted'):
+        user_cache.invalidate(event.get('data', {}).get('id'))
+    return {"received": True}
+
 # Team Management
 @app.post("/teams")
 async def create_team(
     team_data: TeamCreate,
+    request: Request,
     current_user: dict = Depends(get_current_user)
 ):
     # Create team
@@ -188,8 +452,7 @@ async def create_team(
         "owner_id": current_user['id']
     }
     
-    team_result = supabase.table('teams').insert(team_insert).execute()
-    team = team_result.data[0]
+    team = await db.create_team(team_insert)
     
     # Add owner as team member
     member_insert = {
@@ -199,28 +462,64 @@ async def create_team(
         "permissions": ["all"]
     }
     
-    supabase.table('team_members').insert(member_insert).execute()
+    await db.add_team_member(member_insert)
+    audit_log.record('team.create', current_user['id'], team['id'], resource_type='team', resource_id=team['id'], request=request)
     
     return team
 
 @app.get("/teams")
 async def get_user_teams(current_user: dict = Depends(get_current_user)):
-    result = supabase.table('team_members').select(
-        '*, teams(*)'
-    ).eq('user_id', current_user['id']).execute()
-    
-    return [member['teams'] for member in result.data]
+    return await db.list_user_teams(current_user['id'])
 
 # AI Task Management
 @app.post("/tasks", response_model=TaskResponse)
 async def create_ai_task(
     task_data: TaskCreate,
-    background_tasks: BackgroundTasks,
+    request: Request,
     current_user: dict = Depends(get_current_user)
 ):
-    # Create task in database
+    # The pending row is the queue entry; a worker claims it from there
+    task = await db.create_task(task_row(task_data, current_user))
+    await publish_task_event(task, 'pending')
+    audit_task_created(task, request)
+    
+    return TaskResponse(**task)
+
+@app.post("/tasks/batch", response_model=TaskBatchResponse)
+async def create_ai_tasks_batch(
+    items: List[Dict[str, Any]],
+    request: Request,
+    current_user: dict = Depends(get_current_user)
+):
+    """Create many tasks in one insert; invalid items are reported, the rest are queued"""
+    if len(items) > MAX_BATCH_SIZE:
+        raise HTTPException(status_code=413, detail=f"At most {MAX_BATCH_SIZE} tasks per batch")
+    
+    rows, positions, errors = [], [], []
+    for index, item in enumerate(items):
+        try:
+            task_data = TaskCreate.model_validate(item)
+        except ValidationError as e:
+            errors.append(TaskBatchError(index=index, errors=e.errors(include_url=False, include_context=False)))
+            continue
+        rows.append(task_row(task_data, current_user))
+        positions.append(index)
+    
+    ids: List[Optional[str]] = [None] * len(items)
+    if rows:
+        tasks = await db.create_tasks(rows)
+        for index, task in zip(positions, tasks):
+            ids[index] = task['id']
+        await asyncio.gather(*(publish_task_event(task, 'pending') for task in tasks))
+        for task in tasks:
+            audit_task_created(task, request, batch=True)
+    
+    return TaskBatchResponse(ids=ids, errors=errors)
+
+def task_row(task_data: TaskCreate, user: dict) -> dict:
+    """ai_tasks row for a new pending task"""
     task_insert = {
-        "user_id": current_user['id'],
+        "user_id": user['id'],
         "team_id": task_data.team_id,
         "type": task_data.type,
         "category": task_data.category,
@@ -228,47 +527,75 @@ async def create_ai_task(
         "description": task_data.description,
         "input_data": task_data.input_data,
         "priority": task_data.priority,
-        "status": "pending"
+        "status": "pending",
+        # Lets the worker continue this request's trace
+        "trace_context": inject_context()
     }
-    
-    result = supabase.table('ai_tasks').insert(task_insert).execute()
-    task = result.data[0]
-    
-    # Process task in background
-    background_tasks.add_task(process_ai_task, task['id'], task_data.type)
-    
-    return TaskResponse(**task)
+    task_insert["prompt_hash"] = prompt_hash(task_insert)
+    task_insert["estimated_duration"] = duration_estimator.estimate(task_insert)
+    task_insert["estimated_duration_p90"] = duration_estimator.estimate_p90(task_insert)
+    return task_insert
+
+def audit_task_created(task: dict, request: Request, batch: bool = False):
+    audit_log.record('task.create', task['user_id'], task.get('team_id'), resource_type='ai_task', resource_id=task['id'],
+                     request=request, metadata={"type": task['type'], "category": task['category'], "batch": batch})
+
+def encode_cursor(task: dict) -> str:
+    """Opaque position after ``task`` in (created_at, id) order"""
+    raw = json.dumps([task['created_at'], task['id']], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
 
-@app.get("/tasks", response_model=List[TaskResponse])
+def decode_cursor(cursor: str) -> tuple:
+    # Both values end up in a PostgREST filter: only a timestamp and a UUID get through
+    try:
+        created_at, task_id = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        return datetime.fromisoformat(created_at).isoformat(), str(uuid.UUID(task_id))
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def task_columns(fields: Optional[str], default: List[str], required: List[str]) -> str:
+    """PostgREST select list for a comma-separated ?fields= value (or the endpoint default)"""
+    if not fields:
+        selected = default
+    else:
+        selected = [field.strip() for field in fields.split(',') if field.strip()]
+        unknown = [field for field in selected if field not in TASK_FIELDS]
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+    return ','.join(dict.fromkeys(required + selected))
+
+@app.get("/tasks", response_model=TaskPage, response_model_exclude_unset=True)
 async def get_user_tasks(
-    limit: int = 20,
-    offset: int = 0,
+    limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = None,
     status: Optional[str] = None,
     type: Optional[str] = None,
+    fields: Optional[str] = None,
     current_user: dict = Depends(get_current_user)
 ):
-    query = supabase.table('ai_tasks').select('*').eq('user_id', current_user['id'])
+    """Newest tasks first, paged by keyset so every page costs the same"""
+    after = decode_cursor(cursor) if cursor else None
+    # id and created_at are always selected: they make up the cursor
+    columns = task_columns(fields, TASK_LIST_FIELDS, required=['id', 'created_at'])
+    # One extra row tells us whether there is a next page
+    tasks = await db.list_user_tasks(current_user['id'], limit + 1, after=after, status=status, type=type, columns=columns)
     
-    if status:
-        query = query.eq('status', status)
-    if type:
-        query = query.eq('type', type)
-        
-    result = query.order('created_at', desc=True).range(offset, offset + limit - 1).execute()
-    
-    return [TaskResponse(**task) for task in result.data]
+    next_cursor = encode_cursor(tasks[limit - 1]) if len(tasks) > limit else None
+    return TaskPage(tasks=[TaskView(**task) for task in tasks[:limit]], next_cursor=next_cursor)
 
-@app.get("/tasks/{task_id}", response_model=TaskResponse)
+@app.get("/tasks/{task_id}", response_model=TaskView, response_model_exclude_unset=True)
 async def get_task(
     task_id: str,
+    fields: Optional[str] = None,
     current_user: dict = Depends(get_current_user)
 ):
-    result = supabase.table('ai_tasks').select('*').eq('id', task_id).eq('user_id', current_user['id']).single().execute()
+    columns = task_columns(fields, TASK_DETAIL_FIELDS, required=['id'])
+    task = await db.get_user_task(task_id, current_user['id'], columns=columns)
     
-    if not result.data:
+    if not task:
         raise HTTPException(status_code=404, detail="Task not found")
     
-    return TaskResponse(**result.data)
+    return TaskView(**task)
 
 @app.get("/tasks/{task_id}/results")
 async def get_task_results(
@@ -276,37 +603,180 @@ async def get_task_results(
     current_user: dict = Depends(get_current_user)
 ):
     # Verify task ownership
-    task_result = supabase.table('ai_tasks').select('id').eq('id', task_id).eq('user_id', current_user['id']).single().execute()
-    if not task_result.data:
+    task = await db.get_user_task(task_id, current_user['id'], columns='id')
+    if not task:
         raise HTTPException(status_code=404, detail="Task not found")
     
     # Get results
-    results = supabase.table('task_results').select('*').eq('task_id', task_id).execute()
-    return results.data
+    return await db.list_task_results(task_id)
+
+@app.api_route("/blobs/{digest}", methods=["GET", "HEAD"])
+async def get_blob(digest: str, request: Request):
+    """Serve a stored file, with ETag and single-range support.
+
+    Like the provider URLs they replace, blob URLs are capabilities: the
+    SHA-256 in the path is unguessable, so they work in <img> tags without auth.
+    """
+    blob = await blob_store.stat(digest)
+    if not blob:
+        raise HTTPException(status_code=404, detail="Blob not found")
+    
+    # Content-addressed, so a blob never changes
+    headers = {"ETag": blob.etag, "Accept-Ranges": "bytes", "Cache-Control": "public, max-age=31536000, immutable"}
+    if_none_match = request.headers.get('if-none-match')
+    if if_none_match and (if_none_match.strip() == '*' or blob.etag in [t.strip().removeprefix('W/') for t in if_none_match.split(',')]):
+        return Response(status_code=304, headers=headers)
+    
+    try:
+        byte_range = parse_range(request.headers.get('range'), blob.size)
+    except ValueError:
+        return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{blob.size}"})
+    if byte_range and request.headers.get('if-range', blob.etag) != blob.etag:
+        byte_range = None
+    
+    start, end = byte_range or (0, blob.size - 1)
+    headers["Content-Length"] = str(end - start + 1)
+    if byte_range:
+        headers["Content-Range"] = f"bytes {start}-{end}/{blob.size}"
+    status_code = 206 if byte_range else 200
+    if request.method == "HEAD":
+        return Response(status_code=status_code, headers=headers, media_type=blob.content_type)
+    return StreamingResponse(blob_store.read(digest, start, end), status_code=status_code, headers=headers, media_type=blob.content_type)
+
+async def publish_task_event(task: dict, status: str, progress: int = 0):
+    """Push a status change to the owner's /ws/tasks subscribers (best effort)"""
+    try:
+        await task_events.publish(f"user:{task['user_id']}", {
+            "type": "task.status",
+            "task_id": task['id'],
+            "status": status,
+            "progress": progress,
+            "timestamp": datetime.now().isoformat()
+        })
+    except Exception as e:
+        logger.warning(f"Error publishing event for task {task['id']}: {str(e)}")
+
+@app.websocket("/ws/tasks")
+async def task_events_socket(websocket: WebSocket, token: str):
+    """Push status/progress events for all of the user's tasks.
+    
+    Browsers can't set headers on WebSocket requests, so the Clerk token is
+    passed as ?token=.
+    """
+    try:
+        current_user = await load_user(await decode_token(token))
+    except HTTPException:
+        await websocket.close(code=1008)
+        return
+    
+    await websocket.accept()
+    async with task_events.subscribe(f"user:{current_user['id']}") as subscription:
+        async def forward():
+            async for event in subscription:
+                await websocket.send_json(event)
+        
+        sender = asyncio.create_task(forward())
+        try:
+            # Nothing to receive; this just notices when the client goes away
+            while True:
+                message = await websocket.receive()
+                if message['type'] == 'websocket.disconnect':
+                    break
+        finally:
+            sender.cancel()
+            # Also collects a send error (e.g. to a client that has just gone away)
+            await asyncio.gather(sender, return_exceptions=True)
+
+def format_sse(event: StreamEvent) -> str:
+    if event.kind == 'ping':
+        return ": keep-alive\n\n"
+    if event.kind == 'text':
+        return f"id: {event.offset}\nevent: token\ndata: {json.dumps({'text': event.text})}\n\n"
+    if event.kind == 'reset':
+        # Output is being generated again: the client drops what it has
+        return "id: 0\nevent: reset\ndata: {}\n\n"
+    return f"id: {event.offset}\nevent: done\ndata: {json.dumps({'error': event.error})}\n\n"
+
+async def replay_task_result(task: dict, offset: int):
+    """Stream events for a finished task whose live stream has expired"""
+    if task['status'] == 'completed':
+        results = await db.list_task_results(task['id'])
+        content = next((r['content'] for r in results if r.get('content')), '') or ''
+        if len(content) > offset:
+            yield StreamEvent('text', len(content), content[offset:])
+        yield StreamEvent('done', max(len(content), offset))
+    else:
+        yield StreamEvent('done', offset, error=f"Task {task['status']}")
+
+@app.get("/tasks/{task_id}/stream")
+async def stream_task_output(
+    task_id: str,
+    request: Request,
+    offset: int = 0,
+    current_user: dict = Depends(get_current_user)
+):
+    """Server-Sent Events with the task's output as it is generated.
+    
+    Event ids are character offsets; reconnect with ?offset= or Last-Event-ID to resume.
+    """
+    task = await db.get_user_task(task_id, current_user['id'], columns='id, status')
+    if not task:
+        raise HTTPException(status_code=404, detail="Task not found")
+    
+    last_event_id = request.headers.get('last-event-id')
+    if last_event_id and last_event_id.isdigit():
+        offset = int(last_event_id)
+    
+    if task['status'] in ('completed', 'failed', 'canceled') and not await task_streams.exists(task_id):
+        events = replay_task_result(task, offset)
+    else:
+        events = task_streams.read(task_id, offset, heartbeat=STREAM_HEARTBEAT)
+    
+    async def event_source():
+        async for event in events:
+            yield format_sse(event)
+    
+    return StreamingResponse(
+        event_source(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
 # AI Processing Functions
-async def process_ai_task(task_id: str, task_type: str):
-    """Background task to process AI requests"""
+async def process_ai_task(task: dict):
+    """Process a task claimed from the queue (already marked as processing)"""
+    # Continues the trace of the POST /tasks request that created the task
+    with task_span("process_ai_task", task):
+        await handle_ai_task(task)
+
+async def handle_ai_task(task: dict):
+    task_id = task['id']
+    stream = StreamWriter(task_streams, task_id)
+    started = time.monotonic()
     try:
-        # Update task status
-        supabase.table('ai_tasks').update({
-            'status': 'processing',
-            'started_at': datetime.now().isoformat()
-        }).eq('id', task_id).execute()
+        if (task.get('attempts') or 1) > 1:
+            # Drop partial output of an earlier, interrupted attempt
+            await task_streams.reset(task_id)
+        await publish_task_event(task, 'processing')
         
-        # Get task details
-        task_result = supabase.table('ai_tasks').select('*').eq('id', task_id).single().execute()
-        task = task_result.data
+        key = task.get('prompt_hash') or prompt_hash(task)
         
-        # Route to appropriate MCP server
-        if task_type == 'marketing':
-            result = await process_marketing_task(task)
-        elif task_type == 'design':
-            result = await process_design_task(task)
-        elif task_type == 'development':
-            result = await process_development_task(task)
+        cached = await result_cache.get(key) if key else None
+        if cached:
+            result = {**cached, "metadata": {**cached.get('metadata', {}), "cache_hit": True, "cache_key": key}}
+            await stream.write(result.get('content') or '')
+        elif key:
+            with span("generate", {"prompt_hash": key}):
+                result, leader_id = await task_coalescer.run(key, task_id, stream, lambda tee: run_generation(task, tee))
+            if leader_id:
+                result = {**result, "metadata": {**result.get('metadata', {}), "coalesced_with": leader_id}}
+            else:
+                duration_estimator.record(task, result.get('metadata', {}).get('model_used'), time.monotonic() - started)
+                await result_cache.put(key, result)
         else:
-            raise ValueError(f"Unknown task type: {task_type}")
+            with span("generate"):
+                result = await run_generation(task, stream)
+            duration_estimator.record(task, result.get('metadata', {}).get('model_used'), time.monotonic() - started)
         
         # Save result
         result_insert = {
@@ -318,141 +788,213 @@ async def process_ai_task(task_id: str, task_type: str):
             "quality_score": result.get('quality_score', 0.8)
         }
         
-        supabase.table('task_results').insert(result_insert).execute()
+        await db.create_task_result(result_insert)
         
         # Update task as completed
-        supabase.table('ai_tasks').update({
+        await db.update_task(task_id, {
             'status': 'completed',
             'progress': 100,
-            'completed_at': datetime.now().isoformat()
-        }).eq('id', task_id).execute()
+            'completed_at': datetime.now().isoformat(),
+            'actual_duration': round(time.monotonic() - started),
+            'mcp_server_used': result.get('metadata', {}).get('route')
+        })
+        
+        # Update user stats and usage records (flushed in batches)
+        credits = task.get('credits_cost') or 1
+        user_stats.add(task['user_id'], tasks_completed=1, credits_used=credits)
+        usage_log.record(task['user_id'], task.get('team_id'), task['category'], credits=credits)
         
-        # Update user stats
-        supabase.table('users').update({
-            'total_tasks_completed': supabase.table('users').select('total_tasks_completed').eq('id', task['user_id']).single().execute().data['total_tasks_completed'] + 1
-        }).eq('id', task['user_id']).execute()
+        await stream.close()
+        await publish_task_event(task, 'completed', progress=100)
+        webhook_dispatcher.publish('task.completed', task, webhook_event_data(task, 'completed', result))
+        TASK_OUTCOMES.labels(type=task['type'], category=task['category'], outcome='completed').inc()
         
     except Exception as e:
         logger.error(f"Error processing task {task_id}: {str(e)}")
-        supabase.table('ai_tasks').update({
-            'status': 'failed',
-            'progress': 0
-        }).eq('id', task_id).execute()
+        try:
+            await db.update_task(task_id, {
+                'status': 'failed',
+                'progress': 0
+            })
+        finally:
+            # Readers and subscribers hear about the failure even if the row couldn't be updated
+            await stream.close(error="Task failed")
+            await publish_task_event(task, 'failed')
+            webhook_dispatcher.publish('task.failed', task, webhook_event_data(task, 'failed'))
+            TASK_OUTCOMES.labels(type=task['type'], category=task['category'], outcome='failed').inc()
+
+async def run_generation(task: dict, stream: StreamWriter) -> dict:
+    """Route a task to its provider call"""
+    task_type = task['type']
+    # Route to appropriate MCP server
+    if task_type == 'marketing':
+        return await process_marketing_task(task, stream)
+    elif task_type == 'design':
+        return await process_design_task(task, stream)
+    elif task_type == 'development':
+        return await process_development_task(task, stream)
+    raise ValueError(f"Unknown task type: {task_type}")
 
-async def process_marketing_task(task: dict) -> dict:
+async def process_marketing_task(task: dict, stream: StreamWriter) -> dict:
     """Process marketing AI tasks"""
     # Integrate with MCP Marketing Server or direct API calls
     if task['category'] == 'blog_post':
-        # Generate blog post using OpenAI
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                "https://api.openai.com/v1/chat/completions",
-                headers={
-                    "Authorization": f"Bearer {OPENAI_API_KEY}",
-                    "Content-Type": "application/json"
-                },
-                json={
-                    "model": "gpt-4",
-                    "messages": [
-                        {"role": "system", "content": "You are a professional content writer."},
-                        {"role": "user", "content": f"Write a blog post about: {task['title']}\nDescription: {task['description']}"}
-                    ],
-                    "max_tokens": 2000
-                }
-            )
-            
-            ai_response = response.json()
-            content = ai_response['choices'][0]['message']['content']
-            
-            return {
-                "type": "text",
-                "content": content,
-                "metadata": {
-                    "word_count": len(content.split()),
-                    "model_used": "gpt-4"
-                }
+        # Generate blog post (OpenAI or Anthropic, per routing policy)
+        content, route, strategy = await model_router.generate_text(
+            'blog_post',
+            system="You are a professional content writer.",
+            prompt=f"Write a blog post about: {task['title']}\nDescription: {task['description']}",
+            max_tokens=GENERATION_PARAMS['blog_post']['max_tokens'],
+            on_text=stream.write
+        )
+        
+        return {
+            "type": "text",
+            "content": content,
+            "metadata": {
+                "word_count": len(content.split()),
+                "model_used": route.model,
+                "route": route.name,
+                "routing_strategy": strategy
             }
+        }
     
     # Add more marketing task types here
     return {"type": "text", "content": "Marketing task completed"}
 
-async def process_design_task(task: dict) -> dict:
+async def process_design_task(task: dict, stream: StreamWriter) -> dict:
     """Process design AI tasks"""
     if task['category'] == 'logo_design':
+        specs = requested_specs(task)
         # Generate logo using DALL-E
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                "https://api.openai.com/v1/images/generations",
-                headers={
-                    "Authorization": f"Bearer {OPENAI_API_KEY}",
-                    "Content-Type": "application/json"
-                },
-                json={
-                    "model": "dall-e-3",
-                    "prompt": f"Professional logo design for: {task['title']}. {task['description']}. Clean, modern, minimalist style.",
-                    "n": 1,
-                    "size": "1024x1024",
-                    "quality": "hd"
-                }
-            )
-            
-            ai_response = response.json()
-            image_url = ai_response['data'][0]['url']
-            
-            return {
-                "type": "image",
-                "file_url": image_url,
-                "metadata": {
-                    "dimensions": "1024x1024",
-                    "model_used": "dall-e-3"
-                }
+        payload = {
+            **GENERATION_PARAMS['logo_design'],
+            "prompt": f"Professional logo design for: {task['title']}. {task['description']}. Clean, modern, minimalist style."
+        }
+        
+        async def generate_image(on_text) -> dict:
+            response = await provider_clients.openai.post("/v1/images/generations", json=payload)
+            response.raise_for_status()
+            return response.json()
+        
+        ai_response = await provider_clients.call("openai", "/v1/images/generations", payload, generate_image)
+        # The DALL-E URL expires after an hour; keep our own copy
+        blob = await store_image(ai_response['data'][0]['url'])
+        with span("render_derivatives"):
+            derivatives = await derivative_renderer.render(blob.digest, specs)
+        
+        return {
+            "type": "image",
+            "file_url": blob_url(blob.digest),
+            "metadata": {
+                "dimensions": "1024x1024",
+                "model_used": "dall-e-3",
+                "route": "openai:dall-e-3",
+                "blob_sha256": blob.digest,
+                "size_bytes": blob.size,
+                "content_type": blob.content_type,
+                "derivatives": [
+                    {
+                        "name": d['name'],
+                        "format": d['format'],
+                        "width": d['width'],
+                        "height": d['height'],
+                        "url": blob_url(d['sha256'])
+                    }
+                    for d in derivatives
+                ]
             }
+        }
     
     return {"type": "image", "content": "Design task completed"}
 
-async def process_development_task(task: dict) -> dict:
+async def store_image(url: str) -> BlobInfo:
+    """Stream a generated image from the provider CDN into the blob store"""
+    async def download(on_text) -> BlobInfo:
+        async with provider_clients.downloads.stream("GET", url) as response:
+            response.raise_for_status()
+            return await blob_store.put(response.aiter_bytes())
+    
+    with span("store_image"):
+        return await provider_clients.guard("openai", "image-download").call(download)
+
+async def process_development_task(task: dict, stream: StreamWriter) -> dict:
     """Process development AI tasks"""
     if task['category'] == 'code_review':
-        # Code review using Claude
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                "https://api.anthropic.com/v1/messages",
-                headers={
-                    "Authorization": f"Bearer {ANTHROPIC_API_KEY}",
-                    "Content-Type": "application/json",
-                    "anthropic-version": "2023-06-01"
-                },
-                json={
-                    "model": "claude-3-sonnet-20240229",
-                    "max_tokens": 1500,
-                    "messages": [
-                        {
-                            "role": "user",
-                            "content": f"Review this code and provide feedback:\n\n{task.get('input_data', {}).get('code', 'No code provided')}\n\nFocus on: security, performance, best practices, and potential bugs."
-                        }
-                    ]
-                }
-            )
-            
-            ai_response = response.json()
-            review_content = ai_response['content'][0]['text']
-            
-            return {
-                "type": "text",
-                "content": review_content,
-                "metadata": {
-                    "model_used": "claude-3-sonnet",
-                    "review_type": "code_review"
-                }
+        # Code review (Claude or GPT-4, per routing policy)
+        review_content, route, strategy = await model_router.generate_text(
+            'code_review',
+            system=None,
+            prompt=f"Review this code and provide feedback:\n\n{task.get('input_data', {}).get('code', 'No code provided')}\n\nFocus on: security, performance, best practices, and potential bugs.",
+            max_tokens=GENERATION_PARAMS['code_review']['max_tokens'],
+            on_text=stream.write
+        )
+        
+        return {
+            "type": "text",
+            "content": review_content,
+            "metadata": {
+                "model_used": route.model,
+                "route": route.name,
+                "routing_strategy": strategy,
+                "review_type": "code_review"
             }
+        }
     
     return {"type": "text", "content": "Development task completed"}
 
+# Webhooks
+@app.post("/webhooks")
+async def create_webhook(
+    webhook_data: WebhookCreate,
+    request: Request,
+    current_user: dict = Depends(get_current_user)
+):
+    """Subscribe a URL to task events; the signing secret is only returned here"""
+    unknown = set(webhook_data.events) - WEBHOOK_EVENTS
+    if not webhook_data.events or unknown:
+        raise HTTPException(status_code=400, detail=f"Events must be among: {', '.join(sorted(WEBHOOK_EVENTS))}")
+    try:
+        await resolve_webhook_url(webhook_data.url)
+    except WebhookURLError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if webhook_data.team_id and not await db.is_team_member(webhook_data.team_id, current_user['id']):
+        raise HTTPException(status_code=403, detail="Not a member of this team")
+    
+    webhook = await db.create_webhook({
+        "user_id": current_user['id'],
+        "team_id": webhook_data.team_id,
+        "url": webhook_data.url,
+        "events": sorted(set(webhook_data.events)),
+        "secret": f"whsec_{secrets.token_hex(24)}"
+    })
+    webhook_dispatcher.invalidate()
+    audit_log.record('webhook.create', current_user['id'], webhook_data.team_id, resource_type='webhook',
+                     resource_id=webhook['id'], request=request, metadata={"events": webhook['events']})
+    return webhook
+
+@app.get("/webhooks")
+async def list_webhooks(current_user: dict = Depends(get_current_user)):
+    return await db.list_user_webhooks(current_user['id'], WEBHOOK_LIST_FIELDS)
+
+@app.delete("/webhooks/{webhook_id}")
+async def delete_webhook(
+    webhook_id: str,
+    request: Request,
+    current_user: dict = Depends(get_current_user)
+):
+    if not await db.delete_webhook(webhook_id, current_user['id']):
+        raise HTTPException(status_code=404, detail="Webhook not found")
+    webhook_dispatcher.invalidate()
+    audit_log.record('webhook.delete', current_user['id'], resource_type='webhook', resource_id=webhook_id, request=request)
+    return {"message": "Webhook deleted"}
+
 # Platform Integrations
 @app.post("/integrations/{platform}/connect")
 async def connect_platform(
     platform: str,
     integration_data: Dict[str, Any],
+    request: Request,
     current_user: dict = Depends(get_current_user)
 ):
     # Store platform integration
@@ -464,41 +1006,50 @@ async def connect_platform(
         "is_active": True
     }
     
-    result = supabase.table('platform_integrations').upsert(integration_insert).execute()
+    await db.upsert_integration(integration_insert)
+    audit_log.record('integration.connect', current_user['id'], resource_type='platform_integration',
+                     request=request, metadata={"platform": platform, "scopes": integration_insert['scopes']})
     return {"message": f"{platform} integration connected successfully"}
 
 @app.get("/integrations")
 async def get_user_integrations(current_user: dict = Depends(get_current_user)):
-    result = supabase.table('platform_integrations').select(
-        'platform, is_active, created_at, last_sync_at'
-    ).eq('user_id', current_user['id']).execute()
-    
-    return result.data
+    return await db.list_integrations(current_user['id'])
 
 # Statistics and Analytics
+def summarize_task_counters(counters: List[Dict[str, Any]]) -> dict:
+    """Build dashboard stats from ai_task_counters rows"""
+    by_status: Dict[str, int] = {}
+    by_type = {"marketing": 0, "design": 0, "development": 0}
+    for row in counters:
+        by_status[row['status']] = by_status.get(row['status'], 0) + row['count']
+        by_type[row['type']] = by_type.get(row['type'], 0) + row['count']
+    
+    total = sum(by_status.values())
+    return {
+        "total_tasks": total,
+        "completed_tasks": by_status.get('completed', 0),
+        "pending_tasks": by_status.get('pending', 0),
+        "processing_tasks": by_status.get('processing', 0),
+        "tasks_by_type": by_type,
+        "success_rate": round((by_status.get('completed', 0) / max(total, 1)) * 100, 1)
+    }
+
 @app.get("/dashboard/stats")
 async def get_dashboard_stats(current_user: dict = Depends(get_current_user)):
-    # Get user task statistics
-    tasks_result = supabase.table('ai_tasks').select(
-        'status, type'
-    ).eq('user_id', current_user['id']).execute()
-    
-    tasks = tasks_result.data
-    
-    stats = {
-        "total_tasks": len(tasks),
-        "completed_tasks": len([t for t in tasks if t['status'] == 'completed']),
-        "pending_tasks": len([t for t in tasks if t['status'] == 'pending']),
-        "processing_tasks": len([t for t in tasks if t['status'] == 'processing']),
-        "tasks_by_type": {
-            "marketing": len([t for t in tasks if t['type'] == 'marketing']),
-            "design": len([t for t in tasks if t['type'] == 'design']),
-            "development": len([t for t in tasks if t['type'] == 'development'])
-        },
-        "success_rate": round((len([t for t in tasks if t['status'] == 'completed']) / max(len(tasks), 1)) * 100, 1)
-    }
+    # Get user task statistics (counts are maintained in the database)
+    counters = await db.get_task_counters('user', current_user['id'])
+    return summarize_task_counters(counters)
+
+@app.get("/teams/{team_id}/stats")
+async def get_team_stats(
+    team_id: str,
+    current_user: dict = Depends(get_current_user)
+):
+    if not await db.is_team_member(team_id, current_user['id']):
+        raise HTTPException(status_code=404, detail="Team not found")
     
-    return stats
+    counters = await db.get_task_counters('team', team_id)
+    return summarize_task_counters(counters)
 
 if __name__ == "__main__":
     uvicorn.run(
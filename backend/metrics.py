@@ -0,0 +1,207 @@
+# WorkflowAI Metrics
+"""
+Prometheus metrics shared by the API server and the task workers.
+
+The API serves them at GET /metrics; with several uvicorn workers, set
+PROMETHEUS_MULTIPROC_DIR so the endpoint aggregates all of them. Worker
+processes serve their metrics on WORKER_METRICS_PORT (+ process index).
+"""
+
+import os
+import time
+
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess
+
+WORKER_METRICS_PORT = int(os.getenv("WORKER_METRICS_PORT", "0"))  # 0 = disabled
+
+HTTP_REQUEST_SECONDS = Histogram(
+    "workflowai_http_request_seconds",
+    "API request latency by route template",
+    ["method", "route", "status"]
+)
+
+HTTP_REQUESTS_IN_FLIGHT = Gauge(
+    "workflowai_http_requests_in_flight",
+    "API requests being handled",
+    ["method", "route"],
+    multiprocess_mode="livesum"
+)
+
+DB_QUERY_SECONDS = Histogram(
+    "workflowai_db_query_seconds",
+    "Database query latency by table (or RPC function) and operation",
+    ["table", "operation"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+)
+
+PROVIDER_REQUEST_SECONDS = Histogram(
+    "workflowai_provider_request_seconds",
+    "Duration of provider calls (excluding rate limiter waits) by model and outcome",
+    ["provider", "model", "outcome"],
+    buckets=(0.5, 1, 2.5, 5, 10, 20, 30, 60, 90, 120, 180, 300)
+)
+
+PROVIDER_TOKENS = Counter(
+    "workflowai_provider_tokens_total",
+    "Tokens reported by providers, by model and kind (input/output)",
+    ["provider", "model", "kind"]
+)
+
+TASK_QUEUE_DEPTH = Gauge(
+    "workflowai_task_queue_depth",
+    "Pending tasks by priority",
+    ["priority"],
+    multiprocess_mode="max"
+)
+
+TASK_OUTCOMES = Counter(
+    "workflowai_task_outcomes_total",
+    "Processed tasks by type, category and outcome",
+    ["type", "category", "outcome"]
+)
+
+TASK_QUEUE_WAIT_SECONDS = Histogram(
+    "workflowai_task_queue_wait_seconds",
+    "Time tasks spend pending before a worker claims them",
+    ["priority"],
+    buckets=(0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)
+)
+
+CACHE_REQUESTS = Counter(
+    "workflowai_cache_requests_total",
+    "In-process cache lookups",
+    ["cache", "result"]
+)
+
+CACHE_EVICTIONS = Counter(
+    "workflowai_cache_evictions_total",
+    "In-process cache entries evicted to stay within maxsize",
+    ["cache"]
+)
+
+TASK_COALESCING = Counter(
+    "workflowai_task_coalescing_total",
+    "Tasks attached to an identical in-flight generation, and leader failovers",
+    ["event"]
+)
+
+PROVIDER_CONCURRENCY_LIMIT = Gauge(
+    "workflowai_provider_concurrency_limit",
+    "Adaptive concurrency limit of provider calls in this process",
+    ["provider", "model"]
+)
+
+PROVIDER_RATE_LIMITED = Counter(
+    "workflowai_provider_rate_limited_total",
+    "Provider responses with status 429",
+    ["provider", "model"]
+)
+
+PROVIDER_RETRIES = Counter(
+    "workflowai_provider_retries_total",
+    "Provider calls retried after a transient failure",
+    ["endpoint"]
+)
+
+PROVIDER_HEDGES = Counter(
+    "workflowai_provider_hedges_total",
+    "Hedged provider requests sent, and those that beat the original",
+    ["endpoint", "outcome"]
+)
+
+PROVIDER_CIRCUIT_STATE = Gauge(
+    "workflowai_provider_circuit_state",
+    "Circuit breaker state per provider endpoint (0 closed, 1 half-open, 2 open)",
+    ["endpoint"]
+)
+
+PROVIDER_CIRCUIT_REJECTED = Counter(
+    "workflowai_provider_circuit_rejected_total",
+    "Provider calls failed fast by an open circuit",
+    ["endpoint"]
+)
+
+MODEL_ROUTES = Counter(
+    "workflowai_model_routes_total",
+    "Text generations per category and the provider:model that served them",
+    ["category", "route"]
+)
+
+MODEL_FAILOVERS = Counter(
+    "workflowai_model_failovers_total",
+    "Text generations moved to another route after their route failed",
+    ["category", "route"]
+)
+
+WRITE_BEHIND_DROPPED = Counter(
+    "workflowai_write_behind_dropped_total",
+    "Buffered usage/audit rows dropped because the buffer was full",
+    ["table"]
+)
+
+WRITE_BEHIND_REJECTED = Counter(
+    "workflowai_write_behind_rejected_total",
+    "Buffered usage/audit rows dropped because the database kept rejecting them",
+    ["table"]
+)
+
+WEBHOOK_DELIVERIES = Counter(
+    "workflowai_webhook_deliveries_total",
+    "Webhook events delivered, retried, failed after all attempts, or dropped",
+    ["outcome"]
+)
+
+
+def render_metrics():
+    """Body and content type of a metrics scrape for this process (or all, in multiprocess mode)."""
+    registry = REGISTRY
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+def route_template(scope) -> str:
+    """Path template of the route an HTTP request matches (bounded label cardinality)."""
+    from starlette.routing import Match
+
+    for route in scope['app'].router.routes:
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return route.path
+    return "unmatched"
+
+
+class RequestMetricsMiddleware:
+    """ASGI middleware recording per-route latency and in-flight requests.
+
+    Requests are labelled with the matched route template (``/tasks/{task_id}``)
+    to keep label cardinality bounded; unmatched paths share one label.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        method, route = scope['method'], route_template(scope)
+        status = [500]
+
+        async def send_with_status(message):
+            if message['type'] == 'http.response.start':
+                status[0] = message['status']
+            await send(message)
+
+        in_flight = HTTP_REQUESTS_IN_FLIGHT.labels(method=method, route=route)
+        in_flight.inc()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            in_flight.dec()
+            HTTP_REQUEST_SECONDS.labels(method=method, route=route, status=str(status[0])).observe(
+                time.perf_counter() - started
+            )
@@ -0,0 +1,219 @@
+# WorkflowAI Provider Clients
+"""
+Long-lived HTTP clients for the AI providers.
+
+One pooled client per provider is created at startup (API lifespan or
+worker process) and reused by every generation, so connections and TLS
+sessions to the provider stay warm. Base URLs can be overridden to point
+the backend at a local stub.
+
+Generations go through ``ProviderClients.call``, which applies the adaptive
+rate limits (ratelimit.py) and retries, hedging and circuit breaking
+(resilience.py) per endpoint.
+"""
+
+import asyncio
+import json
+import os
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, TypeVar
+
+import httpx
+
+from opentelemetry.trace import SpanKind
+
+from metrics import PROVIDER_REQUEST_SECONDS, PROVIDER_TOKENS
+from ratelimit import ProviderLimits, estimate_tokens
+from resilience import EndpointGuard, OnText
+from tracing import span
+
+T = TypeVar("T")
+
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL", "https://api.openai.com")
+ANTHROPIC_BASE_URL = os.getenv("ANTHROPIC_BASE_URL", "https://api.anthropic.com")
+ANTHROPIC_VERSION = "2023-06-01"
+
+PROVIDER_CONNECT_TIMEOUT = float(os.getenv("PROVIDER_CONNECT_TIMEOUT", "5"))  # seconds
+PROVIDER_READ_TIMEOUT = float(os.getenv("PROVIDER_READ_TIMEOUT", "120"))  # seconds between bytes
+PROVIDER_MAX_CONNECTIONS = int(os.getenv("PROVIDER_MAX_CONNECTIONS", "50"))
+PROVIDER_MAX_KEEPALIVE = int(os.getenv("PROVIDER_MAX_KEEPALIVE", "20"))
+PROVIDER_KEEPALIVE_EXPIRY = float(os.getenv("PROVIDER_KEEPALIVE_EXPIRY", "60"))  # seconds
+PROVIDER_HTTP2 = os.getenv("PROVIDER_HTTP2", "true").lower() == "true"
+
+
+def create_provider_client(
+    base_url: str,
+    headers: dict,
+    response_hooks: Optional[List[Callable[[httpx.Response], Awaitable[None]]]] = None
+) -> httpx.AsyncClient:
+    return httpx.AsyncClient(
+        base_url=base_url,
+        headers=headers,
+        event_hooks={"response": response_hooks or []},
+        http2=PROVIDER_HTTP2,
+        timeout=httpx.Timeout(
+            connect=PROVIDER_CONNECT_TIMEOUT,
+            read=PROVIDER_READ_TIMEOUT,
+            write=PROVIDER_CONNECT_TIMEOUT,
+            pool=PROVIDER_CONNECT_TIMEOUT
+        ),
+        limits=httpx.Limits(
+            max_connections=PROVIDER_MAX_CONNECTIONS,
+            max_keepalive_connections=PROVIDER_MAX_KEEPALIVE,
+            keepalive_expiry=PROVIDER_KEEPALIVE_EXPIRY
+        )
+    )
+
+
+class ProviderClients:
+    """Holds the shared OpenAI and Anthropic clients of one process."""
+
+    def __init__(self, openai_api_key: Optional[str], anthropic_api_key: Optional[str]):
+        self.openai_api_key = openai_api_key
+        self.anthropic_api_key = anthropic_api_key
+        self.limits = ProviderLimits()
+        self._guards: Dict[str, EndpointGuard] = {}
+        self._openai: Optional[httpx.AsyncClient] = None
+        self._anthropic: Optional[httpx.AsyncClient] = None
+        self._downloads: Optional[httpx.AsyncClient] = None
+
+    def start(self) -> None:
+        self._openai = create_provider_client(OPENAI_BASE_URL, {
+            "Authorization": f"Bearer {self.openai_api_key}",
+            "Content-Type": "application/json"
+        }, [self.limits.response_hook("openai")])
+        self._anthropic = create_provider_client(ANTHROPIC_BASE_URL, {
+            "x-api-key": self.anthropic_api_key or "",
+            "anthropic-version": ANTHROPIC_VERSION,
+            "Content-Type": "application/json"
+        }, [self.limits.response_hook("anthropic")])
+        # Generated files on provider CDNs (no API credentials)
+        self._downloads = create_provider_client("", {})
+
+    async def close(self) -> None:
+        for client in (self._openai, self._anthropic, self._downloads):
+            if client:
+                await client.aclose()
+        self._openai = self._anthropic = self._downloads = None
+
+    def guard(self, provider: str, path: str) -> EndpointGuard:
+        endpoint = f"{provider}:{path}"
+        if endpoint not in self._guards:
+            self._guards[endpoint] = EndpointGuard(endpoint)
+        return self._guards[endpoint]
+
+    async def call(
+        self,
+        provider: str,
+        path: str,
+        payload: Dict[str, Any],
+        call: Callable[[OnText], Awaitable[T]],
+        on_text: Optional[OnText] = None
+    ) -> T:
+        """Run ``call(on_text)`` against ``provider`` with rate limiting, retries, hedging and circuit breaking."""
+        model = payload['model']
+        tokens = estimate_tokens(payload)
+        return await self.guard(provider, path).call(
+            lambda emit: self.limits.run(provider, model, tokens, lambda: _timed(provider, model, call(emit))),
+            on_text
+        )
+
+    @property
+    def openai(self) -> httpx.AsyncClient:
+        if not self._openai:
+            raise RuntimeError("Provider clients not started")
+        return self._openai
+
+    @property
+    def anthropic(self) -> httpx.AsyncClient:
+        if not self._anthropic:
+            raise RuntimeError("Provider clients not started")
+        return self._anthropic
+
+    @property
+    def downloads(self) -> httpx.AsyncClient:
+        if not self._downloads:
+            raise RuntimeError("Provider clients not started")
+        return self._downloads
+
+
+async def _timed(provider: str, model: str, call: Awaitable[T]) -> T:
+    outcome = "error"
+    started = time.monotonic()
+    try:
+        with span(f"{provider} {model}", {"gen_ai.system": provider, "gen_ai.request.model": model}, kind=SpanKind.CLIENT):
+            result = await call
+        outcome = "success"
+        return result
+    except asyncio.CancelledError:
+        outcome = "cancelled"
+        raise
+    finally:
+        PROVIDER_REQUEST_SECONDS.labels(provider=provider, model=model, outcome=outcome).observe(time.monotonic() - started)
+
+
+def _count_tokens(provider: str, model: str, input_tokens: Optional[int], output_tokens: Optional[int]) -> None:
+    if input_tokens:
+        PROVIDER_TOKENS.labels(provider=provider, model=model, kind="input").inc(input_tokens)
+    if output_tokens:
+        PROVIDER_TOKENS.labels(provider=provider, model=model, kind="output").inc(output_tokens)
+
+
+async def _sse_data(response: httpx.Response):
+    """Yield the decoded JSON payloads of a server-sent event stream."""
+    async for line in response.aiter_lines():
+        if not line.startswith("data:"):
+            continue
+        data = line[5:].strip()
+        if data == "[DONE]":
+            return
+        yield json.loads(data)
+
+
+async def stream_openai_chat(
+    client: httpx.AsyncClient,
+    payload: dict,
+    on_text: Callable[[str], Awaitable[None]]
+) -> str:
+    """Run a streaming chat completion, passing each delta to ``on_text``; returns the full text."""
+    parts = []
+    body = {**payload, "stream": True, "stream_options": {"include_usage": True}}
+    async with client.stream("POST", "/v1/chat/completions", json=body) as response:
+        if response.is_error:
+            await response.aread()
+            response.raise_for_status()
+        async for chunk in _sse_data(response):
+            choices = chunk.get('choices') or []
+            delta = choices[0].get('delta', {}).get('content') if choices else None
+            if delta:
+                parts.append(delta)
+                await on_text(delta)
+            if chunk.get('usage'):
+                _count_tokens("openai", payload['model'], chunk['usage'].get('prompt_tokens'), chunk['usage'].get('completion_tokens'))
+    return ''.join(parts)
+
+
+async def stream_anthropic_messages(
+    client: httpx.AsyncClient,
+    payload: dict,
+    on_text: Callable[[str], Awaitable[None]]
+) -> str:
+    """Run a streaming Messages API call, passing each text delta to ``on_text``; returns the full text."""
+    parts = []
+    async with client.stream("POST", "/v1/messages", json={**payload, "stream": True}) as response:
+        if response.is_error:
+            await response.aread()
+            response.raise_for_status()
+        async for event in _sse_data(response):
+            if event.get('type') == 'message_start':
+                _count_tokens("anthropic", payload['model'], event['message'].get('usage', {}).get('input_tokens'), None)
+            elif event.get('type') == 'message_delta':
+                _count_tokens("anthropic", payload['model'], None, event.get('usage', {}).get('output_tokens'))
+            elif event.get('type') == 'content_block_delta' and event['delta'].get('type') == 'text_delta':
+                parts.append(event['delta']['text'])
+                await on_text(event['delta']['text'])
+            elif event.get('type') == 'error':
+                raise RuntimeError(f"Anthropic stream error: {event.get('error')}")
+            elif event.get('type') == 'message_stop':
+                break
+    return ''.join(parts)
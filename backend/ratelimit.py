@@ -0,0 +1,252 @@
+# WorkflowAI Provider Rate Limiting
+"""
+Client-side adaptive limits for provider calls, per provider and model.
+
+Each limiter tracks the request and token budgets the provider reports in
+its rate-limit response headers and holds calls back while a budget is used
+up, until its reset time. Concurrency adapts AIMD-style: it grows by about
+one slot per round trip while responses succeed with budget to spare, and
+halves on a 429. Calls that get a 429 wait for the provider's retry-after
+and go again instead of failing the task. A call that has waited
+PROVIDER_RATE_LIMIT_MAX_WAIT in total (for a slot, a budget reset or a
+retry-after) fails with RateLimitTimeout.
+
+Limits are per process; every worker process adapts to the shared quota on
+its own through the headers.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import re
+import time
+from contextlib import asynccontextmanager
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple, TypeVar
+
+import httpx
+
+from metrics import PROVIDER_CONCURRENCY_LIMIT, PROVIDER_RATE_LIMITED
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+PROVIDER_INITIAL_CONCURRENCY = float(os.getenv("PROVIDER_INITIAL_CONCURRENCY", "4"))  # per model and process
+PROVIDER_MAX_CONCURRENCY = int(os.getenv("PROVIDER_MAX_CONCURRENCY", "32"))
+PROVIDER_RATE_LIMIT_MAX_WAIT = float(os.getenv("PROVIDER_RATE_LIMIT_MAX_WAIT", "300"))  # seconds before a call gives up
+PROVIDER_BUDGET_LOW_WATER = 0.1  # stop growing concurrency below this fraction of a budget
+
+_DURATION_PART = re.compile(r"(\d+(?:\.\d+)?)(ms|s|m|h)")
+_DURATION_UNITS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+
+
+class RateLimitTimeout(Exception):
+    """A call could not start within PROVIDER_RATE_LIMIT_MAX_WAIT."""
+
+
+def parse_reset(value: Optional[str]) -> Optional[float]:
+    """Seconds until a budget resets: OpenAI durations ("6m0s", "20ms") or Anthropic RFC 3339 times."""
+    if not value:
+        return None
+    parts = _DURATION_PART.findall(value)
+    if parts and ''.join(number + unit for number, unit in parts) == value:
+        return sum(float(number) * _DURATION_UNITS[unit] for number, unit in parts)
+    try:
+        return max((datetime.fromisoformat(value.replace("Z", "+00:00")) - datetime.now().astimezone()).total_seconds(), 0.0)
+    except ValueError:
+        return None
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    try:
+        return max(float(value), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+def _int_header(headers: httpx.Headers, name: str) -> Optional[int]:
+    try:
+        return int(headers[name])
+    except (KeyError, ValueError):
+        return None
+
+
+def read_rate_limit_headers(headers: httpx.Headers) -> Dict[str, Tuple[Optional[int], Optional[int], Optional[float]]]:
+    """(limit, remaining, seconds to reset) of the 'requests' and 'tokens' budgets."""
+    budgets = {}
+    for kind in ("requests", "tokens"):
+        if f"x-ratelimit-remaining-{kind}" in headers:  # OpenAI
+            budgets[kind] = (
+                _int_header(headers, f"x-ratelimit-limit-{kind}"),
+                _int_header(headers, f"x-ratelimit-remaining-{kind}"),
+                parse_reset(headers.get(f"x-ratelimit-reset-{kind}"))
+            )
+        elif f"anthropic-ratelimit-{kind}-remaining" in headers:
+            budgets[kind] = (
+                _int_header(headers, f"anthropic-ratelimit-{kind}-limit"),
+                _int_header(headers, f"anthropic-ratelimit-{kind}-remaining"),
+                parse_reset(headers.get(f"anthropic-ratelimit-{kind}-reset"))
+            )
+    return budgets
+
+
+def estimate_tokens(payload: Dict[str, Any]) -> int:
+    """Rough token cost of a call: prompt characters / 4 plus the completion allowance."""
+    prompt = json.dumps(payload.get('messages') or payload.get('prompt') or "")
+    return len(prompt) // 4 + int(payload.get('max_tokens') or 0)
+
+
+class _Budget:
+    def __init__(self):
+        self.limit: Optional[int] = None
+        self.remaining: Optional[int] = None
+        self.reset_at = 0.0
+
+    def update(self, limit: Optional[int], remaining: Optional[int], reset: Optional[float]) -> None:
+        self.limit = limit or self.limit
+        self.remaining = remaining
+        self.reset_at = time.monotonic() + (reset if reset is not None else 60)
+
+    def wait_for(self, cost: int) -> float:
+        """Seconds until ``cost`` fits in the budget (0 if it does, or the budget is unknown or reset)."""
+        if self.remaining is None:
+            return 0.0
+        wait = self.reset_at - time.monotonic()
+        if wait <= 0:
+            self.remaining = None
+            return 0.0
+        return wait if self.remaining < max(cost, 1) else 0.0
+
+    def low(self) -> bool:
+        return bool(self.limit and self.remaining is not None and self.remaining < self.limit * PROVIDER_BUDGET_LOW_WATER)
+
+
+class AdaptiveLimiter:
+    """AIMD concurrency limit plus header-reported request/token budgets for one model."""
+
+    def __init__(
+        self,
+        provider: str,
+        model: str,
+        initial: float = PROVIDER_INITIAL_CONCURRENCY,
+        maximum: int = PROVIDER_MAX_CONCURRENCY,
+        minimum: int = 1
+    ):
+        self.provider = provider
+        self.model = model
+        self.limit = initial
+        self.maximum = maximum
+        self.minimum = minimum
+        self.in_flight = 0
+        self.waiting = 0
+        self.requests = _Budget()
+        self.tokens = _Budget()
+        self.blocked_until = 0.0
+        self._changed = asyncio.Condition()
+        self._gauge = PROVIDER_CONCURRENCY_LIMIT.labels(provider=provider, model=model)
+        self._gauge.set(self.limit)
+
+    def _wait_time(self, tokens: int) -> Optional[float]:
+        """0 if a call may start now, seconds until a budget resets, or None to wait for a free slot."""
+        blocked = self.blocked_until - time.monotonic()
+        if blocked > 0:
+            return blocked
+        if self.in_flight >= int(self.limit):
+            return None
+        return max(self.requests.wait_for(1), self.tokens.wait_for(tokens))
+
+    @asynccontextmanager
+    async def slot(self, tokens: int = 0, deadline: Optional[float] = None):
+        """Hold one call's slot; RateLimitTimeout if it can't start before ``deadline`` (monotonic)."""
+        async with self._changed:
+            self.waiting += 1
+            try:
+                while True:
+                    wait = self._wait_time(tokens)
+                    if wait == 0:
+                        break
+                    if deadline is not None:
+                        left = deadline - time.monotonic()
+                        if left <= 0:
+                            raise RateLimitTimeout(f"{self.provider} {self.model} rate limits still exhausted")
+                        wait = left if wait is None else min(wait, left)
+                    try:
+                        await asyncio.wait_for(self._changed.wait(), timeout=wait)
+                    except asyncio.TimeoutError:
+                        pass
+            finally:
+                self.waiting -= 1
+            self.in_flight += 1
+            # Spend the budget locally until the next response reports the real figures
+            if self.requests.remaining is not None:
+                self.requests.remaining -= 1
+            if self.tokens.remaining is not None:
+                self.tokens.remaining -= tokens
+        try:
+            yield
+        finally:
+            async with self._changed:
+                self.in_flight -= 1
+                self._changed.notify_all()
+
+    async def observe(self, response: httpx.Response) -> None:
+        """Update budgets and the concurrency limit from a provider response."""
+        budgets = read_rate_limit_headers(response.headers)
+        async with self._changed:
+            if 'requests' in budgets:
+                self.requests.update(*budgets['requests'])
+            if 'tokens' in budgets:
+                self.tokens.update(*budgets['tokens'])
+
+            if response.status_code == 429:
+                self.limit = max(self.minimum, self.limit / 2)
+                retry_after = parse_retry_after(response.headers.get('retry-after'))
+                self.blocked_until = time.monotonic() + (retry_after if retry_after is not None else 1.0)
+                PROVIDER_RATE_LIMITED.labels(provider=self.provider, model=self.model).inc()
+            elif response.is_success and not (self.requests.low() or self.tokens.low()):
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            self._gauge.set(self.limit)
+            self._changed.notify_all()
+
+
+class ProviderLimits:
+    """Limiters by (provider, model), fed by provider client response hooks."""
+
+    def __init__(self, max_wait: float = PROVIDER_RATE_LIMIT_MAX_WAIT):
+        self.max_wait = max_wait
+        self._limiters: Dict[Tuple[str, str], AdaptiveLimiter] = {}
+
+    def get(self, provider: str, model: str) -> AdaptiveLimiter:
+        key = (provider, model)
+        if key not in self._limiters:
+            self._limiters[key] = AdaptiveLimiter(provider, model)
+        return self._limiters[key]
+
+    def response_hook(self, provider: str) -> Callable[[httpx.Response], Awaitable[None]]:
+        """httpx response event hook that reports every response to its model's limiter."""
+        async def hook(response: httpx.Response) -> None:
+            try:
+                model = json.loads(response.request.content or b"{}").get('model')
+            except ValueError:
+                model = None
+            if model:
+                await self.get(provider, model).observe(response)
+        return hook
+
+    async def run(self, provider: str, model: str, tokens: int, call: Callable[[], Awaitable[T]]) -> T:
+        """Run a provider call within its model's limits, waiting (for slots, budgets and 429s) up to ``max_wait``.
+
+        A 429 arrives before any output is streamed, so repeating the call is safe.
+        """
+        limiter = self.get(provider, model)
+        deadline = time.monotonic() + self.max_wait
+        while True:
+            async with limiter.slot(tokens, deadline):
+                try:
+                    return await call()
+                except httpx.HTTPStatusError as e:
+                    if e.response.status_code != 429 or time.monotonic() > deadline:
+                        raise
+            logger.info(f"{provider} {model} rate limited; call queued (limit {limiter.limit:.1f})")
@@ -0,0 +1,273 @@
+# WorkflowAI Data Access Layer
+"""
+Async repository over Supabase's PostgREST API.
+
+Every database access of the API server and the task workers goes through
+``Repository``, which awaits queries on a pooled async HTTP client instead of
+blocking the event loop like the synchronous supabase-py client.
+"""
+
+import os
+from typing import Any, Dict, List, Optional, Tuple
+
+from postgrest import AsyncPostgrestClient
+from postgrest.types import ReturnMethod
+
+from opentelemetry.trace import SpanKind
+
+from metrics import DB_QUERY_SECONDS
+from tracing import span
+
+DB_TIMEOUT = float(os.getenv("DB_TIMEOUT", "10"))  # seconds per query
+
+
+class Repository:
+    """Async access to the WorkflowAI tables and RPCs."""
+
+    def __init__(self, supabase_url: str, service_key: str, timeout: float = DB_TIMEOUT):
+        self.client = AsyncPostgrestClient(
+            f"{supabase_url.rstrip('/')}/rest/v1",
+            headers={
+                "apikey": service_key,
+                "Authorization": f"Bearer {service_key}"
+            },
+            timeout=timeout
+        )
+
+    async def close(self) -> None:
+        await self.client.aclose()
+
+    def table(self, name: str):
+        return self.client.from_(name)
+
+    async def _execute(self, table: str, operation: str, query):
+        """Run a query, timing and tracing it per table (or RPC function) and operation."""
+        attributes = {"db.system": "postgresql", "db.operation": operation, "db.sql.table": table}
+        with span(f"db {operation} {table}", attributes, kind=SpanKind.CLIENT):
+            with DB_QUERY_SECONDS.labels(table=table, operation=operation).time():
+                return await query.execute()
+
+    @staticmethod
+    def _first(result) -> Optional[Dict[str, Any]]:
+        return result.data[0] if result.data else None
+
+    # Users
+    async def get_user_by_clerk_id(self, clerk_id: str) -> Optional[Dict[str, Any]]:
+        result = await self._execute('users', 'select', self.table('users').select('*').eq('clerk_id', clerk_id).limit(1))
+        return self._first(result)
+
+    async def update_user(self, user_id: str, data: Dict[str, Any]) -> None:
+        await self._execute('users', 'update', self.table('users').update(data).eq('id', user_id))
+
+    async def increment_user_stats(self, deltas: List[Dict[str, Any]]) -> None:
+        """Atomically add per-user tasks_completed/credits_used deltas."""
+        await self._execute('increment_user_stats', 'rpc', self.client.rpc('increment_user_stats', {'p_deltas': deltas}))
+
+    # Teams
+    async def create_team(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        result = await self._execute('teams', 'insert', self.table('teams').insert(data))
+        return result.data[0]
+
+    async def add_team_member(self, data: Dict[str, Any]) -> None:
+        await self._execute('team_members', 'insert', self.table('team_members').insert(data))
+
+    async def is_team_member(self, team_id: str, user_id: str) -> bool:
+        result = await self._execute('team_members', 'select', self.table('team_members').select('id').eq('team_id', team_id).eq('user_id', user_id).limit(1))
+        return bool(result.data)
+
+    async def list_user_teams(self, user_id: str) -> List[Dict[str, Any]]:
+        result = await self._execute('team_members', 'select', self.table('team_members').select('*, teams(*)').eq('user_id', user_id))
+        return [member['teams'] for member in result.data]
+
+    # AI tasks
+    async def create_task(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        result = await self._execute('ai_tasks', 'insert', self.table('ai_tasks').insert(data))
+        return result.data[0]
+
+    async def create_tasks(self, rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Insert many tasks in one statement; rows come back in input order."""
+        result = await self._execute('ai_tasks', 'insert', self.table('ai_tasks').insert(rows))
+        return result.data
+
+    async def list_user_tasks(
+        self,
+        user_id: str,
+        limit: int,
+        after: Optional[Tuple[str, str]] = None,
+        status: Optional[str] = None,
+        type: Optional[str] = None,
+        columns: str = '*'
+    ) -> List[Dict[str, Any]]:
+        """Newest first by (created_at, id), starting after the ``(created_at, id)`` keyset position."""
+        query = self.table('ai_tasks').select(columns).eq('user_id', user_id)
+        if status:
+            query = query.eq('status', status)
+        if type:
+            query = query.eq('type', type)
+        if after:
+            created_at, task_id = after
+            query = query.or_(
+                f'created_at.lt."{created_at}",and(created_at.eq."{created_at}",id.lt."{task_id}")'
+            )
+        result = await self._execute('ai_tasks', 'select', query.order('created_at', desc=True).order('id', desc=True).limit(limit))
+        return result.data
+
+    async def get_user_task(self, task_id: str, user_id: str, columns: str = '*') -> Optional[Dict[str, Any]]:
+        result = await self._execute('ai_tasks', 'select', self.table('ai_tasks').select(columns).eq('id', task_id).eq('user_id', user_id).limit(1))
+        return self._first(result)
+
+    async def update_task(self, task_id: str, data: Dict[str, Any]) -> None:
+        await self._execute('ai_tasks', 'update', self.table('ai_tasks').update(data).eq('id', task_id))
+
+    async def get_task_counters(self, scope: str, scope_id: str) -> List[Dict[str, Any]]:
+        """Per (type, status) task counts of a user or team, kept current by triggers."""
+        result = await self._execute('ai_task_counters', 'select', self.table('ai_task_counters').select('type, status, count').eq('scope', scope).eq('scope_id', scope_id))
+        return result.data
+
+    # Task results
+    async def create_task_result(self, data: Dict[str, Any]) -> None:
+        await self._execute('task_results', 'insert', self.table('task_results').insert(data))
+
+    async def list_task_results(self, task_id: str) -> List[Dict[str, Any]]:
+        result = await self._execute('task_results', 'select', self.table('task_results').select('*').eq('task_id', task_id))
+        return result.data
+
+    # Result cache
+    async def get_cached_result(self, cache_key: str, now: str) -> Optional[Dict[str, Any]]:
+        result = await self._execute('ai_result_cache', 'select', self.table('ai_result_cache').select('result, expires_at').eq(
+            'cache_key', cache_key
+        ).gt('expires_at', now).limit(1))
+        return self._first(result)
+
+    async def put_cached_result(self, cache_key: str, result: Dict[str, Any], expires_at: str) -> None:
+        await self._execute('ai_result_cache', 'upsert', self.table('ai_result_cache').upsert({
+            'cache_key': cache_key,
+            'result': result,
+            'expires_at': expires_at
+        }))
+
+    async def prune_result_cache(self, max_rows: int) -> int:
+        result = await self._execute('prune_ai_result_cache', 'rpc', self.client.rpc('prune_ai_result_cache', {'p_max_rows': max_rows}))
+        return result.data or 0
+
+    # Task durations
+    async def get_task_duration_stats(self) -> List[Dict[str, Any]]:
+        result = await self._execute('ai_task_duration_stats', 'select', self.table('ai_task_duration_stats').select('type, category, model, samples, ewma, p50, p90'))
+        return result.data
+
+    async def record_task_durations(self, samples: List[Dict[str, Any]], alpha: float, rate: float) -> None:
+        """Fold size-normalized duration samples into the per (type, category, model) statistics."""
+        await self._execute('record_ai_task_durations', 'rpc', self.client.rpc('record_ai_task_durations', {
+            'p_samples': samples,
+            'p_alpha': alpha,
+            'p_rate': rate
+        }))
+
+    # Task queue
+    async def pending_task_heads(self, per_group: int, max_rows: int) -> List[Dict[str, Any]]:
+        result = await self._execute('pending_ai_task_heads', 'rpc', self.client.rpc('pending_ai_task_heads', {
+            'p_per_group': per_group,
+            'p_max_rows': max_rows
+        }))
+        return result.data or []
+
+    async def task_queue_depth(self) -> List[Dict[str, Any]]:
+        result = await self._execute('ai_task_queue_depth', 'rpc', self.client.rpc('ai_task_queue_depth', {}))
+        return result.data or []
+
+    async def claim_tasks(
+        self,
+        worker_id: str,
+        task_ids: List[str],
+        max_in_flight: Optional[int],
+        max_followers: int = 0
+    ) -> List[Dict[str, Any]]:
+        result = await self._execute('claim_ai_tasks', 'rpc', self.client.rpc('claim_ai_tasks', {
+            'p_worker_id': worker_id,
+            'p_task_ids': task_ids,
+            'p_max_in_flight': max_in_flight,
+            'p_max_followers': max_followers
+        }))
+        return result.data or []
+
+    async def heartbeat_tasks(self, worker_id: str, task_ids: List[str], at: str) -> None:
+        await self._execute('ai_tasks', 'update', self.table('ai_tasks').update({
+            'heartbeat_at': at
+        }).in_('id', task_ids).eq('claimed_by', worker_id))
+
+    async def release_tasks(self, worker_id: str, task_ids: List[str]) -> None:
+        await self._execute('ai_tasks', 'update', self.table('ai_tasks').update({
+            'status': 'pending',
+            'progress': 0,
+            'claimed_by': None,
+            'heartbeat_at': None
+        }).in_('id', task_ids).eq('claimed_by', worker_id).eq('status', 'processing'))
+
+    async def requeue_stale_tasks(self, stale_seconds: int, max_attempts: int) -> int:
+        result = await self._execute('requeue_stale_ai_tasks', 'rpc', self.client.rpc('requeue_stale_ai_tasks', {
+            'p_stale_seconds': stale_seconds,
+            'p_max_attempts': max_attempts
+        }))
+        return result.data or 0
+
+    # Usage and audit logs
+    async def create_usage_records(self, rows: List[Dict[str, Any]]) -> None:
+        await self._execute('usage_tracking', 'insert', self.table('usage_tracking').insert(rows, returning=ReturnMethod.minimal))
+
+    async def create_audit_logs(self, rows: List[Dict[str, Any]]) -> None:
+        await self._execute('audit_logs', 'insert', self.table('audit_logs').insert(rows, returning=ReturnMethod.minimal))
+
+    # Webhooks
+    async def create_webhook(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        result = await self._execute('webhooks', 'insert', self.table('webhooks').insert(data))
+        return result.data[0]
+
+    async def list_user_webhooks(self, user_id: str, columns: str = '*') -> List[Dict[str, Any]]:
+        result = await self._execute('webhooks', 'select', self.table('webhooks').select(columns).eq('user_id', user_id).order('created_at'))
+        return result.data
+
+    async def delete_webhook(self, webhook_id: str, user_id: str) -> bool:
+        result = await self._execute('webhooks', 'delete', self.table('webhooks').delete().eq('id', webhook_id).eq('user_id', user_id))
+        return bool(result.data)
+
+    async def list_active_webhooks(self, user_id: str, team_id: Optional[str]) -> List[Dict[str, Any]]:
+        """Active webhooks for a task: the owner's personal ones plus its team's."""
+        query = self.table('webhooks').select('id, url, events, secret, is_active').eq('is_active', True)
+        if team_id:
+            query = query.or_(f"and(user_id.eq.{user_id},team_id.is.null),team_id.eq.{team_id}")
+        else:
+            query = query.eq('user_id', user_id).is_('team_id', 'null')
+        result = await self._execute('webhooks', 'select', query)
+        return result.data
+
+    async def record_webhook_delivery(self, webhook_id: str, at: str) -> None:
+        await self._execute('webhooks', 'update', self.table('webhooks').update({
+            'last_delivery_at': at,
+            'failure_count': 0
+        }).eq('id', webhook_id))
+
+    async def record_webhook_failure(self, webhook_id: str, disable_after: int) -> bool:
+        """Count a failed delivery; returns whether the webhook is still active."""
+        result = await self._execute('record_webhook_failure', 'rpc', self.client.rpc('record_webhook_failure', {
+            'p_webhook_id': webhook_id,
+            'p_disable_after': disable_after
+        }))
+        return bool(result.data)
+
+    # Blob derivatives
+    async def get_blob_derivatives(self, source_sha256: str) -> List[Dict[str, Any]]:
+        result = await self._execute('blob_derivatives', 'select', self.table('blob_derivatives').select('*').eq('source_sha256', source_sha256))
+        return result.data
+
+    async def put_blob_derivatives(self, rows: List[Dict[str, Any]]) -> None:
+        await self._execute('blob_derivatives', 'upsert', self.table('blob_derivatives').upsert(rows))
+
+    # Platform integrations
+    async def upsert_integration(self, data: Dict[str, Any]) -> None:
+        await self._execute('platform_integrations', 'upsert', self.table('platform_integrations').upsert(data))
+
+    async def list_integrations(self, user_id: str) -> List[Dict[str, Any]]:
+        result = await self._execute('platform_integrations', 'select', self.table('platform_integrations').select(
+            'platform, is_active, created_at, last_sync_at'
+        ).eq('user_id', user_id))
+        return result.data
@@ -0,0 +1,257 @@
+# WorkflowAI Provider Resilience
+"""
+Retries, hedging and circuit breaking for provider calls, per endpoint.
+
+- Retries: failures that are likely transient (timeouts, connection errors,
+  408/409/5xx/529) are retried with full-jitter exponential backoff, as long
+  as the failed attempt has not streamed any output yet.
+- Hedging (optional): when an attempt has produced no output after the
+  PROVIDER_HEDGE_QUANTILE of recent time-to-first-output, a second request
+  is sent; the first to produce output wins and the other is cancelled.
+- Circuit breaking: after CIRCUIT_FAILURE_THRESHOLD consecutive transient
+  failures an endpoint fails fast for CIRCUIT_RESET_TIMEOUT seconds, then
+  lets one probe call through to decide whether to close again.
+
+Every attempt also has an overall PROVIDER_CALL_TIMEOUT, on top of the HTTP
+client's per-read timeout, so a slowly trickling response can't hold a worker
+slot forever.
+"""
+
+import asyncio
+import logging
+import os
+import random
+import time
+from collections import deque
+from typing import Awaitable, Callable, List, Optional, TypeVar
+
+import httpx
+
+from metrics import PROVIDER_CIRCUIT_REJECTED, PROVIDER_CIRCUIT_STATE, PROVIDER_HEDGES, PROVIDER_RETRIES
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+OnText = Callable[[str], Awaitable[None]]
+
+PROVIDER_CALL_TIMEOUT = float(os.getenv("PROVIDER_CALL_TIMEOUT", "300"))  # seconds per attempt
+PROVIDER_MAX_RETRIES = int(os.getenv("PROVIDER_MAX_RETRIES", "3"))
+PROVIDER_RETRY_BASE_DELAY = float(os.getenv("PROVIDER_RETRY_BASE_DELAY", "0.5"))  # seconds
+PROVIDER_RETRY_MAX_DELAY = float(os.getenv("PROVIDER_RETRY_MAX_DELAY", "20"))  # seconds
+PROVIDER_HEDGE_QUANTILE = float(os.getenv("PROVIDER_HEDGE_QUANTILE", "0"))  # e.g. 0.95; 0 = no hedging
+PROVIDER_HEDGE_MIN_SAMPLES = int(os.getenv("PROVIDER_HEDGE_MIN_SAMPLES", "20"))
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "5"))  # consecutive failures
+CIRCUIT_RESET_TIMEOUT = float(os.getenv("CIRCUIT_RESET_TIMEOUT", "30"))  # seconds open before a probe
+
+RETRYABLE_STATUS = {408, 409, 500, 502, 503, 504, 529}
+
+
+class CircuitOpenError(Exception):
+    """The endpoint's circuit is open; the call was not attempted."""
+
+
+def is_retryable(error: BaseException) -> bool:
+    if isinstance(error, httpx.HTTPStatusError):
+        return error.response.status_code in RETRYABLE_STATUS
+    return isinstance(error, (httpx.TransportError, asyncio.TimeoutError))
+
+
+class CircuitBreaker:
+    """Closed -> open after repeated failures -> half-open (one probe) -> closed or open."""
+
+    CLOSED, HALF_OPEN, OPEN = "closed", "half_open", "open"
+    _STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+    def __init__(self, endpoint: str, threshold: int = CIRCUIT_FAILURE_THRESHOLD, reset_timeout: float = CIRCUIT_RESET_TIMEOUT):
+        self.endpoint = endpoint
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+
+    def _set_state(self, state: str) -> None:
+        if state != self.state:
+            logger.warning(f"Circuit for {self.endpoint} is now {state}")
+        self.state = state
+        PROVIDER_CIRCUIT_STATE.labels(endpoint=self.endpoint).set(self._STATE_VALUES[state])
+
+    def available(self) -> bool:
+        """Whether a call would currently be let through (without reserving the probe)."""
+        if self.state == self.OPEN:
+            return time.monotonic() - self._opened_at >= self.reset_timeout
+        return not (self.state == self.HALF_OPEN and self._probing)
+
+    def before_call(self) -> None:
+        if self.state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+            self._set_state(self.HALF_OPEN)
+        if self.state == self.OPEN or (self.state == self.HALF_OPEN and self._probing):
+            PROVIDER_CIRCUIT_REJECTED.labels(endpoint=self.endpoint).inc()
+            raise CircuitOpenError(f"Circuit for {self.endpoint} is open")
+        if self.state == self.HALF_OPEN:
+            self._probing = True
+
+    def record_success(self) -> None:
+        self.failures = 0
+        self._probing = False
+        self._set_state(self.CLOSED)
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        if self.state == self.HALF_OPEN or self.failures >= self.threshold:
+            self._opened_at = time.monotonic()
+            self._set_state(self.OPEN)
+        self._probing = False
+
+    def release(self) -> None:
+        """End a probe that neither succeeded nor failed (cancelled, or our own error)."""
+        self._probing = False
+
+
+class LatencyWindow:
+    """Recent latencies of an endpoint, for hedging thresholds and routing."""
+
+    def __init__(self, size: int = 200):
+        self._samples = deque(maxlen=size)
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+    def add(self, seconds: float) -> None:
+        self._samples.append(seconds)
+
+    def quantile(self, q: float) -> Optional[float]:
+        if not self._samples:
+            return None
+        ordered = sorted(self._samples)
+        return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+
+class _Output:
+    """Forwards the output of whichever try produces it first; the others are cut off."""
+
+    def __init__(self, on_text: Optional[OnText]):
+        self.on_text = on_text
+        self.winner: Optional[int] = None
+        self.tries: List[asyncio.Task] = []
+
+    def emitter(self, index: int) -> OnText:
+        async def emit(text: str) -> None:
+            if self.winner is None:
+                self.winner = index
+                for i, other in enumerate(self.tries):
+                    if i != index:
+                        other.cancel()
+            if self.winner == index and self.on_text:
+                await self.on_text(text)
+        return emit
+
+    @property
+    def started(self) -> bool:
+        return self.winner is not None
+
+
+class EndpointGuard:
+    """Retry, hedging and circuit breaker state of one provider endpoint."""
+
+    def __init__(
+        self,
+        endpoint: str,
+        retries: int = PROVIDER_MAX_RETRIES,
+        base_delay: float = PROVIDER_RETRY_BASE_DELAY,
+        max_delay: float = PROVIDER_RETRY_MAX_DELAY,
+        hedge_quantile: float = PROVIDER_HEDGE_QUANTILE,
+        timeout: float = PROVIDER_CALL_TIMEOUT
+    ):
+        self.endpoint = endpoint
+        self.retries = retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.hedge_quantile = hedge_quantile
+        self.timeout = timeout
+        self.breaker = CircuitBreaker(endpoint)
+        self.latency = LatencyWindow()  # seconds to first output (or completion)
+        self._outcomes = deque(maxlen=100)  # recent attempts, True = failed
+
+    def error_rate(self) -> float:
+        return sum(self._outcomes) / len(self._outcomes) if self._outcomes else 0.0
+
+    def hedge_delay(self) -> Optional[float]:
+        if not self.hedge_quantile or len(self.latency) < PROVIDER_HEDGE_MIN_SAMPLES:
+            return None
+        return self.latency.quantile(self.hedge_quantile)
+
+    async def call(self, call: Callable[[OnText], Awaitable[T]], on_text: Optional[OnText] = None) -> T:
+        """Run ``call(on_text)`` with retries, hedging and the circuit breaker."""
+        for attempt in range(self.retries + 1):
+            self.breaker.before_call()
+            output = _Output(on_text)
+            try:
+                result = await self._hedged(call, output)
+            except Exception as e:
+                if not is_retryable(e):
+                    # The provider answered (e.g. 400); that says nothing against the endpoint
+                    if isinstance(e, httpx.HTTPStatusError):
+                        self.breaker.record_success()
+                    raise
+                self.breaker.record_failure()
+                self._outcomes.append(True)
+                if output.started or attempt == self.retries or not self.breaker.available():
+                    raise
+                delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+                PROVIDER_RETRIES.labels(endpoint=self.endpoint).inc()
+                logger.warning(f"{self.endpoint} attempt {attempt + 1} failed ({type(e).__name__}: {str(e)}); retrying in {delay:.1f}s")
+                await asyncio.sleep(delay)
+            else:
+                self.breaker.record_success()
+                self._outcomes.append(False)
+                return result
+            finally:
+                self.breaker.release()
+
+    async def _try(self, call: Callable[[OnText], Awaitable[T]], output: _Output, index: int) -> T:
+        started = time.monotonic()
+        emit = output.emitter(index)
+
+        async def timed_emit(text: str) -> None:
+            if output.winner is None:
+                self.latency.add(time.monotonic() - started)
+            await emit(text)
+
+        result = await asyncio.wait_for(call(timed_emit), timeout=self.timeout)
+        if output.winner is None:
+            self.latency.add(time.monotonic() - started)
+            output.winner = index
+        return result
+
+    async def _hedged(self, call: Callable[[OnText], Awaitable[T]], output: _Output) -> T:
+        delay = self.hedge_delay()
+        if delay is None:
+            return await self._try(call, output, 0)
+
+        primary = asyncio.create_task(self._try(call, output, 0))
+        output.tries.append(primary)
+        done, _ = await asyncio.wait({primary}, timeout=delay)
+        if done or output.started:
+            return await primary
+
+        PROVIDER_HEDGES.labels(endpoint=self.endpoint, outcome='sent').inc()
+        output.tries.append(asyncio.create_task(self._try(call, output, 1)))
+        pending = set(output.tries)
+        error: Optional[BaseException] = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.cancelled():
+                        continue
+                    if task.exception() is None:
+                        if task is not primary:
+                            PROVIDER_HEDGES.labels(endpoint=self.endpoint, outcome='won').inc()
+                        return task.result()
+                    error = task.exception()
+            raise error or asyncio.CancelledError()
+        finally:
+            for task in output.tries:
+                task.cancel()
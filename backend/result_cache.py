@@ -0,0 +1,91 @@
+# WorkflowAI Result Cache
+"""
+Content-addressed cache of AI generation results.
+
+Identical generations (same type, category, prompt fields, model and
+parameters) share one result. Keys are SHA-256 hashes of a canonical JSON
+form of those inputs; only the ends of the free-text title and description
+are trimmed, input_data (code, for instance) is hashed as submitted. Lookups go to an in-process LRU (L1)
+first and then to the ``ai_result_cache`` table (L2), which is shared by all
+workers and pruned to RESULT_CACHE_MAX_ROWS.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Optional
+
+from cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+RESULT_CACHE_TTL = float(os.getenv("RESULT_CACHE_TTL", "86400"))  # seconds
+RESULT_CACHE_SIZE = int(os.getenv("RESULT_CACHE_SIZE", "1000"))  # L1 entries per process
+RESULT_CACHE_MAX_ROWS = int(os.getenv("RESULT_CACHE_MAX_ROWS", "100000"))  # L2 rows
+RESULT_CACHE_PRUNE_INTERVAL = float(os.getenv("RESULT_CACHE_PRUNE_INTERVAL", "600"))  # seconds
+
+
+def _strip(value: Optional[str]) -> Optional[str]:
+    return value.strip() if isinstance(value, str) else value
+
+
+def generation_key(task: Dict[str, Any], params: Dict[str, Any]) -> str:
+    """Cache key of a task's generation: its prompt inputs plus model parameters."""
+    material = {
+        "type": task['type'],
+        "category": task['category'],
+        "title": _strip(task.get('title')),
+        "description": _strip(task.get('description')),
+        "input_data": task.get('input_data') or {},
+        "params": params
+    }
+    canonical = json.dumps(material, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+class ResultCache:
+    """Two-level (memory, database) cache of generation results."""
+
+    def __init__(
+        self,
+        db,
+        ttl: float = RESULT_CACHE_TTL,
+        maxsize: int = RESULT_CACHE_SIZE,
+        max_rows: int = RESULT_CACHE_MAX_ROWS,
+        prune_interval: float = RESULT_CACHE_PRUNE_INTERVAL
+    ):
+        self.db = db
+        self.ttl = ttl
+        self.max_rows = max_rows
+        self.prune_interval = prune_interval
+        self.memory = TTLCache("results", maxsize=maxsize, ttl=ttl)
+        self._last_prune = time.monotonic()
+
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        result = self.memory.get(key)
+        if result is not None:
+            return result
+        try:
+            row = await self.db.get_cached_result(key, datetime.now(timezone.utc).isoformat())
+        except Exception as e:
+            logger.warning(f"Result cache lookup failed: {str(e)}")
+            return None
+        if not row:
+            return None
+        remaining = (datetime.fromisoformat(row['expires_at']) - datetime.now(timezone.utc)).total_seconds()
+        self.memory.set(key, row['result'], ttl=min(remaining, self.ttl))
+        return row['result']
+
+    async def put(self, key: str, result: Dict[str, Any]) -> None:
+        self.memory.set(key, result)
+        try:
+            expires_at = datetime.now(timezone.utc) + timedelta(seconds=self.ttl)
+            await self.db.put_cached_result(key, result, expires_at.isoformat())
+            if time.monotonic() - self._last_prune > self.prune_interval:
+                self._last_prune = time.monotonic()
+                await self.db.prune_result_cache(self.max_rows)
+        except Exception as e:
+            logger.warning(f"Result cache write failed: {str(e)}")
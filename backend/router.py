@@ -0,0 +1,150 @@
+# WorkflowAI Model Router
+"""
+Routing of text generations across equivalent OpenAI and Anthropic models.
+
+Each text category has a policy: a list of routes (``provider:model``) and
+a strategy.
+- ``latency``: the routes are ranked by live measurements of this process:
+  mean of p50 and p95 time-to-first-output, inflated by the recent error
+  rate and by the calls queued in the model's rate limiter. Routes without
+  measurements rank first, so each gets tried.
+- ``ordered``: the routes are used in the configured order.
+
+Routes whose circuit is open go last. When a route fails before streaming
+any output (transient errors after retries, open circuit, exhausted rate
+limit wait), the generation fails over to the next route.
+
+Policies can be overridden per category with ROUTING_POLICIES, a JSON object
+such as ``{"blog_post": {"strategy": "ordered", "routes": ["openai:gpt-4"]}}``.
+"""
+
+import json
+import logging
+import os
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+
+from metrics import MODEL_FAILOVERS, MODEL_ROUTES
+from providers import ProviderClients, stream_anthropic_messages, stream_openai_chat
+from resilience import CircuitOpenError, OnText, is_retryable
+
+logger = logging.getLogger(__name__)
+
+ROUTING_ERROR_PENALTY = float(os.getenv("ROUTING_ERROR_PENALTY", "4"))  # score multiplier per unit of error rate
+
+DEFAULT_POLICIES: Dict[str, Dict[str, Any]] = {
+    'blog_post': {"strategy": "latency", "routes": ["openai:gpt-4", "anthropic:claude-3-sonnet-20240229"]},
+    'code_review': {"strategy": "latency", "routes": ["anthropic:claude-3-sonnet-20240229", "openai:gpt-4"]},
+}
+
+TEXT_PATHS = {"openai": "/v1/chat/completions", "anthropic": "/v1/messages"}
+
+
+@dataclass(frozen=True)
+class Route:
+    provider: str
+    model: str
+
+    @classmethod
+    def parse(cls, spec: str) -> "Route":
+        provider, model = spec.split(":", 1)
+        if provider not in TEXT_PATHS:
+            raise ValueError(f"Unknown provider in route {spec!r}")
+        return cls(provider, model)
+
+    @property
+    def name(self) -> str:
+        return f"{self.provider}:{self.model}"
+
+    @property
+    def path(self) -> str:
+        return TEXT_PATHS[self.provider]
+
+
+def load_policies() -> Dict[str, Dict[str, Any]]:
+    policies = dict(DEFAULT_POLICIES)
+    overrides = os.getenv("ROUTING_POLICIES")
+    if overrides:
+        policies.update(json.loads(overrides))
+    return policies
+
+
+def _should_fail_over(error: Exception) -> bool:
+    if isinstance(error, CircuitOpenError) or is_retryable(error):
+        return True
+    # Still rate limited after waiting the limiter's maximum
+    return isinstance(error, httpx.HTTPStatusError) and error.response.status_code == 429
+
+
+class ModelRouter:
+    """Picks the route of each text generation and fails over between routes."""
+
+    def __init__(self, clients: ProviderClients, policies: Optional[Dict[str, Dict[str, Any]]] = None):
+        self.clients = clients
+        self.policies = {
+            category: {"strategy": policy.get("strategy", "latency"), "routes": [Route.parse(r) for r in policy["routes"]]}
+            for category, policy in (policies if policies is not None else load_policies()).items()
+        }
+
+    def score(self, route: Route) -> float:
+        """Expected seconds to first output on ``route``; lower is better."""
+        guard = self.clients.guard(route.provider, route.path)
+        p50, p95 = guard.latency.quantile(0.5), guard.latency.quantile(0.95)
+        if p50 is None:
+            return 0.0
+        limiter = self.clients.limits.get(route.provider, route.model)
+        queued = limiter.waiting / max(limiter.limit, 1)
+        return (p50 + p95) / 2 * (1 + queued) * (1 + ROUTING_ERROR_PENALTY * guard.error_rate())
+
+    def plan(self, category: str) -> Tuple[str, List[Route]]:
+        """Strategy and routes of ``category`` in the order they should be tried."""
+        policy = self.policies[category]
+        routes = list(policy["routes"])
+        if policy["strategy"] == "latency":
+            routes.sort(key=self.score)
+        available = [r for r in routes if self.clients.guard(r.provider, r.path).breaker.available()]
+        return policy["strategy"], available + [r for r in routes if r not in available]
+
+    async def generate_text(self, category: str, system: Optional[str], prompt: str, max_tokens: int, on_text: OnText) -> Tuple[str, Route, str]:
+        """Generate with the best route of ``category``; returns the text, the route used and the strategy."""
+        strategy, routes = self.plan(category)
+        for index, route in enumerate(routes):
+            streamed = False
+
+            async def emit(text: str) -> None:
+                nonlocal streamed
+                streamed = True
+                await on_text(text)
+
+            try:
+                text = await self._call(route, system, prompt, max_tokens, emit)
+            except Exception as e:
+                if streamed or index == len(routes) - 1 or not _should_fail_over(e):
+                    raise
+                MODEL_FAILOVERS.labels(category=category, route=route.name).inc()
+                logger.warning(f"Route {route.name} failed for {category} ({type(e).__name__}); failing over to {routes[index + 1].name}")
+                continue
+            MODEL_ROUTES.labels(category=category, route=route.name).inc()
+            return text, route, strategy
+
+    async def _call(self, route: Route, system: Optional[str], prompt: str, max_tokens: int, on_text: OnText) -> str:
+        if route.provider == "openai":
+            messages = [{"role": "system", "content": system}] if system else []
+            payload = {
+                "model": route.model,
+                "max_tokens": max_tokens,
+                "messages": messages + [{"role": "user", "content": prompt}]
+            }
+            stream = lambda emit: stream_openai_chat(self.clients.openai, payload, emit)
+        else:
+            payload = {
+                "model": route.model,
+                "max_tokens": max_tokens,
+                "messages": [{"role": "user", "content": prompt}]
+            }
+            if system:
+                payload["system"] = system
+            stream = lambda emit: stream_anthropic_messages(self.clients.anthropic, payload, emit)
+        return await self.clients.call(route.provider, route.path, payload, stream, on_text=on_text)
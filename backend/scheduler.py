@@ -0,0 +1,130 @@
+# WorkflowAI Task Scheduler
+"""
+Priority- and fairness-aware task selection.
+
+Two levels of deficit round robin (DRR):
+- across priority classes, with quanta from PRIORITY_WEIGHTS, so urgent work
+  gets most of the capacity but low-priority work still makes progress
+- across tenants (team, or user for personal tasks) inside each class, so one
+  tenant's backlog cannot starve another tenant of the same priority
+
+A task costs its estimated duration (see eta.py) in units of
+SCHEDULER_COST_UNIT seconds, so tenants get fair shares of worker time
+rather than of task counts; tasks without an estimate cost one unit.
+
+Scheduler state (deficits and round-robin position) lives for the lifetime
+of the worker process and carries over between polls.
+"""
+
+import os
+from collections import deque
+from typing import Any, Callable, Deque, Dict, Hashable, Iterable, List, Optional
+
+PRIORITY_WEIGHTS = {
+    "urgent": float(os.getenv("PRIORITY_WEIGHT_URGENT", "8")),
+    "high": float(os.getenv("PRIORITY_WEIGHT_HIGH", "4")),
+    "normal": float(os.getenv("PRIORITY_WEIGHT_NORMAL", "2")),
+    "low": float(os.getenv("PRIORITY_WEIGHT_LOW", "1")),
+}
+SCHEDULER_COST_UNIT = float(os.getenv("SCHEDULER_COST_UNIT", "30"))  # seconds of estimated duration per unit
+
+
+def tenant_key(task: Dict[str, Any]) -> str:
+    """Fair-share unit of a task: its team, or its owner for personal tasks."""
+    if task.get('team_id'):
+        return f"team:{task['team_id']}"
+    return f"user:{task['user_id']}"
+
+
+def duration_cost(task: Dict[str, Any]) -> float:
+    """Scheduling cost of a task: its estimated duration in SCHEDULER_COST_UNITs."""
+    if not task.get('estimated_duration'):
+        return 1.0
+    return task['estimated_duration'] / SCHEDULER_COST_UNIT
+
+
+class DeficitRoundRobin:
+    """Deficit round robin over keyed flows, with state kept between calls."""
+
+    def __init__(self, quantum: Callable[[Hashable], float]):
+        self.quantum = quantum
+        self.deficit: Dict[Hashable, float] = {}
+        self.active: Deque[Hashable] = deque()
+
+    def sync(self, keys: Iterable[Hashable]) -> None:
+        """Make ``keys`` the set of backlogged flows; idle flows lose their deficit."""
+        keys = set(keys)
+        for key in [k for k in self.active if k not in keys]:
+            self.active.remove(key)
+            del self.deficit[key]
+        for key in keys:
+            if key not in self.deficit:
+                self.deficit[key] = 0.0
+                self.active.append(key)
+
+    def next(self, head_cost: Callable[[Hashable], Optional[float]]) -> Optional[Hashable]:
+        """Return the flow whose head item is served next and charge its cost.
+
+        ``head_cost`` returns the cost of a flow's next item, or None if the
+        flow has run empty.
+        """
+        while self.active:
+            key = self.active[0]
+            cost = head_cost(key)
+            if cost is None:
+                self.active.popleft()
+                del self.deficit[key]
+                continue
+            if self.deficit[key] >= cost:
+                self.deficit[key] -= cost
+                return key
+            self.deficit[key] += self.quantum(key)
+            self.active.rotate(-1)
+        return None
+
+
+class FairScheduler:
+    """Picks which pending tasks a worker should claim next."""
+
+    def __init__(
+        self,
+        weights: Optional[Dict[str, float]] = None,
+        cost: Optional[Callable[[Dict[str, Any]], float]] = None
+    ):
+        self.weights = weights or PRIORITY_WEIGHTS
+        self.cost = cost or duration_cost
+        self._classes = DeficitRoundRobin(lambda priority: self.weights.get(priority, 1.0))
+        self._tenants: Dict[str, DeficitRoundRobin] = {}
+
+    def select(self, candidates: List[Dict[str, Any]], limit: int) -> List[Dict[str, Any]]:
+        """Order up to ``limit`` candidates by weighted priority and tenant fair share.
+
+        Candidates are pending task heads (id, user_id, team_id, priority,
+        created_at, estimated_duration); within one tenant and priority tasks keep arrival order.
+        """
+        backlog: Dict[str, Dict[str, Deque[Dict[str, Any]]]] = {}
+        for task in sorted(candidates, key=lambda t: t['created_at']):
+            priority = task.get('priority') or 'normal'
+            backlog.setdefault(priority, {}).setdefault(tenant_key(task), deque()).append(task)
+
+        self._classes.sync(backlog)
+        for priority in list(self._tenants):
+            if priority not in backlog:
+                del self._tenants[priority]
+        for priority, tenants in backlog.items():
+            self._tenants.setdefault(priority, DeficitRoundRobin(lambda tenant: 1.0)).sync(tenants)
+
+        def class_cost(priority):
+            return 1.0 if any(backlog[priority].values()) else None
+
+        picked = []
+        while len(picked) < limit:
+            priority = self._classes.next(class_cost)
+            if priority is None:
+                break
+            tenants = backlog[priority]
+            tenant = self._tenants[priority].next(
+                lambda key: self.cost(tenants[key][0]) if tenants[key] else None
+            )
+            picked.append(tenants[tenant].popleft())
+        return picked
@@ -0,0 +1,296 @@
+# WorkflowAI Task Streams
+"""
+Live output streams of running tasks.
+
+The worker appends generated text to a task's stream while the provider is
+still streaming; API processes read it from any character offset, so SSE
+clients can resume where they left off. Streams are kept for
+STREAM_RETENTION seconds after the task finishes.
+
+When a task's output is generated again (a retried task, or a coalesced
+follower taking over from a failed leader) the stream is reset: readers get
+a ``reset`` event, drop what they have and continue from offset 0. A reader
+that resumes at a non-zero offset of a stream that has been reset also gets
+a ``reset`` first, since its offset may belong to the earlier attempt.
+
+Two backends:
+- MemoryStreamBackend: same-process only (API with EMBEDDED_WORKER). A
+  reader of a task nothing in this process writes to waits at most
+  STREAM_PRODUCER_WAIT seconds for output, then gets a ``done`` event with
+  an error; its entry is dropped with its last reader
+- RedisStreamBackend: Redis Streams (given a client with decode_responses),
+  so separate worker processes and API pods share streams
+"""
+
+import asyncio
+import logging
+import os
+import time
+from dataclasses import dataclass
+from typing import AsyncIterator, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+STREAM_RETENTION = int(os.getenv("STREAM_RETENTION", "600"))  # seconds after finish
+STREAM_MAX_AGE = int(os.getenv("STREAM_MAX_AGE", "3600"))  # seconds, for streams never finished
+STREAM_FLUSH_INTERVAL = float(os.getenv("STREAM_FLUSH_INTERVAL", "0.05"))  # seconds
+STREAM_FLUSH_CHARS = int(os.getenv("STREAM_FLUSH_CHARS", "256"))
+STREAM_PRODUCER_WAIT = float(os.getenv("STREAM_PRODUCER_WAIT", "60"))  # seconds, memory backend readers
+
+
+@dataclass
+class StreamEvent:
+    kind: str  # 'text', 'reset', 'done' or 'ping' (nothing new within the heartbeat interval)
+    offset: int = 0  # character offset after this event's text
+    text: str = ""
+    error: Optional[str] = None
+
+
+class _MemoryStream:
+    def __init__(self, produced: bool = True):
+        self.produced = produced  # False while only readers have opened it
+        self.readers = 0
+        self.text = ""
+        self.done = False
+        self.error: Optional[str] = None
+        self.generation = 0  # number of resets
+        self.changed = asyncio.Condition()
+        self.expiry: Optional[asyncio.TimerHandle] = None
+
+
+class MemoryStreamBackend:
+    """Task streams held in this process."""
+
+    def __init__(self, retention: float = STREAM_RETENTION, producer_wait: float = STREAM_PRODUCER_WAIT):
+        self.retention = retention
+        self.producer_wait = producer_wait
+        self._streams: Dict[str, _MemoryStream] = {}
+
+    def _get(self, task_id: str) -> _MemoryStream:
+        """The stream a producer writes to."""
+        stream = self._streams.get(task_id)
+        if stream is None:
+            stream = self._streams[task_id] = _MemoryStream()
+        stream.produced = True
+        return stream
+
+    async def exists(self, task_id: str) -> bool:
+        stream = self._streams.get(task_id)
+        return stream is not None and stream.produced
+
+    async def reset(self, task_id: str) -> None:
+        # Same object, so readers already waiting on it see the reset
+        stream = self._streams.get(task_id)
+        if stream is None:
+            return
+        stream.produced = True
+        async with stream.changed:
+            if stream.expiry:
+                stream.expiry.cancel()
+                stream.expiry = None
+            stream.text, stream.done, stream.error = "", False, None
+            stream.generation += 1
+            stream.changed.notify_all()
+
+    async def append(self, task_id: str, text: str, end: int) -> None:
+        stream = self._get(task_id)
+        async with stream.changed:
+            stream.text += text
+            stream.changed.notify_all()
+
+    async def finish(self, task_id: str, error: Optional[str] = None) -> None:
+        stream = self._get(task_id)
+        async with stream.changed:
+            stream.done = True
+            stream.error = error
+            stream.changed.notify_all()
+            stream.expiry = asyncio.get_running_loop().call_later(self.retention, self._streams.pop, task_id, None)
+
+    async def read(self, task_id: str, offset: int, heartbeat: float) -> AsyncIterator[StreamEvent]:
+        stream = self._streams.get(task_id)
+        if stream is None:
+            # Opened before the task starts (or for a task running elsewhere)
+            stream = self._streams[task_id] = _MemoryStream(produced=False)
+        stream.readers += 1
+        try:
+            async for event in self._read(stream, offset, heartbeat):
+                yield event
+        finally:
+            stream.readers -= 1
+            if not stream.produced and not stream.readers and self._streams.get(task_id) is stream:
+                del self._streams[task_id]
+
+    async def _read(self, stream: _MemoryStream, offset: int, heartbeat: float) -> AsyncIterator[StreamEvent]:
+        generation = 0 if offset else stream.generation
+        give_up_at = time.monotonic() + self.producer_wait
+        while True:
+            async with stream.changed:
+                timeout = heartbeat if stream.produced else min(heartbeat, max(give_up_at - time.monotonic(), 0))
+                try:
+                    await asyncio.wait_for(
+                        stream.changed.wait_for(
+                            lambda: stream.generation != generation or len(stream.text) > offset or stream.done
+                        ),
+                        timeout=timeout
+                    )
+                except asyncio.TimeoutError:
+                    pass
+                abandoned = not stream.produced and time.monotonic() >= give_up_at
+                # Readers that have text of the earlier output drop it
+                reset = stream.generation != generation and offset > 0
+                if stream.generation != generation:
+                    generation, offset = stream.generation, 0
+                text, done, error = stream.text[offset:], stream.done, stream.error
+            if abandoned:
+                yield StreamEvent('done', offset, error="No live output for this task in this process")
+                return
+            if reset:
+                yield StreamEvent('reset', 0)
+            if not text and not done and not reset:
+                yield StreamEvent('ping', offset)
+                continue
+            if text:
+                offset += len(text)
+                yield StreamEvent('text', offset, text)
+            if done:
+                yield StreamEvent('done', offset, error=error)
+                return
+
+    async def close(self) -> None:
+        self._streams.clear()
+
+
+class RedisStreamBackend:
+    """Task streams in Redis Streams (one stream key per task)."""
+
+    def __init__(self, redis, retention: int = STREAM_RETENTION, max_age: int = STREAM_MAX_AGE):
+        self.redis = redis
+        self.retention = retention
+        self.max_age = max_age
+
+    @staticmethod
+    def _key(task_id: str) -> str:
+        return f"task_stream:{task_id}"
+
+    async def exists(self, task_id: str) -> bool:
+        return bool(await self.redis.exists(self._key(task_id)))
+
+    async def reset(self, task_id: str) -> None:
+        # Replace the entries by a reset marker; blocked readers receive it as
+        # a new entry, new readers find it first
+        key = self._key(task_id)
+        if not await self.redis.exists(key):
+            return
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.delete(key)
+            pipe.xadd(key, {'reset': 1})
+            pipe.expire(key, self.max_age)
+            await pipe.execute()
+
+    async def append(self, task_id: str, text: str, end: int) -> None:
+        key = self._key(task_id)
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.xadd(key, {'text': text, 'end': end})
+            pipe.expire(key, self.max_age)
+            await pipe.execute()
+
+    async def finish(self, task_id: str, error: Optional[str] = None) -> None:
+        key = self._key(task_id)
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.xadd(key, {'done': 1, 'error': error or ''})
+            pipe.expire(key, self.retention)
+            await pipe.execute()
+
+    async def read(self, task_id: str, offset: int, heartbeat: float) -> AsyncIterator[StreamEvent]:
+        key = self._key(task_id)
+        last_id = '0-0'
+        while True:
+            response = await self.redis.xread({key: last_id}, count=100, block=int(heartbeat * 1000))
+            if not response:
+                yield StreamEvent('ping', offset)
+                continue
+            for entry_id, fields in response[0][1]:
+                last_id = entry_id
+                if fields.get('reset'):
+                    if offset:
+                        offset = 0
+                        yield StreamEvent('reset', 0)
+                    continue
+                if fields.get('done'):
+                    yield StreamEvent('done', offset, error=fields.get('error') or None)
+                    return
+                end = int(fields['end'])
+                if end <= offset:
+                    continue
+                text = fields['text']
+                start = end - len(text)
+                # Resuming mid-entry: only send the part after the client's offset
+                text = text[max(0, offset - start):]
+                offset = end
+                yield StreamEvent('text', offset, text)
+
+    async def close(self) -> None:
+        pass  # the Redis client is owned by the caller
+
+
+class StreamWriter:
+    """Buffers provider deltas for one task and appends them in small batches.
+
+    The first delta is appended immediately to keep time-to-first-token low;
+    later ones are flushed every ``flush_interval`` seconds or ``flush_chars``.
+    Streaming is best effort: if the backend fails, the writer stops streaming
+    and the task itself carries on.
+    """
+
+    def __init__(self, backend, task_id: str, flush_interval: float = STREAM_FLUSH_INTERVAL, flush_chars: int = STREAM_FLUSH_CHARS):
+        self.backend = backend
+        self.task_id = task_id
+        self.flush_interval = flush_interval
+        self.flush_chars = flush_chars
+        self.length = 0
+        self._buffer = []
+        self._buffered = 0
+        self._last_flush = 0.0
+        self._broken = False
+
+    async def write(self, text: str) -> None:
+        if not text or self._broken:
+            return
+        self._buffer.append(text)
+        self._buffered += len(text)
+        if self._buffered >= self.flush_chars or time.monotonic() - self._last_flush >= self.flush_interval:
+            await self.flush()
+
+    async def flush(self) -> None:
+        if not self._buffer:
+            return
+        text = ''.join(self._buffer)
+        self._buffer, self._buffered = [], 0
+        self.length += len(text)
+        self._last_flush = time.monotonic()
+        try:
+            await self.backend.append(self.task_id, text, self.length)
+        except Exception as e:
+            self._broken = True
+            logger.warning(f"Streaming disabled for task {self.task_id}: {str(e)}")
+
+    async def reset(self) -> None:
+        """Discard everything written so far (the output is being generated again)."""
+        self._buffer, self._buffered, self.length = [], 0, 0
+        self._broken = False
+        try:
+            await self.backend.reset(self.task_id)
+        except Exception as e:
+            self._broken = True
+            logger.warning(f"Streaming disabled for task {self.task_id}: {str(e)}")
+
+    async def close(self, error: Optional[str] = None) -> None:
+        await self.flush()
+        try:
+            await self.backend.finish(self.task_id, error)
+        except Exception as e:
+            logger.warning(f"Error finishing stream of task {self.task_id}: {str(e)}")
+
+
+def create_stream_backend(redis=None):
+    return RedisStreamBackend(redis) if redis else MemoryStreamBackend()
@@ -0,0 +1,207 @@
+# WorkflowAI Task Queue
+"""
+Database-backed task queue for ai_tasks.
+
+Rows in ``ai_tasks`` with status ``pending`` are the queue. Workers pick
+candidates with the fair scheduler (see scheduler.py), claim them through
+the ``claim_ai_tasks`` RPC (FOR UPDATE SKIP LOCKED), keep a heartbeat while
+they process them, and periodically re-queue tasks whose worker stopped
+heartbeating (crashed or killed).
+
+Pending tasks with the same prompt hash as a claimed one are claimed along
+with it (up to WORKER_MAX_FOLLOWERS), so the worker can coalesce them into
+one provider call (see coalescing.py).
+"""
+
+import asyncio
+import logging
+import os
+import socket
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from metrics import TASK_QUEUE_DEPTH, TASK_QUEUE_WAIT_SECONDS
+from scheduler import PRIORITY_WEIGHTS, FairScheduler
+
+logger = logging.getLogger(__name__)
+
+# Queue configuration
+WORKER_CONCURRENCY = int(os.getenv("WORKER_CONCURRENCY", "4"))  # tasks per worker process
+WORKER_MAX_IN_FLIGHT = int(os.getenv("WORKER_MAX_IN_FLIGHT", "0")) or None  # global cap, 0 = unlimited
+WORKER_POLL_INTERVAL = float(os.getenv("WORKER_POLL_INTERVAL", "1.0"))  # seconds
+WORKER_HEARTBEAT_INTERVAL = float(os.getenv("WORKER_HEARTBEAT_INTERVAL", "10"))  # seconds
+WORKER_STALE_AFTER = int(os.getenv("WORKER_STALE_AFTER", "60"))  # seconds without heartbeat
+WORKER_MAX_ATTEMPTS = int(os.getenv("WORKER_MAX_ATTEMPTS", "3"))
+WORKER_SHUTDOWN_GRACE = float(os.getenv("WORKER_SHUTDOWN_GRACE", "30"))  # seconds
+WORKER_CANDIDATE_LIMIT = int(os.getenv("WORKER_CANDIDATE_LIMIT", "1000"))  # pending heads fetched per poll
+WORKER_MAX_FOLLOWERS = int(os.getenv("WORKER_MAX_FOLLOWERS", "20"))  # identical tasks claimed along per poll
+
+
+def default_worker_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class TaskQueue:
+    """Claims, heartbeats and recovers ai_tasks rows for one worker."""
+
+    def __init__(
+        self,
+        db,
+        worker_id: str,
+        scheduler: Optional[FairScheduler] = None,
+        max_in_flight: Optional[int] = WORKER_MAX_IN_FLIGHT,
+        max_followers: int = WORKER_MAX_FOLLOWERS
+    ):
+        self.db = db
+        self.worker_id = worker_id
+        self.scheduler = scheduler or FairScheduler()
+        self.max_in_flight = max_in_flight
+        self.max_followers = max_followers
+
+    async def claim(self, limit: int) -> List[Dict[str, Any]]:
+        """Atomically move up to ``limit`` pending tasks to processing for this worker.
+
+        Tasks come back in scheduler order, followed by any pending duplicates
+        claimed along with them. Fewer than ``limit`` picks are returned when
+        the queue is short, another worker won the race for a pick, or the
+        global in-flight cap is reached.
+        """
+        if limit <= 0:
+            return []
+        heads = await self.db.pending_task_heads(limit, WORKER_CANDIDATE_LIMIT)
+        picks = self.scheduler.select(heads, limit)
+        if not picks:
+            return []
+
+        rows = await self.db.claim_tasks(
+            self.worker_id, [task['id'] for task in picks], self.max_in_flight, self.max_followers
+        )
+        claimed = {task['id']: task for task in rows}
+
+        tasks = [claimed.pop(task['id']) for task in picks if task['id'] in claimed]
+        tasks.extend(claimed.values())
+        for task in tasks:
+            waited = datetime.fromisoformat(task['started_at']) - datetime.fromisoformat(task['created_at'])
+            TASK_QUEUE_WAIT_SECONDS.labels(priority=task.get('priority') or 'normal').observe(
+                max(waited.total_seconds(), 0.0)
+            )
+        return tasks
+
+    async def heartbeat(self, task_ids: List[str]) -> None:
+        if not task_ids:
+            return
+        await self.db.heartbeat_tasks(self.worker_id, task_ids, datetime.now().isoformat())
+
+    async def release(self, task_ids: List[str]) -> None:
+        """Hand unfinished tasks back to the queue (graceful shutdown)."""
+        if not task_ids:
+            return
+        await self.db.release_tasks(self.worker_id, task_ids)
+
+    async def update_depth_metric(self) -> None:
+        depth = {row['priority']: row['count'] for row in await self.db.task_queue_depth()}
+        for priority in PRIORITY_WEIGHTS:
+            TASK_QUEUE_DEPTH.labels(priority=priority).set(depth.get(priority, 0))
+
+    async def requeue_stale(self, stale_after: int = WORKER_STALE_AFTER, max_attempts: int = WORKER_MAX_ATTEMPTS) -> int:
+        return await self.db.requeue_stale_tasks(stale_after, max_attempts)
+
+
+class TaskWorker:
+    """Runs claimed tasks with bounded concurrency inside one event loop."""
+
+    def __init__(
+        self,
+        queue: TaskQueue,
+        handler: Callable[[Dict[str, Any]], Awaitable[None]],
+        concurrency: int = WORKER_CONCURRENCY,
+        poll_interval: float = WORKER_POLL_INTERVAL,
+        heartbeat_interval: float = WORKER_HEARTBEAT_INTERVAL,
+        shutdown_grace: float = WORKER_SHUTDOWN_GRACE
+    ):
+        self.queue = queue
+        self.handler = handler
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self.heartbeat_interval = heartbeat_interval
+        self.shutdown_grace = shutdown_grace
+        self._in_flight: Dict[str, asyncio.Task] = {}
+        self._stopping = asyncio.Event()
+        self._wake = asyncio.Event()
+
+    def stop(self) -> None:
+        self._stopping.set()
+        self._wake.set()
+
+    def wake(self) -> None:
+        """Skip the rest of the current poll interval (e.g. after new tasks were inserted)."""
+        self._wake.set()
+
+    async def run(self) -> None:
+        logger.info(f"Task worker {self.queue.worker_id} started (concurrency={self.concurrency})")
+        maintenance = asyncio.create_task(self._maintenance_loop())
+        try:
+            while not self._stopping.is_set():
+                free_slots = self.concurrency - len(self._in_flight)
+                claimed = []
+                if free_slots > 0:
+                    try:
+                        claimed = await self.queue.claim(free_slots)
+                    except Exception as e:
+                        logger.error(f"Error claiming tasks: {str(e)}")
+
+                for task in claimed:
+                    self._start(task)
+
+                # Poll again right away if we filled every slot we asked for
+                if claimed and len(claimed) >= free_slots:
+                    continue
+
+                self._wake.clear()
+                try:
+                    await asyncio.wait_for(self._wake.wait(), timeout=self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            maintenance.cancel()
+            await self._drain()
+            logger.info(f"Task worker {self.queue.worker_id} stopped")
+
+    def _start(self, task: Dict[str, Any]) -> None:
+        task_id = task['id']
+        job = asyncio.create_task(self.handler(task))
+        self._in_flight[task_id] = job
+
+        def _done(_):
+            self._in_flight.pop(task_id, None)
+            self._wake.set()
+
+        job.add_done_callback(_done)
+
+    async def _maintenance_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.heartbeat_interval)
+            try:
+                await self.queue.heartbeat(list(self._in_flight))
+                requeued = await self.queue.requeue_stale()
+                if requeued:
+                    logger.warning(f"Re-queued {requeued} stale task(s)")
+                await self.queue.update_depth_metric()
+            except Exception as e:
+                logger.error(f"Task queue maintenance failed: {str(e)}")
+
+    async def _drain(self) -> None:
+        """Wait for in-flight tasks, then hand back whatever did not finish in time."""
+        if not self._in_flight:
+            return
+        logger.info(f"Waiting for {len(self._in_flight)} in-flight task(s) to finish")
+        _, pending = await asyncio.wait(list(self._in_flight.values()), timeout=self.shutdown_grace)
+        if pending:
+            unfinished = list(self._in_flight)
+            for job in pending:
+                job.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+            try:
+                await self.queue.release(unfinished)
+            except Exception as e:
+                logger.error(f"Error releasing unfinished tasks: {str(e)}")
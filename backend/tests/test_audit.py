@@ -0,0 +1,58 @@
+import asyncio
+
+from audit import BufferedWriter
+
+
+class FakeTable:
+    """Inserts rows unless one of them is bad (or the database is down)."""
+
+    def __init__(self):
+        self.rows = []
+        self.calls = 0
+        self.down = False
+
+    async def insert(self, rows):
+        self.calls += 1
+        if self.down:
+            raise ConnectionError("database unreachable")
+        if any(row.get('bad') for row in rows):
+            raise ValueError("invalid input syntax")
+        self.rows.extend(rows)
+
+
+def writer(table, **kwargs):
+    return BufferedWriter('audit_logs', table.insert, batch_size=8, **kwargs)
+
+
+def test_bad_row_does_not_block_the_batch():
+    table = FakeTable()
+    log = writer(table, max_row_attempts=2)
+    for i in range(20):
+        log.add({'n': i, 'bad': i == 5})
+
+    asyncio.run(log.flush())
+    assert [row['n'] for row in table.rows] == [i for i in range(20) if i != 5]
+    assert [row['n'] for row in log._rows] == [5]
+
+    log.add({'n': 20})
+    asyncio.run(log.flush())
+    assert table.rows[-1]['n'] == 20
+    assert not log._rows  # dropped after max_row_attempts
+
+
+def test_outage_keeps_rows_without_charging_attempts():
+    table = FakeTable()
+    table.down = True
+    log = writer(table, max_row_attempts=1)
+    for i in range(20):
+        log.add({'n': i})
+
+    for _ in range(3):
+        asyncio.run(log.flush())
+    assert len(log) == 20
+    assert table.calls < 3 * 20
+
+    table.down = False
+    asyncio.run(log.flush())
+    assert [row['n'] for row in table.rows] == list(range(20))
+    assert not log._rows
@@ -0,0 +1,27 @@
+from prometheus_client import REGISTRY
+
+from cache import TTLCache
+
+
+def sample(name, **labels):
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+
+def test_lookups_and_evictions_are_exported():
+    cache = TTLCache("test-lru", maxsize=2, ttl=60)
+    for key in "abc":
+        cache.set(key, key.upper())
+    assert cache.get("a") is None  # evicted
+    assert cache.get("c") == "C"
+    assert sample("workflowai_cache_evictions_total", cache="test-lru") == 1
+    assert sample("workflowai_cache_requests_total", cache="test-lru", result="hit") == 1
+    assert sample("workflowai_cache_requests_total", cache="test-lru", result="miss") == 1
+
+
+def test_entries_expire():
+    cache = TTLCache("test-ttl", maxsize=10, ttl=60)
+    cache.set("short", 1, ttl=-1)
+    cache.set("long", 2)
+    assert cache.get("short", "gone") == "gone"
+    assert cache.get("long") == 2
+    assert len(cache) == 1
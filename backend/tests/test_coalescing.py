@@ -0,0 +1,56 @@
+import asyncio
+
+import pytest
+
+from coalescing import TaskCoalescer
+from streams import MemoryStreamBackend, StreamWriter
+
+
+async def collect(events):
+    return [event async for event in events if event.kind != 'ping']
+
+
+def test_follower_takes_over_failed_leader_with_attached_reader():
+    async def scenario():
+        backend = MemoryStreamBackend()
+        coalescer = TaskCoalescer()
+        leader_started = asyncio.Event()
+        fail_leader = asyncio.Event()
+
+        async def failing(tee):
+            await tee.write("partial")
+            leader_started.set()
+            await fail_leader.wait()
+            raise RuntimeError("provider error")
+
+        async def succeeding(tee):
+            await tee.write("complete")
+            return {'type': 'text', 'content': "complete"}
+
+        async def follower():
+            stream = StreamWriter(backend, "follower", flush_chars=1)
+            result = await coalescer.run("key", "follower", stream, succeeding)
+            await stream.close()
+            return result
+
+        leader = asyncio.create_task(
+            coalescer.run("key", "leader", StreamWriter(backend, "leader", flush_chars=1), failing)
+        )
+        await leader_started.wait()
+        following = asyncio.create_task(follower())
+        await asyncio.sleep(0.01)
+        reader = asyncio.create_task(
+            asyncio.wait_for(collect(backend.read("follower", 0, heartbeat=0.05)), timeout=1)
+        )
+        await asyncio.sleep(0.01)
+        fail_leader.set()
+        with pytest.raises(RuntimeError):
+            await leader
+        return await following, await reader
+
+    (result, leader_id), events = asyncio.run(scenario())
+    assert result['content'] == "complete"
+    assert leader_id is None
+    assert [(e.kind, e.text) for e in events] == [
+        ('text', "partial"), ('reset', ""), ('text', "complete"), ('done', "")
+    ]
@@ -0,0 +1,35 @@
+import pytest
+
+from derivatives import SIZES, parse_specs, requested_specs
+
+
+def test_single_names_may_be_strings():
+    assert parse_specs({"sizes": "icon_64", "formats": "webp"}) == [("icon_64", "webp")]
+
+
+def test_all_sizes():
+    assert [size for size, _ in parse_specs({"sizes": "all"})] == list(SIZES)
+    assert parse_specs({"sizes": ["all"]}) == parse_specs({"sizes": "all"})
+
+
+@pytest.mark.parametrize("request_", [
+    ["icon_64"],
+    "icon_64",
+    {"sizes": {"icon_64": True}},
+    {"sizes": [64]},
+    {"sizes": ["icon_64"], "formats": [["png"]]},
+])
+def test_malformed_requests_are_rejected(request_):
+    with pytest.raises(ValueError):
+        parse_specs(request_)
+
+
+def test_unknown_names_are_rejected():
+    with pytest.raises(ValueError, match="icon_65"):
+        parse_specs({"sizes": ["icon_65"]})
+
+
+def test_category_default():
+    task = {'category': 'logo_design', 'input_data': {"style": "flat"}}
+    assert ("icon_16", "png") in requested_specs(task)
+
@@ -0,0 +1,30 @@
+import random
+
+from eta import DurationEstimator, DurationStats
+
+TASK = {'type': 'marketing', 'category': 'blog_post', 'title': "Post", 'description': None, 'input_data': None}
+
+
+def test_no_history_no_estimate():
+    estimator = DurationEstimator(db=None)
+    assert estimator.estimate(TASK) is None
+    assert estimator.estimate_p90(TASK) is None
+
+
+def test_p90_bounds_the_expected_duration():
+    random.seed(1)
+    estimator = DurationEstimator(db=None)
+    for _ in range(2000):
+        # Mostly ~10 s, one in five ~40 s
+        estimator.record(TASK, "gpt-4", random.gauss(40, 2) if random.random() < 0.2 else random.gauss(10, 1))
+
+    expected, p90 = estimator.estimate(TASK), estimator.estimate_p90(TASK)
+    assert 12 <= expected <= 22
+    assert 30 <= p90 <= 45
+    assert estimator.estimate_p90(TASK, "gpt-4") == p90
+
+
+def test_p90_is_never_below_the_typical_duration():
+    estimator = DurationEstimator(db=None)
+    estimator.stats[('marketing', 'blog_post', '')] = DurationStats(samples=3, ewma=20.0, p50=8.0, p90=5.0)
+    assert estimator.estimate_p90(TASK) >= estimator.estimate(TASK)
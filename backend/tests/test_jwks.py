@@ -0,0 +1,97 @@
+import asyncio
+import json
+import time
+
+import jwt
+import pytest
+from cryptography.hazmat.primitives.asymmetric import rsa
+from fastapi import HTTPException
+
+import main
+from cache import TTLCache
+from jwks import JWKSCache
+
+ISSUER = "https://clerk.example.test"
+
+
+def rsa_key():
+    return rsa.generate_private_key(public_exponent=65537, key_size=2048)
+
+
+KEYS = {'kid-1': rsa_key(), 'kid-2': rsa_key()}
+
+
+def write_jwks(path, *kids):
+    keys = [{**json.loads(jwt.algorithms.RSAAlgorithm.to_jwk(KEYS[kid].public_key())), 'kid': kid, 'use': 'sig'} for kid in kids]
+    path.write_text(json.dumps({'keys': keys}))
+
+
+def token(kid, expires_in=600, sub="clerk-1"):
+    now = int(time.time())
+    claims = {'sub': sub, 'iss': ISSUER, 'iat': now, 'exp': now + expires_in}
+    return jwt.encode(claims, KEYS[kid], algorithm='RS256', headers={'kid': kid})
+
+
+@pytest.fixture
+def jwks_file(tmp_path, monkeypatch):
+    """CLERK_JWKS_FILE for main.decode_token, initially holding kid-1."""
+    path = tmp_path / "jwks.json"
+    write_jwks(path, 'kid-1')
+    monkeypatch.setattr(main, 'jwks', JWKSCache(url=None, path=str(path), min_refresh_interval=0))
+    monkeypatch.setattr(main, 'token_cache', TTLCache("tokens", maxsize=100, ttl=300))
+    monkeypatch.setattr(main, 'CLERK_JWT_ISSUER', ISSUER)
+    return path
+
+
+def decode(value):
+    return asyncio.run(main.decode_token(value))
+
+
+def rejection(value) -> str:
+    with pytest.raises(HTTPException) as excinfo:
+        decode(value)
+    assert excinfo.value.status_code == 401
+    return excinfo.value.detail
+
+
+def test_valid_token(jwks_file):
+    assert decode(token('kid-1'))['sub'] == "clerk-1"
+
+
+def test_expired_token(jwks_file):
+    assert rejection(token('kid-1', expires_in=-60)) == "Token has expired"
+
+
+def test_wrong_issuer_and_bad_signature(jwks_file):
+    assert rejection(jwt.encode({'sub': "x", 'iss': "https://evil.test", 'exp': int(time.time()) + 60},
+                                KEYS['kid-1'], algorithm='RS256', headers={'kid': 'kid-1'})) == "Invalid token"
+    forged = jwt.encode({'sub': "x", 'iss': ISSUER, 'exp': int(time.time()) + 60},
+                        KEYS['kid-2'], algorithm='RS256', headers={'kid': 'kid-1'})
+    assert rejection(forged) == "Invalid token"
+
+
+def test_unknown_kid_refreshes_the_jwks(jwks_file):
+    decode(token('kid-1'))
+    assert rejection(token('kid-2')) == "Unknown signing key"
+    write_jwks(jwks_file, 'kid-1', 'kid-2')
+    assert decode(token('kid-2'))['sub'] == "clerk-1"
+
+
+def test_cached_token_rejected_after_its_kid_rotates_out(jwks_file):
+    cached = token('kid-1')
+    decode(cached)
+    assert len(main.token_cache) == 1
+
+    write_jwks(jwks_file, 'kid-2')
+    decode(token('kid-2'))  # unknown kid: refresh drops kid-1
+    assert not main.jwks.has_key('kid-1')
+    assert rejection(cached) == "Unknown signing key"
+
+
+def test_refresh_is_rate_limited(tmp_path):
+    path = tmp_path / "jwks.json"
+    write_jwks(path, 'kid-1')
+    cache = JWKSCache(url=None, path=str(path), min_refresh_interval=60)
+    assert asyncio.run(cache.get_key('kid-1')) is not None
+    write_jwks(path, 'kid-1', 'kid-2')
+    assert asyncio.run(cache.get_key('kid-2')) is None
@@ -0,0 +1,97 @@
+import asyncio
+import time
+
+import httpx
+import pytest
+
+from ratelimit import ProviderLimits, RateLimitTimeout
+
+MODEL = "gpt-4"
+
+
+class StubProvider:
+    """Answers like the OpenAI API: rate-limit headers on every response, 429s when told to."""
+
+    def __init__(self, limits):
+        self.limits = limits
+        self.responses = []  # (status, extra headers) for the next requests; then 200s
+        self.requests = 0
+        self.limit_seen = []  # limiter's concurrency limit at each request
+
+    def handler(self, request):
+        self.requests += 1
+        self.limit_seen.append(self.limits.get("openai", MODEL).limit)
+        status, headers = self.responses.pop(0) if self.responses else (200, {})
+        return httpx.Response(status, headers={
+            'x-ratelimit-limit-requests': "100",
+            'x-ratelimit-remaining-requests': "90",
+            'x-ratelimit-reset-requests': "1s",
+            **headers
+        }, json={})
+
+    def client(self):
+        return httpx.AsyncClient(
+            base_url="https://api.openai.test",
+            transport=httpx.MockTransport(self.handler),
+            event_hooks={'response': [self.limits.response_hook("openai")]}
+        )
+
+
+def run_calls(limits, stub, count):
+    async def scenario():
+        async with stub.client() as client:
+            async def call():
+                response = await client.post("/v1/chat/completions", json={'model': MODEL})
+                response.raise_for_status()
+                return response.status_code
+            return await asyncio.gather(*(limits.run("openai", MODEL, 10, call) for _ in range(count)))
+
+    return asyncio.run(scenario())
+
+
+def test_429_halves_concurrency_queues_calls_and_recovers():
+    limits = ProviderLimits(max_wait=5)
+    stub = StubProvider(limits)
+    stub.responses = [(429, {'retry-after': "0.05"})]
+
+    assert run_calls(limits, stub, 8) == [200] * 8
+    assert stub.requests == 9  # the rate-limited call went again
+    limiter = limits.get("openai", MODEL)
+    assert stub.limit_seen[0] == 4
+    assert min(stub.limit_seen) == 2
+    assert limiter.limit > 2
+
+
+def test_exhausted_budget_holds_calls_until_reset():
+    limits = ProviderLimits(max_wait=5)
+    stub = StubProvider(limits)
+    stub.responses = [(200, {'x-ratelimit-remaining-requests': "0", 'x-ratelimit-reset-requests': "200ms"})]
+
+    run_calls(limits, stub, 1)
+    started = time.monotonic()
+    assert run_calls(limits, stub, 1) == [200]
+    assert time.monotonic() - started >= 0.15
+
+
+def test_retry_after_wait_is_bounded_by_max_wait():
+    limits = ProviderLimits(max_wait=0.2)
+    stub = StubProvider(limits)
+    stub.responses = [(429, {'retry-after': "30"})]
+
+    started = time.monotonic()
+    with pytest.raises(RateLimitTimeout):
+        run_calls(limits, stub, 1)
+    assert time.monotonic() - started < 2
+
+
+def test_budget_wait_is_bounded_by_max_wait():
+    limits = ProviderLimits(max_wait=0.2)
+    stub = StubProvider(limits)
+    stub.responses = [(200, {'x-ratelimit-remaining-requests': "0", 'x-ratelimit-reset-requests': "30s"})]
+
+    run_calls(limits, stub, 1)
+    started = time.monotonic()
+    with pytest.raises(RateLimitTimeout):
+        run_calls(limits, stub, 1)
+    assert time.monotonic() - started < 2
+    assert stub.requests == 1
@@ -0,0 +1,22 @@
+from result_cache import generation_key
+
+PARAMS = {"model": "claude-3-sonnet-20240229", "max_tokens": 1500}
+
+
+def task(**fields):
+    return {'type': 'development', 'category': 'code_review', 'title': "Review", 'description': None, **fields}
+
+
+def test_code_differing_in_indentation_gets_different_keys():
+    flat = task(input_data={"code": "if x:\n    y()\nz()"})
+    nested = task(input_data={"code": "if x:\n    y()\n    z()"})
+    assert generation_key(flat, PARAMS) != generation_key(nested, PARAMS)
+
+
+def test_free_text_ends_are_trimmed():
+    assert generation_key(task(title="  Review\n"), PARAMS) == generation_key(task(title="Review"), PARAMS)
+    assert generation_key(task(title="Code  review"), PARAMS) != generation_key(task(title="Code review"), PARAMS)
+
+
+def test_key_ignores_input_data_key_order():
+    assert generation_key(task(input_data={"a": 1, "b": 2}), PARAMS) == generation_key(task(input_data={"b": 2, "a": 1}), PARAMS)
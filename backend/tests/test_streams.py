@@ -0,0 +1,141 @@
+import asyncio
+
+import main
+from streams import MemoryStreamBackend, StreamWriter
+
+
+async def collect(events):
+    return [event async for event in events if event.kind != 'ping']
+
+
+def test_reader_subscribed_before_reset_gets_new_output():
+    async def scenario():
+        backend = MemoryStreamBackend()
+        writer = StreamWriter(backend, "t1", flush_chars=1)
+        await writer.write("stale")
+        reader = asyncio.create_task(collect(backend.read("t1", 0, heartbeat=0.05)))
+        await asyncio.sleep(0.01)
+        await writer.reset()
+        await writer.write("fresh")
+        await writer.close()
+        return await asyncio.wait_for(reader, timeout=1)
+
+    events = asyncio.run(scenario())
+    assert [(e.kind, e.text) for e in events] == [
+        ('text', "stale"), ('reset', ""), ('text', "fresh"), ('done', "")
+    ]
+    assert events[-1].offset == len("fresh")
+
+
+def test_reader_resuming_after_reset_starts_over():
+    async def scenario():
+        backend = MemoryStreamBackend()
+        writer = StreamWriter(backend, "t1", flush_chars=1)
+        await writer.write("stale output")
+        await writer.reset()
+        await writer.write("new")
+        await writer.close()
+        return await collect(backend.read("t1", len("stale"), heartbeat=0.05))
+
+    events = asyncio.run(scenario())
+    assert [(e.kind, e.text) for e in events] == [('reset', ""), ('text', "new"), ('done', "")]
+
+
+def test_reset_of_finished_stream_keeps_it_past_retention():
+    async def scenario():
+        backend = MemoryStreamBackend(retention=0.01)
+        writer = StreamWriter(backend, "t1")
+        await writer.close()
+        await backend.reset("t1")
+        await asyncio.sleep(0.05)
+        return await backend.exists("t1")
+
+    assert asyncio.run(scenario())
+
+
+def test_reader_subscribed_before_handle_ai_task(monkeypatch):
+    class FakeDB:
+        async def create_task_result(self, row):
+            pass
+
+        async def update_task(self, task_id, data):
+            pass
+
+    async def fake_generation(task, stream):
+        await stream.write("hello")
+        return {'type': 'text', 'content': "hello"}
+
+    backend = MemoryStreamBackend()
+    monkeypatch.setattr(main, 'db', FakeDB())
+    monkeypatch.setattr(main, 'task_streams', backend)
+    monkeypatch.setattr(main, 'run_generation', fake_generation)
+    task = {'id': "t1", 'user_id': "u1", 'type': 'development', 'category': 'other', 'attempts': 1}
+
+    async def scenario():
+        reader = asyncio.create_task(collect(backend.read("t1", 0, heartbeat=0.05)))
+        await asyncio.sleep(0.01)
+        await main.handle_ai_task(task)
+        return await asyncio.wait_for(reader, timeout=1)
+
+    events = asyncio.run(scenario())
+    assert [(e.kind, e.text) for e in events] == [('text', "hello"), ('done', "")]
+
+
+def test_reader_without_producer_gets_an_error_and_leaves_nothing_behind():
+    async def scenario():
+        backend = MemoryStreamBackend(producer_wait=0.05)
+        events = await asyncio.wait_for(collect(backend.read("elsewhere", 0, heartbeat=0.02)), timeout=1)
+        return events, await backend.exists("elsewhere"), backend._streams
+
+    events, exists, streams = asyncio.run(scenario())
+    assert [event.kind for event in events] == ['done']
+    assert events[0].error
+    assert not exists
+    assert not streams
+
+
+def test_disconnected_reader_leaves_nothing_behind():
+    async def scenario():
+        backend = MemoryStreamBackend()
+        reader = asyncio.create_task(collect(backend.read("t1", 0, heartbeat=0.02)))
+        await asyncio.sleep(0.05)
+        reader.cancel()
+        await asyncio.gather(reader, return_exceptions=True)
+        return backend._streams
+
+    assert not asyncio.run(scenario())
+
+
+def test_failed_task_closes_its_stream_when_the_db_is_down(monkeypatch):
+    class BrokenDB:
+        async def update_task(self, task_id, data):
+            raise ConnectionError("database unreachable")
+
+    async def failing_generation(task, stream):
+        await stream.write("partial")
+        raise RuntimeError("provider error")
+
+    events_published = []
+
+    async def publish(task, status, progress=0):
+        events_published.append(status)
+
+    backend = MemoryStreamBackend()
+    monkeypatch.setattr(main, 'db', BrokenDB())
+    monkeypatch.setattr(main, 'task_streams', backend)
+    monkeypatch.setattr(main, 'run_generation', failing_generation)
+    monkeypatch.setattr(main, 'publish_task_event', publish)
+    task = {'id': "t1", 'user_id': "u1", 'type': 'development', 'category': 'other', 'attempts': 1}
+
+    async def scenario():
+        reader = asyncio.create_task(collect(backend.read("t1", 0, heartbeat=0.05)))
+        await asyncio.sleep(0.01)
+        try:
+            await main.handle_ai_task(task)
+        except ConnectionError:
+            pass
+        return await asyncio.wait_for(reader, timeout=1)
+
+    events = asyncio.run(scenario())
+    assert events[-1].kind == 'done' and events[-1].error == "Task failed"
+    assert events_published == ['processing', 'failed']
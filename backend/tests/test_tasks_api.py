@@ -0,0 +1,144 @@
+import uuid
+from datetime import datetime, timezone
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+
+USER = {'id': "user-1", 'clerk_id': "clerk-1"}
+
+
+def project(task, columns):
+    return task if columns == '*' else {column: task[column] for column in columns.split(',') if column in task}
+
+
+class FakeDB:
+    def __init__(self):
+        self.tasks = []
+        self.list_calls = []
+
+    async def create_tasks(self, rows):
+        created = [
+            {**row, 'id': str(uuid.uuid4()), 'created_at': datetime.now(timezone.utc).isoformat(), 'progress': 0}
+            for row in rows
+        ]
+        self.tasks += created
+        return created
+
+    async def list_user_tasks(self, user_id, limit, after=None, status=None, type=None, columns='*'):
+        self.list_calls.append({'after': after, 'columns': columns})
+        return [project(task, columns) for task in self.tasks[:limit]]
+
+    async def get_user_task(self, task_id, user_id, columns='*'):
+        self.list_calls.append({'columns': columns})
+        return next((project(task, columns) for task in self.tasks if task['id'] == task_id), None)
+
+
+@pytest.fixture
+def db(monkeypatch):
+    fake = FakeDB()
+    monkeypatch.setattr(main, 'db', fake)
+    return fake
+
+
+@pytest.fixture
+def client(db):
+    main.app.dependency_overrides[main.get_current_user] = lambda: USER
+    yield TestClient(main.app, base_url="http://localhost")
+    main.app.dependency_overrides.clear()
+
+
+def item(**fields):
+    return {'type': 'marketing', 'category': 'blog_post', 'title': "Post", **fields}
+
+
+@pytest.mark.parametrize("derivatives", [{"sizes": 5}, ["icon_64"]])
+def test_create_rejects_malformed_derivatives(client, derivatives):
+    response = client.post("/tasks", json=item(type='design', category='logo_design', input_data={"derivatives": derivatives}))
+    assert response.status_code == 422
+
+
+def test_batch_reports_invalid_items_and_queues_the_rest(client, db):
+    response = client.post("/tasks/batch", json=[
+        item(),
+        item(type='cooking'),
+        {'type': 'design'},
+        item(input_data={"derivatives": {"sizes": 5}}),
+        item(title="Second"),
+    ])
+    assert response.status_code == 200
+    body = response.json()
+    assert body['ids'][0] and body['ids'][4]
+    assert body['ids'][1:4] == [None, None, None]
+    assert [error['index'] for error in body['errors']] == [1, 2, 3]
+    assert body['errors'][0]['errors'][0]['loc'] == ['type']
+    assert {error['loc'][0] for error in body['errors'][1]['errors']} == {'category', 'title'}
+    assert [task['title'] for task in db.tasks] == ["Post", "Second"]
+    assert all(task['status'] == 'pending' and task['user_id'] == USER['id'] for task in db.tasks)
+
+
+def test_batch_with_only_invalid_items_inserts_nothing(client, db):
+    response = client.post("/tasks/batch", json=[item(priority='asap')])
+    assert response.json()['ids'] == [None]
+    assert not db.tasks
+
+
+def test_batch_over_the_limit_is_rejected(client, db, monkeypatch):
+    monkeypatch.setattr(main, 'MAX_BATCH_SIZE', 3)
+    response = client.post("/tasks/batch", json=[item()] * 4)
+    assert response.status_code == 413
+    assert not db.tasks
+
+
+def test_cursor_round_trip():
+    task = {'created_at': "2024-05-01T10:00:00.123456+00:00", 'id': str(uuid.uuid4())}
+    assert main.decode_cursor(main.encode_cursor(task)) == (task['created_at'], task['id'])
+
+
+@pytest.mark.parametrize("cursor", [
+    "not-base64!",
+    main.encode_cursor({'created_at': "2024-05-01T10:00:00+00:00", 'id': "x),id.gt.0"}),
+    main.encode_cursor({'created_at': "yesterday", 'id': str(uuid.uuid4())}),
+    main.encode_cursor({'created_at': 1714557600, 'id': str(uuid.uuid4())}),
+    main.encode_cursor({'created_at': "2024-05-01T10:00:00+00:00", 'id': None}),
+])
+def test_invalid_cursor_is_rejected(client, db, cursor):
+    response = client.get("/tasks", params={'cursor': cursor})
+    assert response.status_code == 400
+    assert not db.list_calls
+
+
+def test_next_page_starts_after_the_cursor(client, db):
+    client.post("/tasks/batch", json=[item(title=str(i)) for i in range(3)])
+    first = client.get("/tasks", params={'limit': 2}).json()
+    assert len(first['tasks']) == 2
+    client.get("/tasks", params={'limit': 2, 'cursor': first['next_cursor']})
+    last = db.tasks[1]
+    assert db.list_calls[-1]['after'] == (datetime.fromisoformat(last['created_at']).isoformat(), last['id'])
+
+
+def test_unknown_fields_are_rejected(client, db):
+    response = client.get("/tasks", params={'fields': "title,secret_column"})
+    assert response.status_code == 400
+    assert "secret_column" in response.json()['detail']
+    assert client.get("/tasks/some-id", params={'fields': "attempts"}).status_code == 400
+    assert not db.list_calls
+
+
+def test_selected_fields_are_passed_to_the_repository(client, db):
+    client.post("/tasks/batch", json=[item()])
+    response = client.get("/tasks", params={'fields': "title, status"})
+    assert db.list_calls[-1]['columns'] == "id,created_at,title,status"
+    assert set(response.json()['tasks'][0]) == {'id', 'created_at', 'title', 'status'}
+
+    task_id = db.tasks[0]['id']
+    client.get(f"/tasks/{task_id}", params={'fields': "progress"})
+    assert db.list_calls[-1]['columns'] == "id,progress"
+
+
+def test_default_columns(client, db):
+    client.get("/tasks")
+    assert db.list_calls[-1]['columns'].split(",") == ['id', 'created_at'] + [
+        field for field in main.TASK_LIST_FIELDS if field not in ('id', 'created_at')
+    ]
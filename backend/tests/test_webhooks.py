@@ -0,0 +1,77 @@
+import asyncio
+
+import httpx
+import pytest
+
+from webhooks import WebhookDispatcher, WebhookURLError, resolve_webhook_url
+
+PUBLIC_IP = "93.184.216.34"
+
+
+@pytest.mark.parametrize("url", [
+    "http://127.0.0.1/hook",
+    "http://localhost:9000/",
+    "http://10.0.0.5/",
+    "http://192.168.1.1/",
+    "http://169.254.169.254/latest/meta-data/",
+    "http://100.64.0.1/",
+    "http://0.0.0.0/",
+    "http://[::1]/",
+    "http://[::ffff:127.0.0.1]/",
+    "http://[fe80::1]/",
+    "http://240.0.0.1/",
+    "ftp://example.com/",
+    "not a url",
+])
+def test_non_public_urls_are_rejected(url):
+    with pytest.raises(WebhookURLError):
+        asyncio.run(resolve_webhook_url(url, allow_private=False))
+
+
+def test_public_address_is_returned():
+    url, address = asyncio.run(resolve_webhook_url(f"https://{PUBLIC_IP}:8443/hook", allow_private=False))
+    assert address == PUBLIC_IP
+    assert url.port == 8443
+
+
+def test_private_urls_allowed_when_configured():
+    _, address = asyncio.run(resolve_webhook_url("http://127.0.0.1:9000/", allow_private=True))
+    assert address == "127.0.0.1"
+
+
+def deliver(url, handler):
+    async def scenario():
+        dispatcher = WebhookDispatcher(db=None, max_attempts=2)
+        dispatcher._client = httpx.AsyncClient(transport=httpx.MockTransport(handler), follow_redirects=False)
+        try:
+            webhook = {'id': "w1", 'url': url, 'secret': "whsec_test"}
+            event = {'id': "e1", 'type': 'task.completed', 'data': {}}
+            return await dispatcher._deliver(webhook, event)
+        finally:
+            await dispatcher._client.aclose()
+
+    return asyncio.run(scenario())
+
+
+def test_delivery_to_private_address_is_refused():
+    requests = []
+    assert not deliver("http://localhost:9000/hook", lambda request: requests.append(request) or httpx.Response(200))
+    assert not requests
+
+
+def test_delivery_connects_to_checked_address():
+    requests = []
+    assert deliver(f"http://{PUBLIC_IP}/hook", lambda request: requests.append(request) or httpx.Response(204))
+    assert requests[0].url.host == PUBLIC_IP
+    assert requests[0].headers['host'] == PUBLIC_IP
+
+
+def test_redirects_are_not_followed():
+    requests = []
+
+    def handler(request):
+        requests.append(request)
+        return httpx.Response(302, headers={'Location': "http://127.0.0.1/"})
+
+    assert not deliver(f"http://{PUBLIC_IP}/hook", handler)
+    assert [request.url.host for request in requests] == [PUBLIC_IP]
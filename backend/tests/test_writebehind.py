@@ -0,0 +1,38 @@
+import asyncio
+
+from writebehind import PeriodicFlusher, lock_order
+
+
+class Counter(PeriodicFlusher):
+    def __init__(self, flush_interval):
+        super().__init__(flush_interval)
+        self.flushes = 0
+
+    async def flush(self):
+        self.flushes += 1
+
+
+def test_flush_soon_stop_and_interval():
+    async def scenario():
+        flusher = Counter(flush_interval=60)
+        flusher.start()
+        await asyncio.sleep(0.01)
+        assert flusher.flushes == 1  # first round right away
+        flusher.flush_soon()
+        await asyncio.sleep(0.01)
+        assert flusher.flushes == 2
+        await flusher.stop()
+        assert flusher.flushes == 3  # final flush
+
+        fast = Counter(flush_interval=0.01)
+        fast.start()
+        await asyncio.sleep(0.1)
+        await fast.stop()
+        assert fast.flushes > 3
+
+    asyncio.run(scenario())
+
+
+def test_lock_order():
+    assert lock_order([("b", 1), ("a", 2)]) == [("a", 2), ("b", 1)]
+    assert lock_order([{'k': 2}, {'k': 1}], key=lambda row: row['k']) == [{'k': 1}, {'k': 2}]
@@ -0,0 +1,124 @@
+# WorkflowAI Tracing
+"""
+OpenTelemetry tracing for the API server and the task workers.
+
+TRACING_EXPORTER selects where spans go:
+- ``none`` (default): the tracing calls are no-ops
+- ``file``: one JSON span per line appended to TRACING_FILE
+- ``otlp``: OTLP/HTTP to a collector (OTEL_EXPORTER_OTLP_ENDPOINT)
+
+Every API request gets a server span (continuing an incoming ``traceparent``);
+every database query and provider call gets a client span. ``POST /tasks``
+stores the W3C trace context in ``ai_tasks.trace_context`` so that the
+worker's processing span continues the request's trace. Spans created while
+a task is processed carry its task.id / user.id attributes.
+"""
+
+import os
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Optional
+
+from opentelemetry import propagate, trace
+from opentelemetry.trace import SpanKind, Status, StatusCode
+
+from metrics import route_template
+
+TRACING_EXPORTER = os.getenv("TRACING_EXPORTER", "none").lower()
+TRACING_FILE = os.getenv("TRACING_FILE", "traces.jsonl")
+TRACING_SERVICE_NAME = os.getenv("TRACING_SERVICE_NAME", "workflowai-api")
+
+# Resolves to the configured provider once setup_tracing() has run
+tracer = trace.get_tracer("workflowai")
+
+_task_attributes: ContextVar[Dict[str, Any]] = ContextVar("task_attributes", default={})
+
+
+def setup_tracing(service_name: str = TRACING_SERVICE_NAME) -> None:
+    if TRACING_EXPORTER in ("", "none"):
+        return
+    from opentelemetry.sdk.resources import Resource
+    from opentelemetry.sdk.trace import TracerProvider
+    from opentelemetry.sdk.trace.export import BatchSpanProcessor, ConsoleSpanExporter
+
+    if TRACING_EXPORTER == "file":
+        exporter = ConsoleSpanExporter(
+            out=open(TRACING_FILE, "a"),
+            formatter=lambda span: span.to_json(indent=None) + "\n"
+        )
+    elif TRACING_EXPORTER == "otlp":
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+        exporter = OTLPSpanExporter()
+    else:
+        raise ValueError(f"Unknown TRACING_EXPORTER: {TRACING_EXPORTER}")
+
+    provider = TracerProvider(resource=Resource.create({"service.name": service_name}))
+    provider.add_span_processor(BatchSpanProcessor(exporter))
+    trace.set_tracer_provider(provider)
+
+
+def shutdown_tracing() -> None:
+    """Flush buffered spans (no-op without an SDK provider)."""
+    provider = trace.get_tracer_provider()
+    if hasattr(provider, "shutdown"):
+        provider.shutdown()
+
+
+def inject_context() -> Optional[Dict[str, str]]:
+    """W3C trace context of the current span, to store with a task (None when not tracing)."""
+    carrier: Dict[str, str] = {}
+    propagate.inject(carrier)
+    return carrier or None
+
+
+@contextmanager
+def span(name: str, attributes: Optional[Dict[str, Any]] = None, kind: SpanKind = SpanKind.INTERNAL):
+    """Child span of the current one, tagged with the attributes of the task being processed."""
+    with tracer.start_as_current_span(name, kind=kind, attributes={**_task_attributes.get(), **(attributes or {})}) as current:
+        yield current
+
+
+@contextmanager
+def task_span(name: str, task: Dict[str, Any]):
+    """Root span of a task's processing, continuing the trace of the request that created it."""
+    attributes = {"task.id": task['id'], "user.id": task['user_id']}
+    token = _task_attributes.set(attributes)
+    try:
+        with tracer.start_as_current_span(
+            name,
+            context=propagate.extract(task.get('trace_context') or {}),
+            kind=SpanKind.CONSUMER,
+            attributes={**attributes, "task.type": task['type'], "task.category": task['category']}
+        ) as current:
+            yield current
+    finally:
+        _task_attributes.reset(token)
+
+
+class TracingMiddleware:
+    """ASGI middleware opening a server span per HTTP request."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        headers = {key.decode('latin-1'): value.decode('latin-1') for key, value in scope['headers']}
+        route = route_template(scope)
+        with tracer.start_as_current_span(
+            f"{scope['method']} {route}",
+            context=propagate.extract(headers),
+            kind=SpanKind.SERVER,
+            attributes={"http.method": scope['method'], "http.route": route}
+        ) as current:
+            async def send_with_status(message):
+                if message['type'] == 'http.response.start':
+                    current.set_attribute("http.status_code", message['status'])
+                    if message['status'] >= 500:
+                        current.set_status(Status(StatusCode.ERROR))
+                await send(message)
+
+            await self.app(scope, receive, send_with_status)
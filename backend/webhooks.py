@@ -0,0 +1,312 @@
+# WorkflowAI Webhook Delivery
+"""
+Delivery of task lifecycle events (``task.completed``, ``task.failed``) to
+the endpoints registered in the ``webhooks`` table.
+
+Publishing never waits on a receiver: events are queued per endpoint and
+sent by at most WEBHOOK_CONCURRENCY tasks per endpoint, over one pooled
+HTTP client. A slow or failing endpoint only holds up its own queue (at
+most WEBHOOK_QUEUE_SIZE events; the oldest are dropped beyond that).
+
+Each delivery is a JSON POST signed with the webhook's secret::
+
+    X-WorkflowAI-Signature: t=<unix time>,v1=<hex HMAC-SHA256 of "<t>.<body>">
+
+Transient failures (connection errors, timeouts, 408/429/5xx) are retried
+with full-jitter exponential backoff up to WEBHOOK_MAX_ATTEMPTS. A delivery
+that still fails bumps the webhook's ``failure_count``; after
+WEBHOOK_DISABLE_AFTER consecutive failed deliveries the webhook is
+deactivated. A successful delivery resets the count.
+
+Webhook URLs must resolve to public addresses: hosts are resolved and
+checked when a webhook is registered and again before every delivery, which
+then connects to the checked address (so a DNS change in between cannot
+point it at an internal service). Redirects are not followed. Set
+WEBHOOK_ALLOW_PRIVATE_URLS=true to deliver to local receivers in development.
+
+Queues live in the publishing process (usually a task worker); deliveries
+still queued when it dies hard are lost. Use scripts/webhook_sink.py as a
+local receiver.
+"""
+
+import asyncio
+import hashlib
+import hmac
+import ipaddress
+import json
+import logging
+import os
+import random
+import socket
+import time
+import uuid
+from collections import deque
+from datetime import datetime, timezone
+from typing import Any, Deque, Dict, Optional, Set, Tuple
+
+import httpx
+from opentelemetry.trace import SpanKind
+
+from cache import TTLCache
+from metrics import WEBHOOK_DELIVERIES
+from tracing import span
+
+logger = logging.getLogger(__name__)
+
+WEBHOOK_TIMEOUT = float(os.getenv("WEBHOOK_TIMEOUT", "10"))  # seconds per attempt
+WEBHOOK_CONCURRENCY = int(os.getenv("WEBHOOK_CONCURRENCY", "2"))  # deliveries in flight per endpoint
+WEBHOOK_QUEUE_SIZE = int(os.getenv("WEBHOOK_QUEUE_SIZE", "1000"))  # queued events per endpoint
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", "100"))  # across all endpoints
+WEBHOOK_MAX_ATTEMPTS = int(os.getenv("WEBHOOK_MAX_ATTEMPTS", "5"))
+WEBHOOK_RETRY_BASE_DELAY = float(os.getenv("WEBHOOK_RETRY_BASE_DELAY", "1"))  # seconds
+WEBHOOK_RETRY_MAX_DELAY = float(os.getenv("WEBHOOK_RETRY_MAX_DELAY", "60"))  # seconds
+WEBHOOK_DISABLE_AFTER = int(os.getenv("WEBHOOK_DISABLE_AFTER", "20"))  # consecutive failed deliveries
+WEBHOOK_CACHE_TTL = float(os.getenv("WEBHOOK_CACHE_TTL", "30"))  # seconds
+WEBHOOK_SHUTDOWN_GRACE = float(os.getenv("WEBHOOK_SHUTDOWN_GRACE", "5"))  # seconds
+WEBHOOK_ALLOW_PRIVATE_URLS = os.getenv("WEBHOOK_ALLOW_PRIVATE_URLS", "false").lower() == "true"
+
+WEBHOOK_EVENTS = {'task.completed', 'task.failed'}
+RETRYABLE_STATUS = {408, 429, 500, 502, 503, 504}
+
+
+class WebhookURLError(ValueError):
+    """A webhook URL that must not be called (not http(s), unresolvable or not public)."""
+
+
+def _is_public(address: ipaddress._BaseAddress) -> bool:
+    if isinstance(address, ipaddress.IPv6Address) and address.ipv4_mapped:
+        address = address.ipv4_mapped
+    # is_global excludes loopback, private, link-local, reserved and shared ranges
+    return address.is_global and not address.is_multicast
+
+
+async def resolve_webhook_url(url: str, allow_private: bool = WEBHOOK_ALLOW_PRIVATE_URLS) -> Tuple[httpx.URL, str]:
+    """The parsed URL and the address to connect to; WebhookURLError if it must not be called."""
+    try:
+        parsed = httpx.URL(url)
+    except httpx.InvalidURL:
+        raise WebhookURLError("Invalid webhook URL")
+    if parsed.scheme not in ("http", "https") or not parsed.host:
+        raise WebhookURLError("Webhook URL must be http(s)")
+    port = parsed.port or (443 if parsed.scheme == "https" else 80)
+    try:
+        infos = await asyncio.get_running_loop().getaddrinfo(parsed.host, port, type=socket.SOCK_STREAM)
+    except socket.gaierror:
+        raise WebhookURLError(f"Webhook host {parsed.host} could not be resolved")
+    addresses = [ipaddress.ip_address(info[4][0].split("%")[0]) for info in infos]
+    if not addresses:
+        raise WebhookURLError(f"Webhook host {parsed.host} could not be resolved")
+    blocked = [address for address in addresses if not _is_public(address)]
+    if blocked and not allow_private:
+        raise WebhookURLError(f"Webhook host {parsed.host} resolves to a non-public address ({blocked[0]})")
+    return parsed, str(addresses[0])
+
+
+def sign_payload(secret: str, body: bytes, timestamp: int) -> str:
+    digest = hmac.new(secret.encode(), f"{timestamp}.".encode() + body, hashlib.sha256).hexdigest()
+    return f"t={timestamp},v1={digest}"
+
+
+def verify_signature(secret: str, header: str, body: bytes, tolerance: float = 300) -> bool:
+    """Check an X-WorkflowAI-Signature header (for receivers and tests)."""
+    try:
+        parts = dict(part.split("=", 1) for part in header.split(","))
+        timestamp = int(parts['t'])
+    except (KeyError, ValueError):
+        return False
+    if abs(time.time() - timestamp) > tolerance:
+        return False
+    return hmac.compare_digest(sign_payload(secret, body, timestamp), f"t={timestamp},v1={parts.get('v1', '')}")
+
+
+class _Endpoint:
+    """Queue and delivery tasks of one webhook."""
+
+    def __init__(self, webhook: Dict[str, Any]):
+        self.webhook = webhook
+        self.queue: Deque[Dict[str, Any]] = deque()
+        self.workers = 0
+
+
+class WebhookDispatcher:
+    """Fans task events out to webhook subscribers without blocking the publisher."""
+
+    def __init__(
+        self,
+        db,
+        concurrency: int = WEBHOOK_CONCURRENCY,
+        queue_size: int = WEBHOOK_QUEUE_SIZE,
+        max_attempts: int = WEBHOOK_MAX_ATTEMPTS
+    ):
+        self.db = db
+        self.concurrency = concurrency
+        self.queue_size = queue_size
+        self.max_attempts = max_attempts
+        self.subscribers = TTLCache("webhooks", maxsize=10000, ttl=WEBHOOK_CACHE_TTL)
+        self._endpoints: Dict[str, _Endpoint] = {}
+        self._tasks: Set[asyncio.Task] = set()
+        self._client: Optional[httpx.AsyncClient] = None
+
+    def start(self) -> None:
+        self._client = httpx.AsyncClient(
+            timeout=WEBHOOK_TIMEOUT,
+            follow_redirects=False,
+            limits=httpx.Limits(max_connections=WEBHOOK_MAX_CONNECTIONS, max_keepalive_connections=WEBHOOK_MAX_CONNECTIONS)
+        )
+
+    async def stop(self, grace: float = WEBHOOK_SHUTDOWN_GRACE) -> None:
+        """Give queued deliveries ``grace`` seconds, then cancel the rest."""
+        if self._tasks:
+            await asyncio.wait(set(self._tasks), timeout=grace)
+        for task in list(self._tasks):
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        dropped = sum(len(endpoint.queue) for endpoint in self._endpoints.values())
+        if dropped:
+            logger.warning(f"Dropping {dropped} undelivered webhook events on shutdown")
+        self._endpoints.clear()
+        if self._client:
+            await self._client.aclose()
+            self._client = None
+
+    def publish(self, event_type: str, task: Dict[str, Any], data: Dict[str, Any]) -> None:
+        """Queue ``event_type`` for the task owner's (and team's) webhooks; returns immediately."""
+        if not self._client or not self.db:
+            return
+        event = {
+            "id": str(uuid.uuid4()),
+            "type": event_type,
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "data": data
+        }
+        self._spawn(self._fan_out(task['user_id'], task.get('team_id'), event))
+
+    def _spawn(self, coro) -> asyncio.Task:
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    async def _fan_out(self, user_id: str, team_id: Optional[str], event: Dict[str, Any]) -> None:
+        key = (user_id, team_id)
+        webhooks = self.subscribers.get(key)
+        if webhooks is None:
+            try:
+                webhooks = await self.db.list_active_webhooks(user_id, team_id)
+            except Exception as e:
+                logger.error(f"Error loading webhooks of user {user_id}: {str(e)}")
+                return
+            self.subscribers.set(key, webhooks)
+        for webhook in webhooks:
+            if event['type'] in (webhook.get('events') or []):
+                self._enqueue(webhook, event)
+
+    def _enqueue(self, webhook: Dict[str, Any], event: Dict[str, Any]) -> None:
+        endpoint = self._endpoints.get(webhook['id'])
+        if endpoint is None:
+            endpoint = self._endpoints[webhook['id']] = _Endpoint(webhook)
+        endpoint.webhook = webhook
+        if len(endpoint.queue) >= self.queue_size:
+            endpoint.queue.popleft()
+            WEBHOOK_DELIVERIES.labels(outcome='dropped').inc()
+        endpoint.queue.append(event)
+        if endpoint.workers < self.concurrency:
+            endpoint.workers += 1
+            self._spawn(self._drain(endpoint))
+
+    async def _drain(self, endpoint: _Endpoint) -> None:
+        try:
+            while endpoint.queue:
+                event = endpoint.queue.popleft()
+                delivered = await self._deliver(endpoint.webhook, event)
+                if not await self._record_outcome(endpoint, delivered):
+                    break
+        finally:
+            endpoint.workers -= 1
+            if not endpoint.workers:
+                self._endpoints.pop(endpoint.webhook['id'], None)
+
+    async def _deliver(self, webhook: Dict[str, Any], event: Dict[str, Any]) -> bool:
+        """POST ``event`` with retries; True once the receiver answered 2xx."""
+        try:
+            url, address = await resolve_webhook_url(webhook['url'])
+        except WebhookURLError as e:
+            WEBHOOK_DELIVERIES.labels(outcome='failed').inc()
+            logger.warning(f"Webhook {webhook['id']} delivery {event['id']} refused: {str(e)}")
+            return False
+        # Connect to the checked address; Host and TLS name stay those of the URL
+        target = url.copy_with(host=address)
+        extensions = {"sni_hostname": url.host} if url.scheme == "https" else {}
+        body = json.dumps(event, default=str, separators=(",", ":")).encode()
+        headers = {
+            "Host": url.netloc.decode("ascii"),
+            "Content-Type": "application/json",
+            "User-Agent": "WorkflowAI-Webhooks/1.0",
+            "X-WorkflowAI-Event": event['type'],
+            "X-WorkflowAI-Delivery": event['id']
+        }
+        for attempt in range(self.max_attempts):
+            if webhook.get('secret'):
+                headers["X-WorkflowAI-Signature"] = sign_payload(webhook['secret'], body, int(time.time()))
+            retryable = True
+            try:
+                with span("webhook.deliver", {"webhook.id": webhook['id'], "event.type": event['type']}, kind=SpanKind.CLIENT):
+                    response = await self._client.post(target, content=body, headers=headers, extensions=extensions)
+                if response.is_success:
+                    WEBHOOK_DELIVERIES.labels(outcome='delivered').inc()
+                    return True
+                retryable = response.status_code in RETRYABLE_STATUS
+                error = f"HTTP {response.status_code}"
+            except httpx.HTTPError as e:
+                error = f"{type(e).__name__}: {str(e)}"
+            if not retryable or attempt == self.max_attempts - 1:
+                break
+            delay = random.uniform(0, min(WEBHOOK_RETRY_MAX_DELAY, WEBHOOK_RETRY_BASE_DELAY * 2 ** attempt))
+            WEBHOOK_DELIVERIES.labels(outcome='retried').inc()
+            await asyncio.sleep(delay)
+        WEBHOOK_DELIVERIES.labels(outcome='failed').inc()
+        logger.warning(f"Webhook {webhook['id']} delivery {event['id']} failed after {attempt + 1} attempts ({error})")
+        return False
+
+    async def _record_outcome(self, endpoint: _Endpoint, delivered: bool) -> bool:
+        """Update the webhook's delivery state; False once it has been disabled."""
+        webhook = endpoint.webhook
+        try:
+            if delivered:
+                await self.db.record_webhook_delivery(webhook['id'], datetime.now(timezone.utc).isoformat())
+                return True
+            active = await self.db.record_webhook_failure(webhook['id'], WEBHOOK_DISABLE_AFTER)
+        except Exception as e:
+            logger.error(f"Error updating webhook {webhook['id']}: {str(e)}")
+            return True
+        if active or webhook.get('is_active') is False:
+            return bool(active)
+        logger.warning(f"Webhook {webhook['id']} disabled after {WEBHOOK_DISABLE_AFTER} failed deliveries")
+        WEBHOOK_DELIVERIES.labels(outcome='dropped').inc(len(endpoint.queue))
+        endpoint.queue.clear()
+        endpoint.webhook = {**webhook, "is_active": False}
+        self.subscribers.clear()
+        return False
+
+    def invalidate(self) -> None:
+        """Forget cached subscriptions (after webhooks were added, changed or removed)."""
+        self.subscribers.clear()
+
+
+def webhook_event_data(task: Dict[str, Any], status: str, result: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """Payload ``data`` of a task lifecycle event."""
+    data = {
+        "task_id": task['id'],
+        "team_id": task.get('team_id'),
+        "type": task['type'],
+        "category": task['category'],
+        "title": task.get('title'),
+        "status": status
+    }
+    if result is not None:
+        data["result"] = {
+            "result_type": result.get('type'),
+            "content": result.get('content'),
+            "file_url": result.get('file_url')
+        }
+    return data
@@ -0,0 +1,94 @@
+# WorkflowAI Task Worker
+"""
+Standalone worker pool for AI generation tasks.
+
+Runs independently of the API server so generation capacity can be scaled
+separately from request handling. Each process claims pending ai_tasks rows
+from the database queue (see task_queue.py) and processes up to
+WORKER_CONCURRENCY of them at once.
+
+Usage:
+    cd backend
+    WORKER_PROCESSES=4 WORKER_CONCURRENCY=8 python worker.py
+"""
+
+import asyncio
+import logging
+import multiprocessing
+import os
+import signal
+import time
+
+logger = logging.getLogger("worker")
+
+WORKER_PROCESSES = int(os.getenv("WORKER_PROCESSES", "2"))
+
+
+def run_worker_process(index: int) -> None:
+    """Entry point of a single worker process."""
+    # Imported here so every spawned process builds its own clients
+    from prometheus_client import start_http_server
+
+    from main import db, process_ai_task, shutdown, startup
+    from metrics import WORKER_METRICS_PORT
+    from task_queue import TaskQueue, TaskWorker, default_worker_id
+
+    if not db:
+        raise RuntimeError("Database client not initialized - missing credentials")
+    if WORKER_METRICS_PORT:
+        start_http_server(WORKER_METRICS_PORT + index)
+
+    async def _main():
+        await startup("workflowai-worker")
+        worker = TaskWorker(TaskQueue(db, default_worker_id()), process_ai_task)
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(sig, worker.stop)
+        try:
+            await worker.run()
+        finally:
+            await shutdown()
+
+    asyncio.run(_main())
+
+
+def main() -> None:
+    logging.basicConfig(level=logging.INFO)
+    ctx = multiprocessing.get_context("spawn")
+    processes = {}
+    stopping = False
+
+    def _start(index: int):
+        process = ctx.Process(target=run_worker_process, args=(index,), name=f"worker-{index}")
+        process.start()
+        processes[index] = process
+        logger.info(f"Started worker-{index} (PID: {process.pid})")
+
+    def _stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for process in processes.values():
+            if process.is_alive():
+                process.terminate()  # SIGTERM -> graceful drain in the child
+
+    signal.signal(signal.SIGTERM, _stop)
+    signal.signal(signal.SIGINT, _stop)
+
+    for index in range(WORKER_PROCESSES):
+        _start(index)
+
+    # Supervise: restart crashed workers until asked to stop
+    while not stopping:
+        for index, process in list(processes.items()):
+            if not process.is_alive() and not stopping:
+                logger.warning(f"worker-{index} exited with code {process.exitcode}, restarting")
+                _start(index)
+        time.sleep(1)
+
+    for process in processes.values():
+        process.join()
+    logger.info("All workers stopped")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+# WorkflowAI Write-Behind Buffers
+"""
+Shared plumbing of the in-memory buffers that write to the database in the
+background (user stats, task durations, usage and audit rows).
+
+``PeriodicFlusher`` runs a buffer's ``flush()`` every ``flush_interval``
+seconds, sooner after ``flush_soon()``, and once more on ``stop()``.
+"""
+
+import asyncio
+from typing import Any, Callable, Iterable, List, Optional, TypeVar
+
+T = TypeVar("T")
+
+
+def lock_order(items: Iterable[T], key: Optional[Callable[[T], Any]] = None) -> List[T]:
+    """``items`` in a fixed order for a batched write.
+
+    Concurrent flushes from several workers then lock the rows they update
+    in the same order, so they wait for each other instead of deadlocking.
+    """
+    return sorted(items, key=key)
+
+
+class PeriodicFlusher:
+    """Background loop calling ``flush()``; subclasses implement it."""
+
+    def __init__(self, flush_interval: float):
+        self.flush_interval = flush_interval
+        self._flush_now = asyncio.Event()
+        self._task = None
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.flush()
+
+    def flush_soon(self) -> None:
+        self._flush_now.set()
+
+    async def flush(self) -> None:
+        raise NotImplementedError
+
+    async def tick(self) -> None:
+        """One round of the loop; flushes by default."""
+        await self.flush()
+
+    async def _run(self) -> None:
+        while True:
+            await self.tick()
+            try:
+                await asyncio.wait_for(self._flush_now.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._flush_now.clear()
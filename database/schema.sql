@@ -59,9 +59,15 @@ CREATE TABLE ai_tasks (
     progress INTEGER DEFAULT 0 CHECK (progress >= 0 AND progress <= 100),
     priority VARCHAR(20) DEFAULT 'normal' CHECK (priority IN ('low', 'normal', 'high', 'urgent')),
     estimated_duration INTEGER, -- in seconds
+    estimated_duration_p90 INTEGER, -- in seconds; 9 in 10 similar tasks finish within it
     actual_duration INTEGER, -- in seconds
     credits_cost INTEGER DEFAULT 1,
     mcp_server_used VARCHAR(100), -- which MCP server processed this
+    claimed_by VARCHAR(255), -- worker id holding the task while processing
+    heartbeat_at TIMESTAMPTZ, -- last liveness ping from the claiming worker
+    attempts INTEGER DEFAULT 0, -- number of times a worker has claimed the task
+    prompt_hash VARCHAR(64), -- SHA-256 of the generation inputs; identical tasks share one provider call
+    trace_context JSONB, -- W3C trace context of the request that created the task
     created_at TIMESTAMPTZ DEFAULT NOW(),
     started_at TIMESTAMPTZ,
     completed_at TIMESTAMPTZ,
@@ -82,6 +88,51 @@ CREATE TABLE task_results (
     created_at TIMESTAMPTZ DEFAULT NOW()
 );
 
+-- Task counters per user and team (kept current by triggers on ai_tasks)
+CREATE TABLE ai_task_counters (
+    scope VARCHAR(10) NOT NULL CHECK (scope IN ('user', 'team')),
+    scope_id UUID NOT NULL, -- users.id or teams.id
+    type VARCHAR(50) NOT NULL,
+    status VARCHAR(50) NOT NULL,
+    count BIGINT NOT NULL DEFAULT 0,
+    PRIMARY KEY (scope, scope_id, type, status)
+);
+
+-- Result cache (content-addressed by a hash of prompt inputs, model and parameters)
+CREATE TABLE ai_result_cache (
+    cache_key VARCHAR(64) PRIMARY KEY, -- SHA-256 hex
+    result JSONB NOT NULL, -- result_type, content, file_url, metadata
+    created_at TIMESTAMPTZ DEFAULT NOW(),
+    expires_at TIMESTAMPTZ NOT NULL
+);
+
+-- Image derivatives (resized / re-encoded copies of a blob, see backend/derivatives.py)
+CREATE TABLE blob_derivatives (
+    source_sha256 VARCHAR(64) NOT NULL,
+    name VARCHAR(50) NOT NULL, -- size preset, e.g. 'instagram_post', 'icon_64'
+    format VARCHAR(10) NOT NULL, -- 'png', 'webp', 'jpeg'
+    width INTEGER NOT NULL,
+    height INTEGER NOT NULL,
+    sha256 VARCHAR(64) NOT NULL, -- blob of the derivative
+    size_bytes INTEGER NOT NULL,
+    created_at TIMESTAMPTZ DEFAULT NOW(),
+    PRIMARY KEY (source_sha256, name, format)
+);
+
+-- Task duration statistics (see backend/eta.py). Values are seconds per unit
+-- of input size; model '' aggregates all models of a (type, category).
+CREATE TABLE ai_task_duration_stats (
+    type VARCHAR(50) NOT NULL,
+    category VARCHAR(100) NOT NULL,
+    model VARCHAR(100) NOT NULL DEFAULT '',
+    samples BIGINT NOT NULL DEFAULT 0,
+    ewma DOUBLE PRECISION NOT NULL,
+    p50 DOUBLE PRECISION NOT NULL,
+    p90 DOUBLE PRECISION NOT NULL,
+    updated_at TIMESTAMPTZ DEFAULT NOW(),
+    PRIMARY KEY (type, category, model)
+);
+
 -- Platform Integrations table (Figma, GitHub, Slack)
 CREATE TABLE platform_integrations (
     id UUID PRIMARY KEY DEFAULT uuid_generate_v4(),
@@ -127,9 +178,7 @@ CREATE TABLE usage_tracking (
     quantity INTEGER DEFAULT 1,
     credits_consumed INTEGER DEFAULT 1,
     month_year VARCHAR(7) NOT NULL, -- 'YYYY-MM' format
-    created_at TIMESTAMPTZ DEFAULT NOW(),
-    INDEX(user_id, month_year),
-    INDEX(team_id, month_year)
+    created_at TIMESTAMPTZ DEFAULT NOW()
 );
 
 -- API Keys table (for external integrations)
@@ -172,9 +221,7 @@ CREATE TABLE audit_logs (
     ip_address INET,
     user_agent TEXT,
     metadata JSONB,
-    created_at TIMESTAMPTZ DEFAULT NOW(),
-    INDEX(user_id, created_at),
-    INDEX(action, created_at)
+    created_at TIMESTAMPTZ DEFAULT NOW()
 );
 
 -- Create indexes for better performance
@@ -182,10 +229,21 @@ CREATE INDEX idx_ai_tasks_user_id_status ON ai_tasks(user_id, status);
 CREATE INDEX idx_ai_tasks_team_id_status ON ai_tasks(team_id, status) WHERE team_id IS NOT NULL;
 CREATE INDEX idx_ai_tasks_type_status ON ai_tasks(type, status);
 CREATE INDEX idx_ai_tasks_created_at ON ai_tasks(created_at DESC);
+CREATE INDEX idx_ai_tasks_user_id_created_at_id ON ai_tasks(user_id, created_at DESC, id DESC); -- GET /tasks keyset pages
+CREATE INDEX idx_ai_tasks_pending ON ai_tasks(created_at) WHERE status = 'pending';
+CREATE INDEX idx_ai_tasks_pending_prompt_hash ON ai_tasks(prompt_hash) WHERE status = 'pending';
+CREATE INDEX idx_ai_tasks_processing_heartbeat ON ai_tasks(heartbeat_at) WHERE status = 'processing';
 CREATE INDEX idx_task_results_task_id ON task_results(task_id);
+CREATE INDEX idx_ai_result_cache_expires_at ON ai_result_cache(expires_at);
 CREATE INDEX idx_users_clerk_id ON users(clerk_id);
 CREATE INDEX idx_users_email ON users(email);
 CREATE INDEX idx_subscriptions_stripe_customer_id ON subscriptions(stripe_customer_id);
+CREATE INDEX idx_usage_tracking_user_id_month_year ON usage_tracking(user_id, month_year);
+CREATE INDEX idx_usage_tracking_team_id_month_year ON usage_tracking(team_id, month_year) WHERE team_id IS NOT NULL;
+CREATE INDEX idx_audit_logs_user_id_created_at ON audit_logs(user_id, created_at);
+CREATE INDEX idx_audit_logs_action_created_at ON audit_logs(action, created_at);
+CREATE INDEX idx_webhooks_user_id ON webhooks(user_id);
+CREATE INDEX idx_webhooks_team_id ON webhooks(team_id) WHERE team_id IS NOT NULL;
 
 -- Create updated_at trigger function
 CREATE OR REPLACE FUNCTION update_updated_at_column()
@@ -196,6 +254,258 @@ BEGIN
 END;
 $$ language 'plpgsql';
 
+-- Task queue: candidate tasks for the scheduler. Returns the oldest pending
+-- tasks of every (tenant, priority) group so one tenant's backlog can't hide
+-- other tenants' work from the worker's fair scheduler.
+CREATE OR REPLACE FUNCTION pending_ai_task_heads(
+    p_per_group INTEGER,
+    p_max_rows INTEGER DEFAULT 1000
+)
+RETURNS TABLE (
+    id UUID,
+    user_id UUID,
+    team_id UUID,
+    priority VARCHAR,
+    created_at TIMESTAMPTZ,
+    estimated_duration INTEGER
+) AS $$
+    SELECT h.id, h.user_id, h.team_id, h.priority, h.created_at, h.estimated_duration
+    FROM (
+        SELECT t.id, t.user_id, t.team_id, t.priority, t.created_at, t.estimated_duration,
+               ROW_NUMBER() OVER (
+                   PARTITION BY COALESCE(t.team_id, t.user_id), t.priority
+                   ORDER BY t.created_at
+               ) AS rn
+        FROM ai_tasks t
+        WHERE t.status = 'pending'
+    ) h
+    WHERE h.rn <= p_per_group
+    ORDER BY h.created_at
+    LIMIT p_max_rows;
+$$ LANGUAGE sql STABLE;
+
+-- Task queue: atomically claim the tasks picked by a worker's scheduler.
+-- Rows already claimed by another worker are skipped (SKIP LOCKED / status
+-- check); p_max_in_flight caps processing tasks across all workers.
+CREATE OR REPLACE FUNCTION claim_ai_tasks(
+    p_worker_id TEXT,
+    p_task_ids UUID[],
+    p_max_in_flight INTEGER DEFAULT NULL,
+    p_max_followers INTEGER DEFAULT 0
+)
+RETURNS SETOF ai_tasks AS $$
+DECLARE
+    v_slots INTEGER := COALESCE(array_length(p_task_ids, 1), 0);
+BEGIN
+    IF p_max_in_flight IS NOT NULL THEN
+        -- Serialize capacity checks so two workers can't both see the last free slot
+        PERFORM pg_advisory_xact_lock(hashtext('claim_ai_tasks'));
+        SELECT LEAST(v_slots, p_max_in_flight - COUNT(*))::INTEGER INTO v_slots
+        FROM ai_tasks WHERE status = 'processing';
+    END IF;
+
+    IF v_slots <= 0 THEN
+        RETURN;
+    END IF;
+
+    RETURN QUERY
+    WITH picked AS (
+        SELECT c.id, c.prompt_hash FROM ai_tasks c
+        JOIN unnest(p_task_ids) WITH ORDINALITY AS pick(id, ord) ON pick.id = c.id
+        WHERE c.status = 'pending'
+        ORDER BY pick.ord
+        LIMIT v_slots
+        FOR UPDATE OF c SKIP LOCKED
+    ),
+    -- Pending duplicates of the picks go to the same worker, which runs them as
+    -- followers of a single provider call; they may exceed p_max_in_flight
+    followers AS (
+        SELECT f.id FROM ai_tasks f
+        WHERE f.status = 'pending'
+          AND f.prompt_hash IN (SELECT prompt_hash FROM picked)
+          AND f.id NOT IN (SELECT id FROM picked)
+        ORDER BY f.created_at
+        LIMIT p_max_followers
+        FOR UPDATE SKIP LOCKED
+    )
+    UPDATE ai_tasks t
+    SET status = 'processing',
+        started_at = NOW(),
+        heartbeat_at = NOW(),
+        claimed_by = p_worker_id,
+        attempts = t.attempts + 1
+    WHERE t.id IN (SELECT id FROM picked UNION ALL SELECT id FROM followers)
+    RETURNING t.*;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Task queue: pending tasks per priority, for the queue depth metric
+CREATE OR REPLACE FUNCTION ai_task_queue_depth()
+RETURNS TABLE(priority VARCHAR, count BIGINT) AS $$
+    SELECT t.priority, COUNT(*) FROM ai_tasks t WHERE t.status = 'pending' GROUP BY t.priority;
+$$ LANGUAGE sql STABLE;
+
+-- Task queue: crash recovery. Tasks whose worker stopped heartbeating go back
+-- to pending, or to failed once they have used up their attempts.
+CREATE OR REPLACE FUNCTION requeue_stale_ai_tasks(
+    p_stale_seconds INTEGER,
+    p_max_attempts INTEGER
+)
+RETURNS INTEGER AS $$
+DECLARE
+    v_count INTEGER;
+BEGIN
+    WITH stale AS (
+        SELECT id FROM ai_tasks
+        WHERE status = 'processing'
+          AND heartbeat_at < NOW() - make_interval(secs => p_stale_seconds)
+        FOR UPDATE SKIP LOCKED
+    )
+    UPDATE ai_tasks t
+    SET status = CASE WHEN t.attempts >= p_max_attempts THEN 'failed' ELSE 'pending' END,
+        progress = 0,
+        claimed_by = NULL,
+        heartbeat_at = NULL
+    FROM stale
+    WHERE t.id = stale.id;
+
+    GET DIAGNOSTICS v_count = ROW_COUNT;
+    RETURN v_count;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Task counters: apply a +1/-1 to the user's (and team's) counter rows
+CREATE OR REPLACE FUNCTION bump_ai_task_counters(
+    p_user_id UUID,
+    p_team_id UUID,
+    p_type VARCHAR,
+    p_status VARCHAR,
+    p_delta INTEGER
+)
+RETURNS VOID AS $$
+BEGIN
+    INSERT INTO ai_task_counters (scope, scope_id, type, status, count)
+    VALUES ('user', p_user_id, p_type, p_status, p_delta)
+    ON CONFLICT (scope, scope_id, type, status)
+    DO UPDATE SET count = ai_task_counters.count + EXCLUDED.count;
+
+    IF p_team_id IS NOT NULL THEN
+        INSERT INTO ai_task_counters (scope, scope_id, type, status, count)
+        VALUES ('team', p_team_id, p_type, p_status, p_delta)
+        ON CONFLICT (scope, scope_id, type, status)
+        DO UPDATE SET count = ai_task_counters.count + EXCLUDED.count;
+    END IF;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION track_ai_task_counters()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        PERFORM bump_ai_task_counters(OLD.user_id, OLD.team_id, OLD.type, OLD.status, -1);
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        PERFORM bump_ai_task_counters(NEW.user_id, NEW.team_id, NEW.type, NEW.status, 1);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER track_ai_task_counters_insert_delete
+    AFTER INSERT OR DELETE ON ai_tasks
+    FOR EACH ROW EXECUTE FUNCTION track_ai_task_counters();
+
+-- Only status/ownership changes move counters; progress and heartbeat updates don't
+CREATE TRIGGER track_ai_task_counters_update
+    AFTER UPDATE OF status, type, user_id, team_id ON ai_tasks
+    FOR EACH ROW
+    WHEN (OLD.status IS DISTINCT FROM NEW.status
+          OR OLD.type IS DISTINCT FROM NEW.type
+          OR OLD.user_id IS DISTINCT FROM NEW.user_id
+          OR OLD.team_id IS DISTINCT FROM NEW.team_id)
+    EXECUTE FUNCTION track_ai_task_counters();
+
+-- Backfill counters for tasks created before the triggers existed
+INSERT INTO ai_task_counters (scope, scope_id, type, status, count)
+SELECT 'user', user_id, type, status, COUNT(*) FROM ai_tasks GROUP BY user_id, type, status
+UNION ALL
+SELECT 'team', team_id, type, status, COUNT(*) FROM ai_tasks WHERE team_id IS NOT NULL GROUP BY team_id, type, status
+ON CONFLICT (scope, scope_id, type, status) DO UPDATE SET count = EXCLUDED.count;
+
+-- User stats: apply coalesced increments atomically (no read-then-write).
+-- p_deltas: [{"user_id": ..., "tasks_completed": n, "credits_used": n}, ...]
+CREATE OR REPLACE FUNCTION increment_user_stats(p_deltas JSONB)
+RETURNS VOID AS $$
+    UPDATE users u
+    SET total_tasks_completed = u.total_tasks_completed + d.tasks_completed,
+        total_credits_used = u.total_credits_used + d.credits_used
+    FROM jsonb_to_recordset(p_deltas) AS d(user_id UUID, tasks_completed INTEGER, credits_used INTEGER)
+    WHERE u.id = d.user_id;
+$$ LANGUAGE sql;
+
+-- Task durations: fold samples into the EWMA / p50 / p90 of their model's row
+-- and of the all-models row, in order (same arithmetic as DurationStats.update).
+-- p_samples: [{"type": ..., "category": ..., "model": ..., "value": seconds}, ...]
+CREATE OR REPLACE FUNCTION record_ai_task_durations(
+    p_samples JSONB,
+    p_alpha DOUBLE PRECISION,
+    p_rate DOUBLE PRECISION
+)
+RETURNS VOID AS $$
+DECLARE
+    v_sample RECORD;
+    v_model TEXT;
+BEGIN
+    FOR v_sample IN
+        SELECT * FROM jsonb_to_recordset(p_samples) AS s(type TEXT, category TEXT, model TEXT, value DOUBLE PRECISION)
+    LOOP
+        FOR v_model IN SELECT DISTINCT m FROM unnest(ARRAY[COALESCE(v_sample.model, ''), '']) AS m LOOP
+            INSERT INTO ai_task_duration_stats AS d (type, category, model, samples, ewma, p50, p90)
+            VALUES (v_sample.type, v_sample.category, v_model, 1, v_sample.value, v_sample.value, v_sample.value)
+            ON CONFLICT (type, category, model) DO UPDATE SET
+                samples = d.samples + 1,
+                ewma = d.ewma + p_alpha * (v_sample.value - d.ewma),
+                p50 = d.p50 * (1 + p_rate * (0.5 - (v_sample.value < d.p50)::INTEGER)),
+                p90 = d.p90 * (1 + p_rate * (0.9 - (v_sample.value < d.p90)::INTEGER)),
+                updated_at = NOW();
+        END LOOP;
+    END LOOP;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Webhooks: count a failed delivery and deactivate the webhook once it has
+-- failed p_disable_after times in a row. Returns whether it is still active.
+CREATE OR REPLACE FUNCTION record_webhook_failure(p_webhook_id UUID, p_disable_after INTEGER)
+RETURNS BOOLEAN AS $$
+    UPDATE webhooks
+    SET failure_count = failure_count + 1,
+        is_active = is_active AND failure_count + 1 < p_disable_after
+    WHERE id = p_webhook_id
+    RETURNING is_active;
+$$ LANGUAGE sql;
+
+-- Result cache: drop expired entries, then the oldest beyond p_max_rows
+CREATE OR REPLACE FUNCTION prune_ai_result_cache(p_max_rows INTEGER)
+RETURNS INTEGER AS $$
+DECLARE
+    v_expired INTEGER;
+    v_evicted INTEGER;
+BEGIN
+    DELETE FROM ai_result_cache WHERE expires_at <= NOW();
+    GET DIAGNOSTICS v_expired = ROW_COUNT;
+
+    DELETE FROM ai_result_cache
+    WHERE cache_key IN (
+        SELECT cache_key FROM ai_result_cache
+        ORDER BY created_at DESC
+        OFFSET p_max_rows
+    );
+    GET DIAGNOSTICS v_evicted = ROW_COUNT;
+
+    RETURN v_expired + v_evicted;
+END;
+$$ LANGUAGE plpgsql;
+
 -- Add triggers for updated_at
 CREATE TRIGGER update_users_updated_at BEFORE UPDATE ON users FOR EACH ROW EXECUTE FUNCTION update_updated_at_column();
 CREATE TRIGGER update_teams_updated_at BEFORE UPDATE ON teams FOR EACH ROW EXECUTE FUNCTION update_updated_at_column();
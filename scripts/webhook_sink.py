@@ -0,0 +1,64 @@
+# WorkflowAI Webhook Sink
+"""
+Local receiver for testing webhook delivery.
+
+Prints every delivery and checks its signature when given the webhook's
+secret. ``--status`` / ``--delay`` make it answer with an error or slowly,
+to exercise retries, auto-disable and per-endpoint backpressure.
+
+Usage:
+    python scripts/webhook_sink.py --port 9000 --secret whsec_...
+    # then register http://localhost:9000/ with POST /webhooks
+    # (the API needs WEBHOOK_ALLOW_PRIVATE_URLS=true to call localhost)
+"""
+
+import argparse
+import hashlib
+import hmac
+import json
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def signature_valid(secret: str, header: str, body: bytes) -> bool:
+    try:
+        parts = dict(part.split("=", 1) for part in header.split(","))
+        expected = hmac.new(secret.encode(), f"{parts['t']}.".encode() + body, hashlib.sha256).hexdigest()
+    except (KeyError, ValueError):
+        return False
+    return hmac.compare_digest(expected, parts.get('v1', ''))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=9000)
+    parser.add_argument("--secret", help="webhook secret to verify X-WorkflowAI-Signature")
+    parser.add_argument("--status", type=int, default=200, help="status code to answer with")
+    parser.add_argument("--delay", type=float, default=0, help="seconds to wait before answering")
+    args = parser.parse_args()
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+            signature = self.headers.get('X-WorkflowAI-Signature', '')
+            verified = signature_valid(args.secret, signature, body) if args.secret else None
+            event = json.loads(body or b"{}")
+            print(json.dumps({
+                "delivery": self.headers.get('X-WorkflowAI-Delivery'),
+                "event": event.get('type'),
+                "signature_valid": verified,
+                "data": event.get('data')
+            }), flush=True)
+            time.sleep(args.delay)
+            self.send_response(args.status)
+            self.end_headers()
+
+        def log_message(self, format, *log_args):
+            pass
+
+    print(f"Webhook sink listening on http://localhost:{args.port}/", flush=True)
+    ThreadingHTTPServer(("", args.port), Handler).serve_forever()
+
+
+if __name__ == "__main__":
+    main()